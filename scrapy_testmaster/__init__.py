@@ -1,4 +1,18 @@
-from .middleware import TestMasterMiddleware
+import sys
 
 
 name = 'scrapy-testmaster'
+
+
+# The middleware, and with it Scrapy, is only imported once it's looked up
+# (as Scrapy does when loading 'scrapy_testmaster.TestMasterMiddleware'), so
+# that importing the CLI doesn't pay for it
+def __getattr__(attr):
+    if attr == 'TestMasterMiddleware':
+        from .middleware import TestMasterMiddleware
+        return TestMasterMiddleware
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
+
+
+if sys.version_info < (3, 7):  # no module __getattr__
+    from .middleware import TestMasterMiddleware  # noqa: F401
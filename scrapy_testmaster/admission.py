@@ -0,0 +1,396 @@
+import os
+import re
+import sys
+import random
+import hashlib
+import inspect
+from collections import Counter
+from itertools import count
+from urllib.parse import urlsplit
+
+from scrapy.utils.misc import load_object
+
+from .utils_novel import (
+    get_cb_settings,
+    load_view,
+    read_seen_counts,
+    write_seen_counts
+)
+
+
+# Admission policies decide, for each response seen by TestMasterMiddleware
+# during a crawl, whether it becomes a fixture and under which index.
+# `admit` returns that index (or None to drop the response), and
+# `view_fields` any extra fields to store alongside the fixture in view.json.
+# `result` is the processed callback output, as stored in the fixture, and
+# `url` that of the request. Policies that need to watch the callback run
+# return a context manager from `get_tracer`, which is active while the
+# callback output is drained. `close` is called when the spider closes.
+# `cancel`, if a policy has it, is called right after `admit` when the
+# response admitted isn't recorded after all (e.g. over the recording
+# budget): the policy should forget the fixture it expected, but keep
+# counting the response as seen.
+class RandomAdmission(object):
+    def __init__(self, settings):
+        self.settings = settings
+        self._undo = None
+
+    def get_tracer(self, spider, callback_name, test_dir):
+        return None
+
+    def admit(self, test_dir, callback_name, seen, max_fixtures, result,
+              tracer=None, url=None):
+        if seen < max_fixtures:
+            return seen + 1
+        r = random.randint(0, seen)
+        if r < max_fixtures:
+            return r + 1
+        return None
+
+    def view_fields(self, result, tracer=None):
+        return {}
+
+    # stored[index] = value, which `cancel` reverts
+    def _assign(self, stored, index, value):
+        self._undo = (stored, index, stored.get(index, _MISSING))
+        stored[index] = value
+
+    def cancel(self):
+        if self._undo is None:
+            return
+        stored, index, previous = self._undo
+        self._undo = None
+        if previous is _MISSING:
+            del stored[index]
+        else:
+            stored[index] = previous
+
+    def close(self):
+        pass
+
+
+_MISSING = object()
+
+
+def _first_free_index(stored):
+    return next(i for i in count(1) if i not in stored)
+
+
+def load_view_field(test_dir, field):
+    return {int(index): entry.get(field)
+            for index, entry in load_view(test_dir).items()}
+
+
+class CoverageTracer(object):
+    # Records which lines (or, at branch granularity, which line-to-line
+    # transitions) of the given source file get executed while active.
+    def __init__(self, filename, branch=False):
+        self.filename = filename
+        self.branch = branch
+        self.coverage = set()
+        self._last_lines = {}
+        self._previous = None
+
+    def _trace(self, frame, event, arg):
+        if frame.f_code.co_filename != self.filename:
+            return None
+        return self._trace_lines
+
+    def _trace_lines(self, frame, event, arg):
+        if event == 'line':
+            if self.branch:
+                last = self._last_lines.get(frame, -frame.f_code.co_firstlineno)
+                self.coverage.add((last, frame.f_lineno))
+                self._last_lines[frame] = frame.f_lineno
+            else:
+                self.coverage.add(frame.f_lineno)
+        return self._trace_lines
+
+    def __enter__(self):
+        self._previous = sys.gettrace()
+        sys.settrace(self._trace)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.settrace(self._previous)
+        self._last_lines = {}
+        return False
+
+
+# Keeps a response only if the callback covered something the stored fixtures
+# for it don't, or if its coverage strictly contains that of a stored fixture
+# (which it then replaces). Coverage is traced over the spider's own module
+# with settrace, for a sample of the responses once a callback has fixtures.
+# Tracing only sees the callback run while its output is drained, i.e. for
+# generator callbacks: those returning a list (or a single item or request)
+# are done by then, and with nothing traced, responses are admitted at random.
+class CoverageAdmission(RandomAdmission):
+    def __init__(self, settings):
+        super(CoverageAdmission, self).__init__(settings)
+        self.sample_rate = settings.getfloat(
+            'TESTMASTER_COVERAGE_SAMPLE_RATE', 0.1)
+        self.branch = settings.get(
+            'TESTMASTER_COVERAGE_GRANULARITY', 'line') == 'branch'
+        self.fixture_coverage = {}
+
+    def _load(self, test_dir, callback_name):
+        if callback_name in self.fixture_coverage:
+            return self.fixture_coverage[callback_name]
+        stored = {}
+        for index, coverage in load_view_field(test_dir, 'coverage').items():
+            # fixtures recorded without coverage count as covering nothing
+            stored[index] = frozenset(
+                tuple(c) if isinstance(c, list) else c for c in coverage or [])
+        self.fixture_coverage[callback_name] = stored
+        return stored
+
+    def get_tracer(self, spider, callback_name, test_dir):
+        stored = self._load(test_dir, callback_name)
+        if stored and random.random() >= self.sample_rate:
+            return None
+        try:
+            filename = inspect.getsourcefile(type(spider))
+        except TypeError:
+            return None
+        return CoverageTracer(os.path.abspath(filename), branch=self.branch)
+
+    def admit(self, test_dir, callback_name, seen, max_fixtures, result,
+              tracer=None, url=None):
+        if tracer is None:
+            return None
+        coverage = frozenset(tracer.coverage)
+        stored = self._load(test_dir, callback_name)
+        if not coverage:
+            index = super(CoverageAdmission, self).admit(
+                test_dir, callback_name, seen, max_fixtures, result)
+            if index is not None:
+                self._assign(stored, index, coverage)
+            return index
+        known = frozenset().union(*stored.values())
+
+        index = None
+        if coverage - known and len(stored) < max_fixtures:
+            index = _first_free_index(stored)
+        else:
+            contained = [i for i, c in stored.items() if c < coverage]
+            if contained:
+                index = min(contained, key=lambda i: (len(stored[i]), i))
+        if index is not None:
+            self._assign(stored, index, coverage)
+        return index
+
+    def view_fields(self, result, tracer=None):
+        if tracer is None:
+            return {}
+        return {'coverage': sorted(
+            list(c) if isinstance(c, tuple) else c for c in tracer.coverage)}
+
+
+def _is_empty(value):
+    return value is None or (
+        isinstance(value, (str, bytes, list, tuple, dict)) and not value)
+
+
+# A cheap signature of the "shape" of a callback's output: for each item, the
+# fields present with their value types and whether they are empty; the item
+# and request counts, bucketed by powers of two; and the callbacks of the
+# requests emitted.
+def result_shape(result):
+    item_shapes = set()
+    callbacks = set()
+    num_items = num_requests = 0
+    for entry in result:
+        data = entry['data']
+        if entry['type'] == 'request':
+            num_requests += 1
+            callbacks.add(str(data.get('callback')))
+        else:
+            num_items += 1
+            if hasattr(data, 'items'):
+                item_shapes.add(tuple(sorted(
+                    (str(k), type(v).__name__, _is_empty(v))
+                    for k, v in data.items())))
+            else:
+                item_shapes.add(type(data).__name__)
+    signature = (
+        sorted(item_shapes, key=repr),
+        num_items.bit_length(),
+        num_requests.bit_length(),
+        sorted(callbacks),
+    )
+    return hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:16]
+
+
+# Admits responses whose output has a shape not yet stored for the callback,
+# and drops repeats of known shapes. Once the callback is full, a new shape
+# replaces a fixture recorded without a shape, or else one of the fixtures
+# of the most repeated shape.
+class NoveltyAdmission(RandomAdmission):
+    def __init__(self, settings):
+        super(NoveltyAdmission, self).__init__(settings)
+        self.fixture_shapes = {}
+
+    def _load(self, test_dir, callback_name):
+        if callback_name not in self.fixture_shapes:
+            self.fixture_shapes[callback_name] = load_view_field(test_dir, 'shape')
+        return self.fixture_shapes[callback_name]
+
+    def admit(self, test_dir, callback_name, seen, max_fixtures, result,
+              tracer=None, url=None):
+        shape = result_shape(result)
+        stored = self._load(test_dir, callback_name)
+        if shape in stored.values():
+            return None
+
+        index = None
+        if len(stored) < max_fixtures:
+            index = _first_free_index(stored)
+        else:
+            unknown = [i for i, s in stored.items() if s is None]
+            shape_counts = Counter(s for s in stored.values() if s is not None)
+            if unknown:
+                index = min(unknown)
+            elif shape_counts and max(shape_counts.values()) > 1:
+                most_common = shape_counts.most_common(1)[0][0]
+                index = max(i for i, s in stored.items() if s == most_common)
+        if index is not None:
+            self._assign(stored, index, shape)
+        return index
+
+    def view_fields(self, result, tracer=None):
+        return {'shape': result_shape(result)}
+
+
+TEMPLATE_COUNTS_FILE = 'templates.json'
+_ID_SEGMENT_RE = re.compile(r'\d')
+
+
+# The template of a URL: the first of `patterns` (regexes) found in it, or
+# else its path, with the segments holding digits (ids, dates, page numbers)
+# replaced by <id>
+def url_template(url, patterns=()):
+    for pattern in patterns:
+        if re.search(pattern, url):
+            return pattern
+    segments = urlsplit(url).path.split('/')
+    return '/'.join('<id>' if _ID_SEGMENT_RE.search(segment) else segment
+                    for segment in segments) or '/'
+
+
+def _local_or_global(cb_settings, settings, name, default=None):
+    local = getattr(cb_settings, name, None)
+    if local is not None and local != []:
+        return local
+    return settings.get('TESTMASTER_' + name, default)
+
+
+class _Strata(object):
+    # The fixtures of a callback by URL template, and the responses seen for
+    # each template over all crawls (in templates.json in the callback dir)
+    def __init__(self, test_dir, cb_settings, settings):
+        self.test_dir = test_dir
+        self.patterns = _local_or_global(cb_settings, settings, 'URL_TEMPLATES', [])
+        self.min_fixtures = int(_local_or_global(
+            cb_settings, settings, 'MIN_FIXTURES_PER_TEMPLATE', 1))
+        self.max_fixtures = _local_or_global(
+            cb_settings, settings, 'MAX_FIXTURES_PER_TEMPLATE')
+        self.stored = {}
+        for index, request in load_view_field(test_dir, 'request').items():
+            url = request.get('url') if isinstance(request, dict) else None
+            self.stored[index] = url_template(url, self.patterns) if url else None
+        self.initial = read_seen_counts(test_dir, TEMPLATE_COUNTS_FILE)
+        for template, num in Counter(self.stored.values()).items():
+            if template is not None:
+                # fixtures recorded before the counts were kept
+                self.initial.setdefault(template, num)
+        self.seen = dict(self.initial)
+
+    def indices(self, template):
+        return sorted(i for i, t in self.stored.items() if t == template)
+
+    def quota(self, template, max_fixtures):
+        # min_fixtures, plus a share of the slots not set aside for the
+        # minimums in proportion to the responses seen, up to max_fixtures
+        if template is None:
+            return 0
+        spare = max(max_fixtures - self.min_fixtures * len(self.seen), 0)
+        quota = self.min_fixtures + \
+            spare * self.seen.get(template, 0) // sum(self.seen.values())
+        if self.max_fixtures:
+            quota = min(quota, int(self.max_fixtures))
+        return quota
+
+    def evictable(self, max_fixtures):
+        # a fixture of the template most over its quota, if any is
+        excess = {t: len(self.indices(t)) - self.quota(t, max_fixtures)
+                  for t in set(self.stored.values())}
+        template = max(excess, key=lambda t: (excess[t], t is None, str(t)))
+        if excess[template] <= 0:
+            return None
+        return random.choice(self.indices(template))
+
+    def save(self):
+        if self.seen != self.initial:
+            write_seen_counts(self.test_dir, self.initial, self.seen,
+                              TEMPLATE_COUNTS_FILE)
+            self.initial = dict(self.seen)
+
+
+# Random replacement within strata: the responses of a callback are grouped
+# by URL template, each with its own reservoir. Free slots go to any template
+# (up to an optional maximum per template). Once the callback is full, each
+# template has a quota: a minimum (1 by default), so that rare templates are
+# always represented, plus a share of the other slots in proportion to the
+# responses seen. A template under its quota takes the slot of a fixture from
+# the template most over its own.
+class StratifiedAdmission(RandomAdmission):
+    def __init__(self, settings):
+        super(StratifiedAdmission, self).__init__(settings)
+        self.strata = {}
+
+    def _load(self, test_dir, callback_name):
+        if callback_name not in self.strata:
+            self.strata[callback_name] = _Strata(
+                test_dir, get_cb_settings(test_dir), self.settings)
+        return self.strata[callback_name]
+
+    def admit(self, test_dir, callback_name, seen, max_fixtures, result,
+              tracer=None, url=None):
+        strata = self._load(test_dir, callback_name)
+        template = url_template(url or '', strata.patterns)
+        seen_template = strata.seen[template] = strata.seen.get(template, 0) + 1
+        stored = strata.indices(template)
+
+        index = None
+        under_max = not strata.max_fixtures or len(stored) < int(strata.max_fixtures)
+        if under_max and len(strata.stored) < max_fixtures:
+            index = _first_free_index(strata.stored)
+        elif len(stored) < strata.quota(template, max_fixtures):
+            index = strata.evictable(max_fixtures)
+        if index is None and stored:
+            r = random.randint(0, seen_template - 1)
+            if r < len(stored):
+                index = stored[r]
+        if index is not None:
+            self._assign(strata.stored, index, template)
+        return index
+
+    def close(self):
+        for strata in self.strata.values():
+            strata.save()
+
+
+ADMISSION_POLICIES = {
+    'random': RandomAdmission,
+    'coverage': CoverageAdmission,
+    'novelty': NoveltyAdmission,
+    'stratified': StratifiedAdmission,
+}
+
+
+def get_admission_policy(settings):
+    name = settings.get('TESTMASTER_ADMISSION', 'random')
+    policy_cls = ADMISSION_POLICIES.get(name)
+    if policy_cls is None:
+        policy_cls = load_object(name)
+    return policy_cls(settings)
@@ -0,0 +1,104 @@
+import os
+import time
+from collections import deque
+
+MB = 1024 * 1024
+# fixture writes held back by the write rate budget before responses are
+# skipped altogether
+MAX_DEFERRED_WRITES = 32
+
+
+def disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class TokenBucket(object):
+    # Refills at `rate` bytes per second up to `capacity`. A write is allowed
+    # as long as the bucket isn't in debt, and may take it into debt (so a
+    # fixture larger than the bucket doesn't block recording for good).
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self):
+        self._refill()
+        return self.tokens > 0
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+
+# Budgets for the fixtures written by `scrapy crawl`: the disk space taken by
+# the fixtures under base_path/tests, and the rate at which fixture bytes are
+# written. Responses are only offered to the admission policy if there is
+# room for them; over the write rate, admitted fixtures are encoded and held
+# back (up to MAX_DEFERRED_WRITES of them) until the bucket refills or the
+# spider closes. Both budgets may be overshot by one fixture.
+class RecordingBudget(object):
+    def __init__(self, tests_dir, max_disk_mb=None, max_write_mbps=None,
+                 clock=time.monotonic):
+        self.max_disk = max_disk_mb * MB if max_disk_mb else None
+        self.bucket = TokenBucket(max_write_mbps * MB, clock=clock) \
+            if max_write_mbps else None
+        self.used = disk_usage(tests_dir) if self.max_disk else 0
+        self.pending = deque()
+
+    @classmethod
+    def from_settings(cls, settings, tests_dir):
+        max_disk_mb = settings.getfloat('TESTMASTER_MAX_DISK_MB', 0)
+        max_write_mbps = settings.getfloat('TESTMASTER_MAX_WRITE_MBPS', 0)
+        if not max_disk_mb and not max_write_mbps:
+            return None
+        return cls(tests_dir, max_disk_mb, max_write_mbps)
+
+    def _pending_bytes(self):
+        return sum(size for size, _ in self.pending)
+
+    def check(self):
+        # -> None if a new fixture may be recorded, or the budget it's over
+        if self.max_disk and self.used + self._pending_bytes() >= self.max_disk:
+            return 'disk_quota'
+        queue_full = len(self.pending) >= MAX_DEFERRED_WRITES
+        if queue_full and not self.bucket.ready():
+            return 'write_rate'
+        return None
+
+    def write(self, size, write):
+        # -> whether `write` (of `size` bytes) was called, or deferred
+        if self.pending or (self.bucket is not None and not self.bucket.ready()):
+            self.pending.append((size, write))
+            return False
+        self._write(size, write)
+        return True
+
+    def _write(self, size, write):
+        # `write` returns the size of what it replaced
+        replaced = write()
+        self.used += size - (replaced or 0)
+        if self.bucket is not None:
+            self.bucket.consume(size)
+
+    def flush(self, force=False):
+        # -> the number of deferred writes done
+        done = 0
+        while self.pending and (force or self.bucket.ready()):
+            self._write(*self.pending.popleft())
+            done += 1
+        return done
@@ -2,46 +2,28 @@ import re
 import os
 import sys
 import json
-import scrapy
 import argparse
-from glob import glob
-from datetime import datetime
-from w3lib.url import is_url
-
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import inside_project, get_project_settings
-from scrapy.utils.python import to_unicode
-from scrapy.utils.reqser import request_from_dict
-from scrapy.commands.genspider import sanitize_module_name
-
-from scrapy_testmaster.utils import (
-    add_sample,
-    auto_import,
-    unpickle_data,
-    decompress_data,
-    get_or_create_test_dir,
+
+from scrapy_testmaster.project import (
     get_project_dirs,
-    parse_callback_result,
-    prepare_callback_replay,
-    process_result,
-    erase_special_metakeys
+    inside_project,
+    read_project_settings,
+    sanitize_module_name
 )
 from scrapy_testmaster.utils_novel import (
     cascade_fixtures,
     get_callbacks,
-    get_cb_settings,
+    get_or_create_test_dir,
     get_test_paths,
-    write_config,
-    get_homepage_cookies,
-    trigger_requests,
-    get_reqs_to_add,
-    get_reqs_multiple,
-    validate_results
-)
-from .parse import (
-    process_options,
-    run_command
+    to_jsonable,
+    write_config
 )
+from .storage import get_storage, load_fixture_data
+
+# Commands that only deal with fixture files, and so run without importing
+# Scrapy. The others import what they need when they run (see
+# tests/test_startup.py for the import budget).
+METADATA_COMMANDS = ('inspect', 'clear', 'establish')
 
 
 class CommandLine:
@@ -54,8 +36,8 @@ class CommandLine:
 
         self.command = self.args.command
 
-        self.spider = sanitize_module_name(self.args.spider) if \
-            self.args.spider else None
+        spider = getattr(self.args, 'spider', None)
+        self.spider = sanitize_module_name(spider) if spider else None
         try:
             self.callback = self.args.callback
         except AttributeError:
@@ -81,22 +63,44 @@ class CommandLine:
         if self.fixture and not self.callback:
             self.error("Can't specify a fixture without a callback")
 
+        if self.callback and not self.spider:
+            self.error("Can't specify a callback without a spider")
+
         self.project_dir, self.project_name = get_project_dirs()
         sys.path.append(self.project_dir)
 
-        self.settings = get_project_settings()
+        if self.command in METADATA_COMMANDS:
+            self.settings = read_project_settings()
+        else:
+            from scrapy.utils.project import get_project_settings
+            self.settings = get_project_settings()
 
         if self.command == "parse":
-            url_list = [url.strip() for url in self.args.urls.split('|')]
-            for url in url_list:
-                if not is_url(url):
-                    self.error("Something went wrong with your urls arg! "
-                               "Note that as of version 1.0, the character for separating "
-                               "multiple urls is '|', as opposed to ','")
+            from w3lib.url import is_url
+            from scrapy.crawler import CrawlerProcess
+            from .parse import (
+                iter_url_specs,
+                process_options,
+                read_urls_file,
+                run_command
+            )
+
+            if self.args.urls_file:
+                url_specs = iter_url_specs(read_urls_file(self.args.urls_file))
+            elif self.args.urls:
+                url_list = [url.strip() for url in self.args.urls.split('|')]
+                for url in url_list:
+                    if not is_url(url):
+                        self.error("Something went wrong with your urls arg! "
+                                   "Note that as of version 1.0, the character for separating "
+                                   "multiple urls is '|', as opposed to ','")
+                url_specs = [{'url': url} for url in url_list]
+            else:
+                self.error("Pass either a urls arg or --urls-file")
 
             self.args = process_options(self.args)
             crawler_process = CrawlerProcess(self.settings)
-            run_command(crawler_process, url_list, self.args)
+            run_command(crawler_process, url_specs, self.args)
 
         else:
             self.base_path = self.settings.get(
@@ -104,14 +108,22 @@ class CommandLine:
                 default=os.path.join(self.project_dir, 'testmaster'))
             self.tests_dir = os.path.join(self.base_path, 'tests')
 
-            self.spider_dir = os.path.join(self.tests_dir, self.spider)
+            if self.spider:
+                self.spider_dir = os.path.join(self.tests_dir, self.spider)
+            elif self.command in ('test', 'serve', 'merge'):
+                self.spider_dir = self.tests_dir
+            else:
+                self.error("A spider must be specified")
 
-            if not os.path.isdir(self.spider_dir) and self.command != "establish":
+            if not os.path.isdir(self.spider_dir) and \
+                    self.command not in ("establish", "merge"):
                 self.error(
                     "No recorded data found "
                     "for spider '{}'".format(self.spider))
 
             self.extra_path = self.settings.get('TESTMASTER_EXTRA_PATH') or ''
+            self.write_test_modules = self.settings.getbool(
+                'TESTMASTER_WRITE_TEST_MODULES', default=True)
             if self.callback:
                 self.callback_dir = os.path.join(
                     self.spider_dir, self.extra_path, self.callback)
@@ -131,7 +143,7 @@ class CommandLine:
             if self.fixture:
                 self.fixture_path = os.path.join(self.callback_dir,
                                                  self.parse_fixture_arg())
-                if not os.path.isfile(self.fixture_path):
+                if not get_storage().exists(self.fixture_path):
                     self.error("Fixture '{}' not found".format(self.fixture_path))
 
     def error(self, msg):
@@ -149,107 +161,144 @@ class CommandLine:
         return self.fixture
 
     def parse_data(self, data):
-        if isinstance(data, (dict, scrapy.Item)):
-            return {
-                self.parse_data(k): self.parse_data(v)
-                for k, v in data.items()
-            }
-        elif isinstance(data, list):
-            return [self.parse_data(x) for x in data]
-        elif isinstance(data, bytes):
-            return to_unicode(data)
-        elif isinstance(data, datetime):
-            return data.isoformat()
-        elif isinstance(data, (int, float)):
-            return data
-        return str(data)
+        return to_jsonable(data)
 
     def get_fixture_data(self):
-        with open(self.fixture_path, 'rb') as f:
-            raw_data = f.read()
-        fixture_info = unpickle_data(decompress_data(raw_data), 'utf-8')
-        if 'fixture_version' in fixture_info:
-            encoding = fixture_info['encoding']
-            data = unpickle_data(fixture_info['data'], encoding)
-        else:
-            data = fixture_info  # legacy tests (not all will work, just utf-8)
-        return data
+        # legacy tests (not all will work, just utf-8)
+        return load_fixture_data(self.fixture_path)
 
     def inspect(self):
         data = self.parse_data(self.get_fixture_data())
         print(json.dumps(data))
 
     def update(self):
+        import tempfile
+        from scrapy.crawler import CrawlerProcess
+        from scrapy.utils.reqser import request_from_dict
+        from .drift import DriftReport, read_spool, run_static_updates
+        from .utils import erase_special_metakeys, prepare_callback_replay
+        from .utils_novel import (
+            get_homepage_cookies,
+            get_reqs_multiple,
+            get_reqs_to_add,
+            trigger_requests
+        )
+
         to_update = []
         if self.fixture:
             to_update.append(self.fixture_path)
         elif not self.fixture and self.callback:
-            target = os.path.join(self.callback_dir, "*.bin")
-            to_update = glob(target)
+            to_update = list(get_storage().iter_paths(
+                self.callback_dir, recursive=False))
         # == if not self.callback
         else:
             spider_path = os.path.join(self.project_dir, self.project_name,
                                        'spiders/' + self.spider + '.py')
             to_update = get_test_paths(self.spider_dir, spider_path, self.extra_path, True)
 
-        req_list = []
+        dry_run = self.args.dry_run
+        report = DriftReport()
+        # fixtures that couldn't be updated make the command fail, unless
+        # it's only a dry run
+        failed = False
+
+        if not self.dynamic:
+            # static updates re-run the callbacks on the stored responses,
+            # in parallel across fixtures
+            for record in run_static_updates(to_update, self.settings,
+                                             write=not dry_run,
+                                             processes=self.args.processes):
+                report.add(record)
+                if self.print_update_record(record, dry_run):
+                    failed = True
 
-        homepage_cookies = {}
-        i = 0
-        for path in to_update:
-            data, _, spider, _ = prepare_callback_replay(path)
-            if (self.dynamic or self.new) and i == 0:
-                homepage_cookies = get_homepage_cookies(spider)
-                i += 1
-
-            request = request_from_dict(data['request'], spider)
-            if homepage_cookies:
-                request.cookies = homepage_cookies
-            fixture_dir, filename = os.path.split(path)
-            fixture_index = re.search(r"\d+", filename).group()
-            if self.dynamic:
+        req_list = []
+        spool_path = None
+        if self.dynamic or self.new:
+            homepage_cookies = {}
+            i = 0
+            # only the spider is needed from the fixtures for --new alone
+            for path in to_update if self.dynamic else to_update[:1]:
+                data, _, spider, _ = prepare_callback_replay(path)
+                if i == 0:
+                    homepage_cookies = get_homepage_cookies(spider)
+                    i += 1
+                if not self.dynamic:
+                    break
+
+                request = request_from_dict(data['request'], spider)
+                if homepage_cookies:
+                    request.cookies = homepage_cookies
+                fixture_index = re.search(r"\d+", os.path.basename(path)).group()
                 request = erase_special_metakeys(request)
                 request.meta['_update'] = 1
                 request.meta['_fixture'] = fixture_index
                 req_list.append(request)
-            else:
-                response_cls = auto_import(
-                    data['response'].pop('cls', 'scrapy.http.HtmlResponse')
-                )
-                response = response_cls(
-                    request=request, **data['response'])
-
-                cb_settings = get_cb_settings(fixture_dir)
-                data['result'], _ = parse_callback_result(
-                    request.callback(response), spider, cb_settings
-                )
-                items_out, requests_out = process_result(
-                    data['result'], spider.settings, cb_settings)
-                validate_results(fixture_dir, spider.settings, items_out,
-                                 requests_out, data['request']['url'])
-
-                add_sample(fixture_index, fixture_dir, filename, data)
-
-                print("Fixture '{}' successfully updated.".format(
-                    os.path.relpath(path)))
-        if self.dynamic or self.new:
+
             crawler_process = CrawlerProcess(self.settings)
             if self.callback:
                 # add any requests specified in REQUESTS_TO_ADD in config.py
                 req_list += get_reqs_to_add(self.callback_dir, spider)
-                trigger_requests(crawler_process, spider, req_list)
             else:
                 # finds all paths to all config.py files for the spider
                 # potentially adding a whole lot of requests from the REQUESTS_TO_ADD fields in these
                 to_add = get_test_paths(self.spider_dir, spider_path, self.extra_path)
                 req_list += get_reqs_multiple(to_add, spider)
+            if dry_run or self.args.report:
+                # the middleware reports on each response in a spool file
+                fd, spool_path = tempfile.mkstemp(suffix='.jsonl')
+                os.close(fd)
+                for request in req_list:
+                    request.meta['_drift_spool'] = spool_path
+                    if dry_run:
+                        request.meta['_dry_run'] = 1
+            try:
                 trigger_requests(crawler_process, spider, req_list)
+                for record in read_spool(spool_path) if spool_path else []:
+                    report.add(record)
+                    if dry_run:
+                        self.print_update_record(record, dry_run)
+                    elif 'error' in record or 'invalid' in record:
+                        failed = True
+            finally:
+                if spool_path:
+                    os.remove(spool_path)
+
+        if self.args.report:
+            print(report.format() or "Nothing was updated.")
+            if self.args.report != '-':
+                with open(self.args.report, 'w') as f:
+                    json.dump(report.to_dict(), f, indent=2, sort_keys=True)
+
+        if failed and not dry_run:
+            sys.exit(1)
+
+    # Returns True if the fixture couldn't be updated
+    def print_update_record(self, record, dry_run):
+        from .drift import is_changed
+        path = os.path.relpath(record['path'])
+        if 'error' in record:
+            print("Fixture '{}' could not be updated: {}".format(path, record['error']))
+            return True
+        if 'invalid' in record:
+            print("Fixture '{}' not updated, the new result is invalid: {}".format(
+                path, record['invalid']))
+            return True
+        if not dry_run:
+            print("Fixture '{}' successfully updated.".format(path))
+        elif record.get('new'):
+            print("Fixture '{}' would be added.".format(path))
+        elif is_changed(record['diff']):
+            print("Fixture '{}' would change.".format(path))
+        else:
+            print("Fixture '{}' is unchanged.".format(path))
 
     def establish(self):
         did_something = False
         if self.callback:
             if not os.path.exists(self.callback_dir):
-                get_or_create_test_dir(self.base_path, self.spider, self.callback, self.extra_path)
+                get_or_create_test_dir(self.base_path, self.spider, self.callback, self.extra_path,
+                                       init_files=self.write_test_modules)
                 write_config(self.callback_dir)
                 did_something = True
         else:
@@ -261,7 +310,8 @@ class CommandLine:
                 cb_exists = False
                 if os.path.exists(callback_dir):
                     cb_exists = True
-                get_or_create_test_dir(self.base_path, self.spider, callback, self.extra_path)
+                get_or_create_test_dir(self.base_path, self.spider, callback, self.extra_path,
+                                       init_files=self.write_test_modules)
                 if not cb_exists:
                     write_config(callback_dir)
                     did_something = True
@@ -276,9 +326,178 @@ class CommandLine:
         min_fixture = min(int(f) for f in self.fixtures)
         for f in self.fixtures:
             dead_path = os.path.join(self.callback_dir, f'fixture{f}.bin')
-            os.remove(dead_path)
+            get_storage().delete(dead_path)
         cascade_fixtures(self.callback_dir, min_fixture)
 
+    def test(self):
+        from .replay import (
+            assign_shards,
+            iter_fixture_paths,
+            parse_shard_arg,
+            run_fixtures
+        )
+
+        if self.fixture:
+            fixture_paths = [self.fixture_path]
+        elif self.callback:
+            fixture_paths = list(iter_fixture_paths(self.callback_dir))
+        else:
+            fixture_paths = list(iter_fixture_paths(self.spider_dir))
+
+        if self.args.shard:
+            try:
+                index, total = parse_shard_arg(self.args.shard)
+            except ValueError as e:
+                self.error(str(e))
+            fixture_paths = assign_shards(fixture_paths, total)[index - 1]
+            print("Shard {}/{}: {} fixture(s)".format(
+                index, total, len(fixture_paths)))
+
+        if self.args.server:
+            sys.exit(self.test_on_server(fixture_paths))
+        result = run_fixtures(fixture_paths,
+                              record_timings=not self.args.no_timings,
+                              collect_all=self.args.collect_all)
+        sys.exit(0 if result.wasSuccessful() else 1)
+
+    def test_on_server(self, fixture_paths):
+        from .replay import save_fixture_timings
+        from .server import ReplayClient, default_socket_path
+
+        client = ReplayClient(default_socket_path(self.project_dir))
+        try:
+            response = client.request(
+                'replay', paths=[os.path.abspath(p) for p in fixture_paths],
+                collect_all=self.args.collect_all)
+        except (OSError, ValueError):
+            self.error("No testmaster server running for this project "
+                       "(start one with 'testmaster serve')")
+        if not response['ok']:
+            self.error(response['error'])
+        if response['reloaded']:
+            print("Reloaded {}".format(', '.join(response['reloaded'])))
+
+        failures = 0
+        for result in response['results']:
+            print("{} ... {} ({:.1f} ms)".format(
+                result['id'], result['outcome'], result['duration'] * 1000))
+            if result['outcome'] != 'passed':
+                failures += 1
+                print(result['message'])
+        print("Ran {} fixture(s), {} failed.".format(
+            len(response['results']), failures))
+        if not self.args.no_timings:
+            save_fixture_timings({r['path']: r['duration']
+                                  for r in response['results']})
+        return 1 if failures else 0
+
+    def serve(self):
+        from .server import ReplayServer, default_socket_path
+
+        socket_path = self.args.socket or default_socket_path(self.project_dir)
+        try:
+            server = ReplayServer(socket_path, self.project_dir, self.tests_dir)
+        except (OSError, ValueError) as e:
+            self.error(str(e))
+        print("Serving fixture replays for '{}' on {}".format(
+            self.project_name, socket_path))
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+
+    def minimize(self):
+        from .minimize import FixtureMinimizer
+        from .replay import iter_fixture_paths
+
+        if self.fixture:
+            fixture_paths = [self.fixture_path]
+        else:
+            fixture_paths = list(iter_fixture_paths(self.callback_dir))
+
+        total_before = total_after = 0
+        for path in fixture_paths:
+            name = os.path.relpath(path)
+            minimizer = FixtureMinimizer(path)
+            body = minimizer.data['response']['body']
+            try:
+                minimized = minimizer.minimize()
+            except ValueError as e:
+                print("Fixture '{}' left as is: {}.".format(name, e))
+                continue
+            total_before += len(body)
+            if len(minimized) >= len(body):
+                total_after += len(body)
+                print("Fixture '{}' is already minimal ({} replays).".format(
+                    name, minimizer.replays))
+                continue
+            total_after += len(minimized)
+
+            time_before = minimizer.replay_time(body)
+            time_after = minimizer.replay_time(minimized)
+            if not self.args.dry_run:
+                minimizer.save(minimized)
+            print("Fixture '{}' minimized in {} replays: body {} -> {} bytes "
+                  "({:.0%} smaller), replay {:.1f} -> {:.1f} ms ({:.0%} faster).".format(
+                      name, minimizer.replays, len(body), len(minimized),
+                      1 - len(minimized) / len(body),
+                      time_before * 1000, time_after * 1000,
+                      1 - time_after / time_before if time_before else 0))
+
+        if total_before:
+            print("Total: {} -> {} bytes ({:.0%} smaller){}.".format(
+                total_before, total_after, 1 - total_after / total_before,
+                " (dry run, nothing written)" if self.args.dry_run else ""))
+
+    def export(self):
+        from .export import export_items
+        from .fixtures import query as query_fixtures
+
+        output = self.args.output or '{}.{}'.format(
+            '_'.join(filter(None, [self.spider, self.callback])),
+            self.args.format)
+        fixture_iter = query_fixtures(spider=self.spider, callback=self.callback,
+                                      settings=self.settings)
+        try:
+            num_rows, schema = export_items(
+                fixture_iter, output, self.args.format,
+                processes=self.args.processes, settings=self.settings)
+        except ImportError:
+            self.error("Exporting to parquet requires pyarrow "
+                       "(pip install scrapy-testmaster[parquet])")
+        print("Exported {} items with {} columns to '{}'.".format(
+            num_rows, len(schema.columns), output))
+
+    def watch(self):
+        from .watch import Watcher, find_callback_dirs
+
+        callback_dirs = find_callback_dirs(
+            self.spider_dir, self.extra_path, self.callback)
+        if not callback_dirs:
+            self.error("No callbacks found for spider '{}'".format(self.spider))
+        print("Watching {} for changes (Ctrl-C to stop)".format(
+            ', '.join(sorted(callback_dirs))))
+        try:
+            Watcher(callback_dirs, self.project_dir).run(self.args.interval)
+        except KeyboardInterrupt:
+            pass
+
+    def merge(self):
+        from .merge import find_spools, merge_spools
+
+        spools = find_spools(self.args.spools)
+        if not spools:
+            self.error("No spools found in {}".format(', '.join(self.args.spools)))
+        print("Merging {} spool(s) into '{}'".format(
+            len(spools), os.path.relpath(self.tests_dir)))
+        records = merge_spools(self.tests_dir, spools, self.settings,
+                               processes=self.args.processes,
+                               keep=self.args.keep)
+        for record in records:
+            print("{callback}: {before} -> {after} fixture(s) ({added} added, "
+                  "{dropped} dropped, {duplicates} duplicates)".format(**record))
+        print("Merged {} callback(s).".format(len(records)))
+
     def parse_command(self):
         if self.command == "inspect":
             self.inspect()
@@ -288,6 +507,18 @@ class CommandLine:
             self.establish()
         elif self.command == "clear":
             self.clear()
+        elif self.command == "test":
+            self.test()
+        elif self.command == "minimize":
+            self.minimize()
+        elif self.command == "export":
+            self.export()
+        elif self.command == "serve":
+            self.serve()
+        elif self.command == "watch":
+            self.watch()
+        elif self.command == "merge":
+            self.merge()
 
 
 def main():
@@ -301,7 +532,12 @@ def main():
         description="Downloads and parses n requests up to depth d with different "
                     "urls but the same attributes otherwise",
         formatter_class=argparse.RawTextHelpFormatter)
-    parse_cmd.add_argument("urls", help="urls separated by '|'")
+    parse_cmd.add_argument("urls", nargs="?", help="urls separated by '|'")
+    parse_cmd.add_argument(
+        "--urls-file", dest="urls_file",
+        help="read urls from this file ('-' for stdin), one per line, either\n"
+             "as plain urls or as JSON objects with a \"url\" key and any of\n"
+             "\"meta\", \"cb_kwargs\" and \"callback\"")
     parse_cmd.add_argument(
         "--spider", dest="spider",
         help="use this spider without looking for one")
@@ -341,6 +577,14 @@ def main():
     parse_cmd.add_argument(
         "-v", "--verbose", dest="verbose", action="store_true",
         help="print each depth level one by one")
+    parse_cmd.add_argument(
+        "--jsonl", dest="jsonl", action="store_true",
+        help="write each item and request as a JSON line to stdout as soon\n"
+             "as its callback yields it, instead of printing everything at the end")
+    parse_cmd.add_argument(
+        "--spill-mb", dest="spill_mb", type=float,
+        help="spill the collected results to a temporary file once they\n"
+             "take up more than this many MB in memory")
     parse_cmd.add_argument(
         "--headers", dest="headers",
         help="inject extra headers, it must be a valid raw json string")
@@ -374,6 +618,13 @@ def main():
                             help=("Include this to re-download the response."))
     update_cmd.add_argument('--new', action="store_true",
                             help=("Downloads requests from REQUESTS_TO_ADD"))
+    update_cmd.add_argument('--dry-run', dest='dry_run', action="store_true",
+                            help=("Re-run the callbacks without writing any fixtures."))
+    update_cmd.add_argument('--report', nargs='?', const='-', help=(
+        "Print a report of what changed, per callback and per item field.\n"
+        "If a file is given, the report is also written to it as JSON."))
+    update_cmd.add_argument('--processes', type=int, help=(
+        "The number of processes for static updates [default: the number of CPUs]."))
 
     establish_cmd = subparsers.add_parser(
         'establish',
@@ -398,5 +649,99 @@ def main():
         "The fixtures to be cleared, listed in terms of their number, each"
         "separated by a comma."))
 
+    test_cmd = subparsers.add_parser(
+        'test',
+        description="Replays fixtures, optionally only those of one shard out of N "
+                    "balanced on how long each fixture took to replay last time",
+        formatter_class=argparse.RawTextHelpFormatter)
+    test_cmd.add_argument('spider', nargs='?', help=(
+        "The spider to test. If not specified, all spiders are tested."))
+    test_cmd.add_argument('-c', '--callback', help="The callback to test.")
+    test_cmd.add_argument('-f', '--fixture', help=(
+        "The fixture to test.\n"
+        "Can be the fixture number or the fixture name."))
+    test_cmd.add_argument('--shard', help=(
+        "Only run shard i out of N, given as i/N (e.g. 2/8). Fixtures are\n"
+        "assigned to shards by bin-packing on their recorded replay durations\n"
+        "(falling back to fixture size where there is no history)."))
+    test_cmd.add_argument('--no-timings', dest='no_timings', action='store_true',
+                          help="Don't record replay durations in timings.json.")
+    test_cmd.add_argument(
+        '--collect-all', dest='collect_all', nargs='?', type=int, const=True,
+        default=0, metavar='N', help=(
+            "Keep comparing the callback output after a mismatch and report up\n"
+            "to N mismatches per fixture (default 20), instead of stopping at\n"
+            "the first one."))
+    test_cmd.add_argument('--server', action='store_true', help=(
+        "Replay the fixtures in the running 'testmaster serve' process\n"
+        "instead of starting Scrapy up again."))
+
+    minimize_cmd = subparsers.add_parser(
+        'minimize',
+        description="Strips DOM subtrees from the response body of fixtures "
+                    "(by delta debugging) for as long as the callback output "
+                    "stays the same as recorded",
+        formatter_class=argparse.RawTextHelpFormatter)
+    minimize_cmd.add_argument('spider', help="The spider.")
+    minimize_cmd.add_argument('callback', help="The callback.")
+    minimize_cmd.add_argument('-f', '--fixture', help=(
+        "The fixture to minimize.\n"
+        "Can be the fixture number or the fixture name.\n"
+        "If not specified, all fixtures of the callback are minimized."))
+    minimize_cmd.add_argument('--dry-run', dest='dry_run', action='store_true',
+                              help="Report the reduction without rewriting fixtures.")
+
+    export_cmd = subparsers.add_parser(
+        'export',
+        description="Exports the items recorded in fixtures to a parquet, csv or "
+                    "jsonl file, with the spider, callback, fixture number and "
+                    "url of each item",
+        formatter_class=argparse.RawTextHelpFormatter)
+    export_cmd.add_argument('spider', help="The spider.")
+    export_cmd.add_argument('-c', '--callback', help=(
+        "Only export the items of this callback."))
+    export_cmd.add_argument('--format', choices=['parquet', 'csv', 'jsonl'],
+                            default='jsonl', help="The output format [default: jsonl].")
+    export_cmd.add_argument('-o', '--output', help=(
+        "The output file [default: <spider>[_<callback>].<format>]."))
+    export_cmd.add_argument('--processes', type=int, help=(
+        "The number of processes decoding fixtures [default: the number of CPUs]."))
+
+    serve_cmd = subparsers.add_parser(
+        'serve',
+        description="Keeps the project imported in a long-running process that "
+                    "replays, inspects and updates fixtures on request over a "
+                    "unix socket, reloading the spider modules that changed "
+                    "in between",
+        formatter_class=argparse.RawTextHelpFormatter)
+    serve_cmd.add_argument('--socket', help=(
+        "The socket path [default: a per-project path in the temp dir]."))
+
+    watch_cmd = subparsers.add_parser(
+        'watch',
+        description="Replays the fixtures of a spider's callbacks, then again "
+                    "for the callbacks affected whenever the spider code, their "
+                    "config.py or their fixtures change",
+        formatter_class=argparse.RawTextHelpFormatter)
+    watch_cmd.add_argument('spider', help="The spider to watch.")
+    watch_cmd.add_argument('-c', '--callback', help="Only watch this callback.")
+    watch_cmd.add_argument('--interval', type=float, default=0.5, help=(
+        "Seconds between checks for changes [default: 0.5]."))
+
+    merge_cmd = subparsers.add_parser(
+        'merge',
+        description="Merges the spools recorded by crawls with TESTMASTER_SPOOL_DIR "
+                    "set into the project's fixtures, deduplicating them by content "
+                    "and sampling each callback according to the responses seen "
+                    "on every side",
+        formatter_class=argparse.RawTextHelpFormatter)
+    merge_cmd.add_argument('spools', nargs='+', help=(
+        "The spools to merge, or dirs of spools (e.g. TESTMASTER_SPOOL_DIR)."))
+    merge_cmd.add_argument('--keep', action='store_true', help=(
+        "Don't delete the spools once merged. Merging them again would count\n"
+        "the responses they saw twice."))
+    merge_cmd.add_argument('--processes', type=int, help=(
+        "The number of processes merging callbacks [default: the number of CPUs]."))
+
     cli = CommandLine(parser)
     cli.parse_command()
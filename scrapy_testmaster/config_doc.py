@@ -33,6 +33,26 @@ INCLUDED_AUTH_HEADERS = []
 #Equivalent to TESTMASTER_INCLUDED_SETTINGS
 INCLUDED_SETTINGS = []
 
+#Equivalent to TESTMASTER_MAX_PEAK_MEMORY_MB
+MAX_PEAK_MEMORY_MB = None
+
+# With TESTMASTER_ADMISSION = 'stratified': regexes matched against the
+# request url, the first one found being the url template of the response
+# (e.g. [r'/p/', r'/sale/', r'/bundle/']). Urls matching none are templated
+# automatically, by replacing path segments that contain digits.
+
+#Equivalent to TESTMASTER_URL_TEMPLATES
+URL_TEMPLATES = []
+
+#Equivalent to TESTMASTER_MIN_FIXTURES_PER_TEMPLATE (None = the global value)
+MIN_FIXTURES_PER_TEMPLATE = None
+
+#Equivalent to TESTMASTER_MAX_FIXTURES_PER_TEMPLATE (None = the global value)
+MAX_FIXTURES_PER_TEMPLATE = None
+
+#Equivalent to TESTMASTER_MONITOR_SAMPLE_RATE (None = the global value)
+MONITOR_SAMPLE_RATE = None
+
 
 # Insert here any field names which you intend to exist in every dictionary
 # object outputted for all callback/s applicable at the given level of this file
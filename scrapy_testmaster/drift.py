@@ -0,0 +1,236 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.exceptions import _InvalidOutput
+from scrapy.utils.reqser import request_from_dict
+
+from .replay import fixture_test_id
+from .storage import (
+    WorkerTask,
+    get_storage,
+    get_worker_storage,
+    reset_default_storage
+)
+from .utils import (
+    add_sample,
+    auto_import,
+    get_fixture_num,
+    load_fixture_data,
+    parse_callback_result,
+    prepare_callback_replay,
+    process_result
+)
+from .utils_novel import get_cb_settings, validate_results
+
+DRIFT_KINDS = ('changed', 'length_changed', 'gained', 'lost')
+
+
+def _request_key(request):
+    return (request.get('url'), request.get('method'),
+            str(request.get('callback')))
+
+
+def _has_len(value):
+    return isinstance(value, (str, bytes, list, tuple, dict))
+
+
+# Structural diff between the recorded and the new output of a callback for
+# one fixture. Items are paired up by position; for each field, the kinds of
+# drift seen in any pair (value changed, length changed, field gained, field
+# lost). Requests are compared as sets of (url, method, callback).
+def diff_results(old_items, old_requests, new_items, new_requests):
+    fields = {}
+    for old, new in zip(old_items, new_items):
+        if not (hasattr(old, 'keys') and hasattr(new, 'keys')):
+            if old != new:
+                fields.setdefault('<item>', set()).add('changed')
+            continue
+        for field in set(old.keys()) | set(new.keys()):
+            if field not in new:
+                kind = 'lost'
+            elif field not in old:
+                kind = 'gained'
+            elif old[field] != new[field]:
+                kinds = fields.setdefault(str(field), set())
+                kinds.add('changed')
+                if _has_len(old[field]) and _has_len(new[field]) and \
+                        len(old[field]) != len(new[field]):
+                    kinds.add('length_changed')
+                continue
+            else:
+                continue
+            fields.setdefault(str(field), set()).add(kind)
+
+    old_keys = set(_request_key(r) for r in old_requests)
+    new_keys = set(_request_key(r) for r in new_requests)
+    return {
+        'num_items': [len(old_items), len(new_items)],
+        'num_requests': [len(old_requests), len(new_requests)],
+        'requests_gained': len(new_keys - old_keys),
+        'requests_lost': len(old_keys - new_keys),
+        'fields': {f: sorted(kinds) for f, kinds in fields.items()},
+    }
+
+
+def is_changed(diff):
+    return any([
+        diff['fields'], diff['requests_gained'], diff['requests_lost'],
+        diff['num_items'][0] != diff['num_items'][1],
+        diff['num_requests'][0] != diff['num_requests'][1],
+    ])
+
+
+# The drift record for a fixture given its old (None if there is no fixture
+# yet) and new callback output, after validating the new output with the
+# callback's rules.
+def drift_record(fixture_path, old_result, new_result, spider_settings,
+                 cb_settings, url):
+    record = {'path': fixture_path,
+              'callback': '/'.join(fixture_test_id(fixture_path).split('/')[:-1])}
+    new_items, new_requests = process_result(new_result, spider_settings, cb_settings)
+    try:
+        validate_results(os.path.dirname(fixture_path), spider_settings,
+                         new_items, new_requests, url)
+    except _InvalidOutput as e:
+        record['invalid'] = str(e)
+        return record
+    if old_result is None:
+        record['new'] = True
+        return record
+    old_items, old_requests = process_result(old_result, spider_settings, cb_settings)
+    record['diff'] = diff_results(old_items, old_requests, new_items, new_requests)
+    return record
+
+
+# Re-runs the callback of a fixture on its stored response. Returns the drift
+# record, having written the new result to the fixture unless `write` is
+# False or the new result is invalid.
+def static_update(fixture_path, write=True, storage=None):
+    storage = storage or get_worker_storage() or get_storage()
+    try:
+        data = load_fixture_data(fixture_path, storage=storage)
+        data, _, spider, _ = prepare_callback_replay(fixture_path, data=data)
+        request = request_from_dict(data['request'], spider)
+        response_kwargs = dict(data['response'])
+        response_cls = auto_import(
+            response_kwargs.pop('cls', 'scrapy.http.HtmlResponse'))
+        response = response_cls(request=request, **response_kwargs)
+
+        test_dir = os.path.dirname(fixture_path)
+        cb_settings = get_cb_settings(test_dir)
+        new_result, _ = parse_callback_result(
+            request.callback(response), spider, cb_settings)
+        record = drift_record(fixture_path, data['result'], new_result,
+                              spider.settings, cb_settings, data['request']['url'])
+    except Exception as e:
+        return {'path': fixture_path,
+                'callback': '/'.join(fixture_test_id(fixture_path).split('/')[:-1]),
+                'error': '%s: %s' % (type(e).__name__, e)}
+
+    if write and 'invalid' not in record:
+        data['result'] = new_result
+        test_dir, filename = os.path.split(fixture_path)
+        add_sample(get_fixture_num(fixture_path), test_dir, filename, data,
+                   storage=storage)
+    return record
+
+
+def _static_update_worker(args):
+    return static_update(*args)
+
+
+# Each worker process opens its own storage, and the parent's is closed
+# first: sqlite connections can't be shared across a fork
+def run_static_updates(fixture_paths, settings, write=True, processes=None):
+    reset_default_storage()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for record in executor.map(
+                WorkerTask(_static_update_worker, settings),
+                [(path, write) for path in fixture_paths], chunksize=4):
+            yield record
+
+
+# Used by the middleware for `update --dynamic` with --dry-run or --report:
+# the drift record of each re-downloaded response is appended to a spool file
+# that the command reads back once the crawl is over.
+def spool_dynamic_record(spool_path, fixture_path, storage, new_result,
+                         spider_settings, cb_settings, url):
+    old_result = None
+    if storage.exists(fixture_path):
+        old_result = load_fixture_data(fixture_path, storage=storage)['result']
+    record = drift_record(fixture_path, old_result, new_result,
+                          spider_settings, cb_settings, url)
+    with open(spool_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def read_spool(spool_path):
+    if not os.path.exists(spool_path):
+        return
+    with open(spool_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class DriftReport(object):
+    def __init__(self):
+        self.callbacks = {}
+
+    def _callback(self, callback):
+        return self.callbacks.setdefault(callback, {
+            'fixtures': 0, 'changed': 0, 'unchanged': 0, 'new': 0,
+            'invalid': 0, 'errors': 0, 'item_count_changed': 0,
+            'gained_requests': 0, 'lost_requests': 0, 'fields': {},
+        })
+
+    def add(self, record):
+        stats = self._callback(record['callback'])
+        stats['fixtures'] += 1
+        if 'error' in record:
+            stats['errors'] += 1
+        elif 'invalid' in record:
+            stats['invalid'] += 1
+        elif record.get('new'):
+            stats['new'] += 1
+        elif not is_changed(record['diff']):
+            stats['unchanged'] += 1
+        else:
+            diff = record['diff']
+            stats['changed'] += 1
+            stats['item_count_changed'] += diff['num_items'][0] != diff['num_items'][1]
+            stats['gained_requests'] += bool(diff['requests_gained'])
+            stats['lost_requests'] += bool(diff['requests_lost'])
+            for field, kinds in diff['fields'].items():
+                counts = stats['fields'].setdefault(
+                    field, dict.fromkeys(DRIFT_KINDS, 0))
+                for kind in kinds:
+                    counts[kind] += 1
+
+    def to_dict(self):
+        return self.callbacks
+
+    def format(self):
+        lines = []
+        for callback in sorted(self.callbacks):
+            stats = self.callbacks[callback]
+            lines.append(
+                "{}: {} fixtures, {} changed, {} unchanged, {} new, "
+                "{} invalid, {} errors".format(
+                    callback, stats['fixtures'], stats['changed'],
+                    stats['unchanged'], stats['new'], stats['invalid'],
+                    stats['errors']))
+            if stats['changed']:
+                lines.append(
+                    "  item count changed in {}, gained requests in {}, "
+                    "lost requests in {}".format(
+                        stats['item_count_changed'], stats['gained_requests'],
+                        stats['lost_requests']))
+            for field in sorted(stats['fields'],
+                                key=lambda f: (-sum(stats['fields'][f].values()), f)):
+                counts = stats['fields'][field]
+                lines.append("  {}: {}".format(field, ", ".join(
+                    "{} {}".format(kind.replace('_', ' '), counts[kind])
+                    for kind in DRIFT_KINDS if counts[kind])))
+        return '\n'.join(lines)
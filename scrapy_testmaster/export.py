@@ -0,0 +1,162 @@
+import csv
+import json
+import tempfile
+
+from . import fixtures
+from .utils_novel import atomic_write, to_jsonable
+
+EXPORT_FORMATS = ('parquet', 'csv', 'jsonl')
+PROVENANCE_COLUMNS = ('_spider', '_callback', '_fixture_num', '_url')
+BATCH_SIZE = 10000
+
+
+# One row per item in the fixture's result, with the provenance columns first.
+# Runs in the worker processes of fixtures.map, so that only the rows (and not
+# the whole fixture, response body included) go back to the main process.
+def fixture_rows(fixture):
+    rows = []
+    for item in fixture.items:
+        item = to_jsonable(item)
+        if not isinstance(item, dict):
+            item = {'_value': item}
+        row = {
+            '_spider': fixture.spider,
+            '_callback': fixture.callback,
+            '_fixture_num': fixture.fixture_num,
+            '_url': fixture.url or fixture.request.get('url'),
+        }
+        row.update(item)
+        rows.append(row)
+    return rows
+
+
+def _type_name(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, (dict, list)):
+        return 'json'
+    return 'string'
+
+
+# Column types inferred across all the items: a column keeps a numeric or
+# boolean type only if all its (non-null) values have it, ints and floats
+# together make floats, and anything else is a string (with nested values
+# serialized as JSON).
+class Schema(object):
+    def __init__(self):
+        self.columns = list(PROVENANCE_COLUMNS)
+        self.types = {}
+
+    def update(self, row):
+        for key, value in row.items():
+            if key not in self.types:
+                if key not in self.columns:
+                    self.columns.append(key)
+                self.types[key] = set()
+            if value is not None:
+                self.types[key].add(_type_name(value))
+
+    def column_type(self, column):
+        types = self.types.get(column, set())
+        if types == {'bool'}:
+            return 'bool'
+        if types == {'int'}:
+            return 'int'
+        if types and types <= {'int', 'float'}:
+            return 'float'
+        return 'string'
+
+    def cast(self, column, value):
+        if value is None:
+            return None
+        column_type = self.column_type(column)
+        if column_type == 'float':
+            return float(value)
+        if column_type == 'string' and not isinstance(value, str):
+            return json.dumps(value) if isinstance(value, (dict, list)) \
+                else str(value)
+        return value
+
+
+def _write_jsonl(spool, schema, out):
+    for line in spool:
+        row = json.loads(line)
+        out.write(json.dumps({c: row.get(c) for c in schema.columns if c in row}))
+        out.write('\n')
+
+
+def _write_csv(spool, schema, out):
+    writer = csv.writer(out)
+    writer.writerow(schema.columns)
+    for line in spool:
+        row = json.loads(line)
+        writer.writerow(['' if row.get(c) is None else schema.cast(c, row.get(c))
+                         for c in schema.columns])
+
+
+def _read_batches(spool):
+    batch = []
+    for line in spool:
+        batch.append(json.loads(line))
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _write_parquet(spool, schema, out_path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pa_types = {'bool': pa.bool_(), 'int': pa.int64(),
+                'float': pa.float64(), 'string': pa.string()}
+    pa_schema = pa.schema([
+        (c, pa_types[schema.column_type(c)]) for c in schema.columns])
+    with pq.ParquetWriter(out_path, pa_schema) as writer:
+        for batch in _read_batches(spool):
+            writer.write_table(pa.Table.from_arrays([
+                pa.array([schema.cast(c, row.get(c)) for row in batch],
+                         type=pa_schema.field(c).type)
+                for c in schema.columns], schema=pa_schema))
+
+
+# Streams the items of the given fixtures into a file in the given format,
+# returning (number of rows, schema). The rows are spooled to a temporary
+# file as the fixtures are decoded (in parallel), since the schema has to be
+# known across all the items before the first csv or parquet row is written;
+# only a batch of rows is in memory at a time.
+def export_items(fixture_iter, out_path, fmt, processes=None, settings=None):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format '%s'" % fmt)
+    if fmt == 'parquet':
+        # fail before decoding anything
+        import pyarrow.parquet  # noqa: F401
+
+    schema = Schema()
+    num_rows = 0
+    with tempfile.TemporaryFile('w+', encoding='utf-8') as spool:
+        for rows in fixtures.map(fixture_rows, fixture_iter,
+                                 processes=processes, settings=settings):
+            for row in rows:
+                schema.update(row)
+                spool.write(json.dumps(row))
+                spool.write('\n')
+                num_rows += 1
+        spool.seek(0)
+
+        with atomic_write(out_path) as tmp_path:
+            if fmt == 'parquet':
+                _write_parquet(spool, schema, tmp_path)
+            else:
+                newline = '' if fmt == 'csv' else None
+                with open(tmp_path, 'w', encoding='utf-8', newline=newline) as out:
+                    if fmt == 'csv':
+                        _write_csv(spool, schema, out)
+                    else:
+                        _write_jsonl(spool, schema, out)
+    return num_rows, schema
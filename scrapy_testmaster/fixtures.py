@@ -0,0 +1,162 @@
+import os
+import re
+from collections import deque
+from datetime import date, datetime
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.utils.project import get_project_settings
+
+from .replay import fixture_test_id
+from .storage import (
+    WorkerTask,
+    get_storage,
+    get_worker_storage,
+    reset_default_storage
+)
+from .utils import get_fixture_num, get_project_dirs, load_fixture_data
+from .utils_novel import SLOW_FIXTURES_DIR
+
+
+class Fixture(object):
+    # The metadata attributes (spider, callback, fixture_num, url, status,
+    # recorded_at, size) come from the path and the storage index; the
+    # fixture itself is only decompressed and unpickled when `data` (or any
+    # attribute derived from it) is first accessed.
+    def __init__(self, path, meta, storage=None):
+        self.path = path
+        parts = fixture_test_id(path).split('/')
+        self.spider = parts[0]
+        # performance fixtures are in the slow/ subdir of their callback's
+        self.callback = parts[-3] if parts[-2] == SLOW_FIXTURES_DIR else parts[-2]
+        self.fixture_num = get_fixture_num(path)
+        self.url = meta.get('url')
+        self.status = meta.get('status')
+        self.recorded_at = meta.get('recorded_at')
+        self.size = meta.get('size')
+        self._storage = storage
+        self._data = None
+
+    def __repr__(self):
+        return '<Fixture %s %s>' % (fixture_test_id(self.path), self.url)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_storage'] = None
+        state['_data'] = None
+        return state
+
+    @property
+    def data(self):
+        if self._data is None:
+            # in the processes of `map`, fixtures arrive without the storage
+            # (and e.g. sqlite connections) of the parent process
+            storage = self._storage or get_worker_storage() or get_storage()
+            self._data = load_fixture_data(self.path, storage=storage)
+        return self._data
+
+    @property
+    def request(self):
+        return self.data['request']
+
+    @property
+    def response(self):
+        return self.data['response']
+
+    @property
+    def body(self):
+        return self.data['response']['body']
+
+    @property
+    def result(self):
+        return self.data['result']
+
+    @property
+    def items(self):
+        return [r['data'] for r in self.result if r['type'] == 'item']
+
+    @property
+    def requests(self):
+        return [r['data'] for r in self.result if r['type'] == 'request']
+
+
+def _to_timestamp(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, datetime) and isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    return value.timestamp()
+
+
+def _get_tests_dir(settings):
+    base_path = settings.get('TESTMASTER_BASE_PATH') or os.path.join(
+        get_project_dirs()[0], 'testmaster')
+    return os.path.join(base_path, 'tests')
+
+
+# Yields the fixtures matching all the filters given, in storage order:
+# `spider` and `callback` by name, `url` as a regex searched for in the
+# request url, `status` as a status code or collection of them, and `since`
+# and `until` (datetimes, dates or timestamps) on when the fixture was last
+# written. Filters are applied to the storage metadata, so fixtures that
+# don't match are never decompressed. For fixtures recorded before the status
+# was kept in view.json, `status` falls back to loading the fixture.
+def query(spider=None, callback=None, url=None, status=None, since=None,
+          until=None, settings=None):
+    settings = settings if settings is not None else get_project_settings()
+    storage = get_storage(settings)
+    test_dir = _get_tests_dir(settings)
+    if spider:
+        test_dir = os.path.join(test_dir, spider)
+    if isinstance(url, str):
+        url = re.compile(url)
+    if isinstance(status, int):
+        status = {status}
+    elif status is not None:
+        status = set(status)
+    since, until = _to_timestamp(since), _to_timestamp(until)
+
+    for path, meta in storage.iter_records(test_dir):
+        fixture = Fixture(path, meta, storage)
+        if callback and fixture.callback != callback:
+            continue
+        if url is not None and not url.search(fixture.url or ''):
+            continue
+        if since is not None and (fixture.recorded_at or 0) < since:
+            continue
+        if until is not None and (fixture.recorded_at or 0) > until:
+            continue
+        if status is not None:
+            if fixture.status is None:
+                fixture.status = fixture.response['status']
+            if fixture.status not in status:
+                continue
+        yield fixture
+
+
+def _run_chunk(task, chunk):
+    return [task(fixture) for fixture in chunk]
+
+
+# Runs `func` over the fixtures in a pool of processes, yielding the results
+# in order. Each process decompresses the fixtures it gets, so `func` should
+# only need `fixture.data` (and be picklable, e.g. a module-level function).
+# Fixtures are handed out `chunksize` at a time, and no more than two chunks
+# per process are in flight, so that the results waiting to be consumed (and
+# the fixtures read ahead) don't grow with the number of fixtures.
+def map(func, fixtures, processes=None, chunksize=8, settings=None):
+    settings = settings if settings is not None else get_project_settings()
+    processes = processes or os.cpu_count() or 1
+    task = WorkerTask(func, settings)
+    fixtures = iter(fixtures)
+    chunks = iter(lambda: list(islice(fixtures, chunksize)), [])
+    reset_default_storage()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque(executor.submit(_run_chunk, task, chunk)
+                        for chunk in islice(chunks, processes * 2))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in islice(chunks, 1):
+                pending.append(executor.submit(_run_chunk, task, chunk))
+            for result in results:
+                yield result
@@ -0,0 +1,299 @@
+import os
+import uuid
+import random
+import shutil
+import socket
+import hashlib
+
+from .admission import TEMPLATE_COUNTS_FILE
+from .storage import (
+    FileStorage,
+    WorkerTask,
+    fixture_name,
+    get_storage,
+    get_worker_storage,
+    load_fixture_data,
+    reset_default_storage
+)
+from .utils import get_fixture_num, write_test
+from .utils_novel import (
+    SLOW_FIXTURES_DIR,
+    create_dir,
+    get_cb_settings,
+    load_view,
+    read_seen_counts,
+    update_max_fixtures,
+    write_seen_counts,
+    write_view
+)
+
+
+# With TESTMASTER_SPOOL_DIR set, `scrapy crawl` records into a spool of its
+# own, <spool dir>/<node id>, laid out like the testmaster dir (tests/<spider>/
+# <callback>/fixtureN.bin, view.json, seen.json...) but always as plain files,
+# whatever the storage of the project. Each process samples and numbers its
+# fixtures on its own, and gives each a globally unique `fixture_id` in
+# view.json; `testmaster merge` then combines spools into the project tests.
+def get_node_id(settings):
+    return settings.get('TESTMASTER_NODE_ID') or '%s-%s' % (
+        socket.gethostname(), os.getpid())
+
+
+def get_spool_path(settings):
+    spool_dir = settings.get('TESTMASTER_SPOOL_DIR')
+    if not spool_dir:
+        return None
+    return os.path.join(spool_dir, get_node_id(settings))
+
+
+def new_fixture_id(node_id):
+    return '%s/%s' % (node_id, uuid.uuid4().hex)
+
+
+# The spools in `paths`, each either a spool or a dir of spools
+def find_spools(paths):
+    spools = []
+    for path in paths:
+        if os.path.isdir(os.path.join(path, 'tests')):
+            spools.append(path)
+        elif os.path.isdir(path):
+            spools.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.isdir(os.path.join(path, name, 'tests')))
+    return spools
+
+
+def content_hash(data):
+    response = data['response']
+    digest = hashlib.sha1()
+    digest.update(('%s %s\n' % (response.get('url'),
+                                response.get('status'))).encode('utf-8'))
+    digest.update(response.get('body') or b'')
+    return digest.hexdigest()
+
+
+def _seen(test_dir, num_fixtures):
+    # callbacks recorded before seen counts were kept have seen at least as
+    # many responses as they have fixtures
+    seen = read_seen_counts(os.path.dirname(test_dir)).get(
+        os.path.basename(test_dir), 0)
+    return max(seen, num_fixtures)
+
+
+# Picks up to `size` elements out of reservoir samples of several streams,
+# given as (responses seen, sample) pairs, so that the result is a sample of
+# all the responses seen: each pick comes from a stream with probability in
+# proportion to the responses of it not yet accounted for.
+def merge_samples(pools, size, rng=random):
+    samples = []
+    for _, sample in pools:
+        sample = list(sample)
+        rng.shuffle(sample)
+        samples.append(sample)
+    remaining = [max(seen, len(sample)) for (seen, _), sample
+                 in zip(pools, samples)]
+    picked = []
+    while len(picked) < size:
+        weights = [r if sample else 0 for r, sample in zip(remaining, samples)]
+        total = sum(weights)
+        if not total:
+            break
+        point = rng.random() * total
+        for i, weight in enumerate(weights):
+            point -= weight
+            if point < 0 and weight:
+                break
+        picked.append(samples[i].pop())
+        remaining[i] -= 1
+    return picked
+
+
+class _Candidate(object):
+    def __init__(self, order, path, node, entry, storage):
+        self.order = order
+        self.path = path
+        self.node = node
+        self.entry = entry
+        self.blob = storage.load(path)
+        self.data = load_fixture_data(path, storage=storage)
+        self.hash = content_hash(self.data)
+
+
+def _load_candidates(source, test_dir, node, storage):
+    view = load_view(test_dir)
+    return [
+        _Candidate((source, i), path, node,
+                   view.get(str(get_fixture_num(path)), {}), storage)
+        for i, path in enumerate(storage.iter_paths(test_dir, recursive=False))
+    ]
+
+
+# as get_or_create_test_dir does, from the testmaster dir down
+def _create_test_dir(tests_dir, rel_path, init_files):
+    test_dir = os.path.dirname(tests_dir)
+    for component in [None, 'tests'] + rel_path.split(os.sep):
+        if component:
+            test_dir = os.path.join(test_dir, component)
+        create_dir(test_dir, parents=True, exist_ok=True)
+        if init_files:
+            with open(os.path.join(test_dir, '__init__.py'), 'a'):
+                pass
+    return test_dir
+
+
+# Merges the fixtures of one callback dir (relative to the tests dir) from
+# the spools into the project's, in one go: fixtures are deduplicated by
+# fixture id and content (the project's own winning over those of spools),
+# then sampled according to the responses each side has seen (performance
+# fixtures are picked by wall time instead), renumbered, and view.json is
+# rebuilt to match.
+def merge_callback(tests_dir, rel_path, sources, max_fixtures,
+                   test_modules=True, slow_fixtures=0, storage=None,
+                   rng=random):
+    storage = storage or get_worker_storage() or get_storage()
+    spool_storage = FileStorage(None)
+    test_dir = os.path.join(tests_dir, rel_path)
+    slow = os.path.basename(test_dir) == SLOW_FIXTURES_DIR
+
+    stored = []
+    if os.path.isdir(test_dir):
+        stored = _load_candidates(0, test_dir, None, storage)
+    pools = [(_seen(test_dir, len(stored)), stored)]
+    for i, (node, src_dir, seen) in enumerate(sources, 1):
+        pools.append((seen, _load_candidates(i, src_dir, node, spool_storage)))
+
+    ids, hashes = set(), set()
+    duplicates = 0
+    unique_pools = []
+    for seen, candidates in pools:
+        unique = []
+        for candidate in candidates:
+            fixture_id = candidate.entry.get('fixture_id')
+            if candidate.hash in hashes or (fixture_id and fixture_id in ids):
+                duplicates += 1
+                continue
+            hashes.add(candidate.hash)
+            ids.add(fixture_id)
+            unique.append(candidate)
+        unique_pools.append((seen, unique))
+
+    if slow:
+        # spools may have been recorded with TESTMASTER_SLOW_FIXTURES set on
+        # the command line only, in which case they're kept as they are
+        size = slow_fixtures or max(len(candidates) for _, candidates in pools)
+        picked = sorted(
+            (c for _, unique in unique_pools for c in unique),
+            key=lambda c: c.entry.get('wall_ms') or 0, reverse=True)[:size]
+    else:
+        size = update_max_fixtures(get_cb_settings(test_dir), max_fixtures)
+        picked = merge_samples(unique_pools, size, rng=rng)
+    picked.sort(key=lambda c: c.order)
+
+    new = [c for c in picked if c.node is not None]
+    if new and not os.path.isdir(test_dir):
+        _create_test_dir(tests_dir, rel_path, test_modules)
+    kept = set(id(c) for c in picked)
+    for candidate in stored:
+        if id(candidate) not in kept:
+            storage.delete(candidate.path)
+
+    view = {}
+    for num, candidate in enumerate(picked, 1):
+        path = os.path.join(test_dir, fixture_name(num))
+        if candidate.node is None:
+            if candidate.path != path:
+                storage.rename(candidate.path, path)
+        else:
+            storage.save(path, candidate.blob, candidate.data)
+            candidate.entry.setdefault('fixture_id',
+                                       new_fixture_id(candidate.node))
+        view[str(num)] = candidate.entry
+    if picked:
+        write_view(test_dir, view)
+
+    if new and not os.path.exists(os.path.join(test_dir, 'test_fixtures.py')):
+        write_test(test_dir, '__'.join(rel_path.split(os.sep)),
+                   new[0].data['request']['url'], test_module=test_modules,
+                   write_config=not slow)
+
+    if not slow:
+        templates = {}
+        for _, src_dir, _ in sources:
+            for template, seen in read_seen_counts(
+                    src_dir, TEMPLATE_COUNTS_FILE).items():
+                templates[template] = templates.get(template, 0) + seen
+        if templates:
+            initial = read_seen_counts(test_dir, TEMPLATE_COUNTS_FILE)
+            write_seen_counts(test_dir, initial, {
+                t: initial.get(t, 0) + seen for t, seen in templates.items()
+            }, TEMPLATE_COUNTS_FILE)
+
+    return {
+        'callback': rel_path,
+        'before': len(stored),
+        'after': len(picked),
+        'added': len(new),
+        'dropped': len(stored) - (len(picked) - len(new)),
+        'duplicates': duplicates,
+    }
+
+
+def _merge_worker(args):
+    return merge_callback(*args)
+
+
+# Merges the spools into the tests dir, the callbacks in parallel, and adds
+# the responses seen by the spools to the seen counts of the project (which
+# is why spools are deleted once merged, unless `keep`).
+def merge_spools(tests_dir, spools, settings, processes=None, keep=False):
+    # not imported with the spool helpers above, which the middleware uses
+    from concurrent.futures import ProcessPoolExecutor
+
+    max_fixtures = max(settings.getint(
+        'TESTMASTER_MAX_FIXTURES_PER_CALLBACK', default=10), 10)
+    test_modules = settings.getbool('TESTMASTER_WRITE_TEST_MODULES',
+                                    default=True)
+    slow_fixtures = max(settings.getint('TESTMASTER_SLOW_FIXTURES', 0), 0)
+    spool_storage = FileStorage(settings)
+
+    jobs = {}
+    for spool in spools:
+        node = os.path.basename(os.path.normpath(spool))
+        spool_tests = os.path.join(spool, 'tests')
+        src_dirs = sorted(set(os.path.dirname(path) for path
+                              in spool_storage.iter_paths(spool_tests)))
+        for src_dir in src_dirs:
+            rel_path = os.path.relpath(src_dir, spool_tests)
+            seen = _seen(src_dir, spool_storage.count(src_dir))
+            jobs.setdefault(rel_path, []).append((node, src_dir, seen))
+
+    reset_default_storage()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        records = list(executor.map(WorkerTask(_merge_worker, settings), [
+            (tests_dir, rel_path, sources, max_fixtures, test_modules,
+             slow_fixtures)
+            for rel_path, sources in sorted(jobs.items())
+        ]))
+
+    # seen.json is shared by the callbacks of a spider, so it's only written
+    # once they're all merged
+    seen_added = {}
+    for record in records:
+        rel_path = record['callback']
+        if os.path.basename(rel_path) == SLOW_FIXTURES_DIR:
+            continue
+        base_dir, callback = os.path.split(os.path.join(tests_dir, rel_path))
+        counts = seen_added.setdefault(base_dir, {})
+        counts[callback] = (record['before'],
+                            sum(seen for _, _, seen in jobs[rel_path]))
+    for base_dir, counts in seen_added.items():
+        initial = read_seen_counts(base_dir)
+        write_seen_counts(base_dir, initial, {
+            callback: initial.get(callback, before) + added
+            for callback, (before, added) in counts.items()
+        })
+
+    if not keep:
+        for spool in spools:
+            shutil.rmtree(spool)
+    return records
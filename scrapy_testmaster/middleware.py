@@ -1,10 +1,11 @@
 import os
 import six
+import inspect
 import pickle
-import random
 import logging
 import copy
 
+from scrapy import signals
 from scrapy.exceptions import NotConfigured
 from scrapy.commands.genspider import sanitize_module_name
 from scrapy.spiders import CrawlSpider
@@ -12,6 +13,7 @@ from scrapy.spiders import CrawlSpider
 
 from .utils import (
     add_sample,
+    encode_sample,
     write_test,
     response_to_dict,
     get_or_create_test_dir,
@@ -23,13 +25,23 @@ from .utils import (
     parse_callback_result,
     process_result
 )
+from .admission import get_admission_policy
+from .budget import RecordingBudget
+from .merge import get_node_id, get_spool_path, new_fixture_id
+from .monitor import Monitor
+from .simhash import NearDuplicateFilter
+from .slowpath import CallbackTimer, SlowResponses, slow_fixtures_dir
+from .storage import FileStorage, get_storage
 from .utils_novel import (
     get_cb_settings,
     validate_results,
     write_json,
     get_fixture_counts,
+    get_num_fixtures,
+    read_seen_counts,
     update_max_fixtures,
-    request_to_dict
+    request_to_dict,
+    write_seen_counts
 )
 
 logger = logging.getLogger(__name__)
@@ -61,7 +73,8 @@ class TestMasterMiddleware:
                     self.__class__.__name__,))
         if not settings.getbool('TESTMASTER_ENABLED'):
             raise NotConfigured('scrapy-testmaster is not enabled')
-        if settings.getint('CONCURRENT_REQUESTS') > 1:
+        monitoring = settings.get('TESTMASTER_MODE', 'record') == 'monitor'
+        if settings.getint('CONCURRENT_REQUESTS') > 1 and not monitoring:
             logger.warn(
                 'Recording with concurrency > 1! '
                 'Data races in shared object modification may create broken '
@@ -82,14 +95,96 @@ class TestMasterMiddleware:
 
         create_dir(self.base_path, exist_ok=True)
 
+        # with TESTMASTER_MODE = 'monitor', crawls only validate a sample of
+        # the responses (`testmaster parse` and `update` still record)
+        self.monitor = Monitor.from_settings(settings, self.base_path,
+                                             crawler.stats)
+
+        self.storage = get_storage(settings)
+        self.stats = crawler.stats
+        self.node_id = None
+        self.crawl_path = self.base_path
+        self.crawl_storage = self.storage
+        # what only recording crawls need (the budget measures the disk usage
+        # of the tests dir) isn't set up in monitor mode
+        self.admission = self.near_duplicates = self.slow_responses = None
+        self.spool_path = self.budget = None
+        if self.monitor is None:
+            self.admission = get_admission_policy(settings)
+            self.near_duplicates = NearDuplicateFilter.from_settings(settings)
+            self.slow_responses = SlowResponses.from_settings(settings)
+            # where `scrapy crawl` records: a spool of its own for `testmaster
+            # merge`, if TESTMASTER_SPOOL_DIR is set (always as plain files)
+            self.spool_path = get_spool_path(settings)
+            if self.spool_path is not None:
+                self.node_id = get_node_id(settings)
+                self.crawl_path = self.spool_path
+                self.crawl_storage = FileStorage(settings)
+                create_dir(self.spool_path, parents=True, exist_ok=True)
+            self.budget = RecordingBudget.from_settings(
+                settings, os.path.join(self.crawl_path, 'tests'))
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+        self.write_test_modules = settings.getbool(
+            'TESTMASTER_WRITE_TEST_MODULES', default=True)
+
         self.init = 0
         self.fixture_counters = {}
+        # responses seen per callback by `scrapy crawl`, over all its runs
+        self.seen_dir = None
+        self.seen_initial = {}
+        self.seen_counts = {}
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(crawler)
 
+    def spider_opened(self, spider):
+        if self.monitor is not None:
+            self.monitor.open(spider)
+        self.seen_dir = os.path.join(
+            self.crawl_path, 'tests', sanitize_module_name(spider.name),
+            spider.settings.get('TESTMASTER_EXTRA_PATH') or '')
+        self.seen_initial = read_seen_counts(self.seen_dir)
+        self.seen_counts = dict(self.seen_initial)
+
+    def spider_closed(self, spider):
+        if self.monitor is not None:
+            self.monitor.close()
+        else:
+            self.admission.close()
+        if self.budget is not None:
+            self._flush_deferred(spider, force=True)
+        if self.seen_counts != self.seen_initial:
+            write_seen_counts(self.seen_dir, self.seen_initial, self.seen_counts)
+
+    def _seen(self, callback_name, test_dir):
+        if callback_name not in self.seen_counts:
+            # callbacks recorded before the counts were kept have seen at
+            # least as many responses as they have fixtures (the other
+            # commands count the fixtures they add as seen, see _add_seen)
+            seen = get_num_fixtures(test_dir, storage=self.crawl_storage)
+            self.seen_initial[callback_name] = self.seen_counts[callback_name] = seen
+        return self.seen_counts[callback_name]
+
+    # Fixtures added by commands other than `scrapy crawl` count as responses
+    # seen, so that crawls never see fewer responses than there are fixtures
+    # (and reuse the indices of stored ones while there's room)
+    def _add_seen(self, spider, callback_name, num_fixtures):
+        seen_dir = os.path.join(
+            self.base_path, 'tests', sanitize_module_name(spider.name),
+            spider.settings.get('TESTMASTER_EXTRA_PATH') or '')
+        write_seen_counts(seen_dir, {callback_name: num_fixtures},
+                          {callback_name: num_fixtures + 1})
+
+    def _monitored(self, response):
+        return self.monitor is not None and not (
+            '_parse' in response.meta or '_update' in response.meta)
+
     def process_spider_input(self, response, spider):
+        if self._monitored(response):
+            return None
         if self.init == 0:
             if '_parse' in response.meta:
                 spider_dir = os.path.join(self.base_path, 'tests', sanitize_module_name(spider.name))
@@ -129,21 +224,57 @@ class TestMasterMiddleware:
             'middlewares': get_middlewares(spider),
         })
 
+        if self.slow_responses is not None and not (
+                '_update' in response.meta or '_parse' in response.meta):
+            self._time_callback(response, spider)
         return None
 
+    # Callbacks that return a list (or an item, or a request) do all their
+    # work when called, before process_spider_output gets their output, so
+    # the call itself is timed by swapping in a wrapper for the callback
+    # until then. Generator callbacks only run as their output is consumed.
+    def _time_callback(self, response, spider):
+        request = response.request
+        callback = request.callback
+        # what Scrapy calls for requests without a callback
+        target = callback or getattr(spider, '_parse', spider.parse)
+        timer = response.meta['_testmaster_timer'] = CallbackTimer()
+        if inspect.isgeneratorfunction(target):
+            return
+
+        def timed_callback(*args, **kwargs):
+            request.callback = callback
+            with timer:
+                return target(*args, **kwargs)
+
+        request.callback = timed_callback
+
     def process_spider_output(self, response, result, spider):
+        if self._monitored(response):
+            return self.monitor.process_spider_output(response, result, spider)
         input_data = pickle.loads(response.meta.pop('_testmaster'))
+        callback_timer = response.meta.pop('_testmaster_timer', None)
         request = input_data['request']
         callback_name = request['callback']
 
         settings = spider.settings
+        crawling = not ('_update' in response.meta or '_parse' in response.meta)
+        spooled = crawling and self.spool_path is not None
+        test_modules = self.write_test_modules and not spooled
         test_dir, test_name = get_or_create_test_dir(
-            self.base_path,
+            self.crawl_path if crawling else self.base_path,
             sanitize_module_name(spider.name),
             callback_name,
             settings.get('TESTMASTER_EXTRA_PATH'),
+            init_files=test_modules,
         )
-        cb_settings = get_cb_settings(test_dir)
+        # spooled fixtures are checked against the project's config.py
+        config_dir = os.path.join(
+            self.base_path, os.path.relpath(test_dir, self.crawl_path)) \
+            if spooled else test_dir
+        cb_settings = get_cb_settings(config_dir)
+        tracer = None
+        timer = None
         # parse command will return requests at the end of callbacks but not
         # items... As such I am processing the result as it comes, before it
         # reaches this point (and  storing the result in meta).
@@ -151,7 +282,21 @@ class TestMasterMiddleware:
             processed_result = response.meta.pop('_processed_result')
             out = result
         else:
-            processed_result, out = parse_callback_result(result, spider, cb_settings)
+            if crawling:
+                tracer = self.admission.get_tracer(spider, callback_name, test_dir)
+            if tracer is not None:
+                with tracer:
+                    processed_result, out = parse_callback_result(
+                        result, spider, cb_settings)
+            elif crawling and callback_timer is not None:
+                # traced callbacks are too slowed down to be timed; only the
+                # callback itself is, not the copying and parsing of its output
+                with callback_timer as timer:
+                    result = list(result)
+                processed_result, out = parse_callback_result(
+                    result, spider, cb_settings)
+            else:
+                processed_result, out = parse_callback_result(result, spider, cb_settings)
 
         spider_attr_out = {
             k: v for k, v in spider.__dict__.items()
@@ -173,8 +318,13 @@ class TestMasterMiddleware:
             'python_version': 2 if six.PY2 else 3,
         }
 
-        callback_counter = self.fixture_counters.setdefault(callback_name, 0)
-        # self.fixture_counters[callback_name] += 1
+        # the admission policy samples from all the responses seen by crawls,
+        # while the other commands number the fixtures they add after those
+        # stored
+        if crawling:
+            callback_counter = self._seen(callback_name, test_dir)
+        else:
+            callback_counter = self.fixture_counters.setdefault(callback_name, 0)
 
         index = 0
 
@@ -182,35 +332,144 @@ class TestMasterMiddleware:
         _request = copy.deepcopy(data['request'])
         _request = clean_request(_request, spider.settings, cb_settings)
 
-        items_out, requests_out = process_result(
-            data['result'], spider.settings, cb_settings)
-        validate_results(test_dir, spider.settings, items_out, requests_out,
-                         request['url'])
+        # update --dry-run only reports on the new results (invalid or not)
+        dry_run = '_dry_run' in response.meta
+        if not dry_run:
+            items_out, requests_out = process_result(
+                data['result'], spider.settings, cb_settings)
+            validate_results(config_dir, spider.settings, items_out, requests_out,
+                             request['url'])
+
+        fingerprint = None
+        if crawling and self.near_duplicates is not None:
+            fingerprint = self.near_duplicates.fingerprint(response)
 
-        if callback_counter < max_fixtures or '_update' in response.meta:
+        if crawling and self.budget is not None:
+            self._flush_deferred(spider)
+
+        near_duplicate = fingerprint is not None and \
+            self.near_duplicates.find_near_duplicate(
+                test_dir, callback_name, fingerprint) is not None
+
+        if near_duplicate:
+            self.stats.inc_value('testmaster/skipped/near_duplicate', spider=spider)
+
+        elif crawling:
+            # the admission policy (random replacement by default) should only
+            # apply to generating testcases via scrapy crawl. It sees every
+            # response, so that it keeps count of them even over the budget.
+            index = self.admission.admit(
+                test_dir, callback_name, callback_counter, max_fixtures,
+                data['result'], tracer=tracer, url=request['url']) or 0
+            over_budget = index and self._over_budget()
+            if over_budget:
+                if hasattr(self.admission, 'cancel'):
+                    self.admission.cancel()
+                self.stats.inc_value('testmaster/skipped/%s' % over_budget, spider=spider)
+                index = 0
+            elif index:
+                extra = self.admission.view_fields(data['result'], tracer)
+                extra['status'] = response.status
+                if fingerprint is not None:
+                    self.near_duplicates.add(callback_name, index, fingerprint)
+                    extra.update(self.near_duplicates.view_fields(fingerprint))
+                self._record(index, test_dir, test_name, data, _request,
+                             extra, spider)
+
+        elif callback_counter < max_fixtures or '_update' in response.meta:
             index = callback_counter + 1
             if '_fixture' in response.meta:
                 index = response.meta['_fixture']
-            add_sample(index, test_dir, test_name, data)
-            write_json(test_dir, _request, data['result'], index)
+            if '_drift_spool' in response.meta:
+                # only `testmaster update` sets this, so drift (and the
+                # process pool it imports) isn't imported while crawling
+                from .drift import spool_dynamic_record
+                spool_dynamic_record(
+                    response.meta['_drift_spool'],
+                    os.path.join(test_dir, 'fixture%s.bin' % index),
+                    self.storage, data['result'], spider.settings,
+                    cb_settings, request['url'])
+            if not dry_run:
+                add_sample(index, test_dir, test_name, data, storage=self.storage)
+                write_json(test_dir, _request, data['result'], index,
+                           extra={'status': response.status})
+                if '_update' not in response.meta:
+                    self._add_seen(spider, callback_name, callback_counter)
 
-        else:
-            # this random overwriting logic should only apply to generating testcases
-            # via scrapy crawl
-            if not ('_update' in response.meta or '_parse' in response.meta):
-                r = random.randint(0, callback_counter)
-                if r < max_fixtures:
-                    index = r + 1
-                    add_sample(index, test_dir, test_name, data)
-                    write_json(test_dir, _request, data['result'], index)
+        if timer is not None and not near_duplicate and not self._over_budget():
+            self._record_slow(test_dir, test_name, callback_name, data,
+                              _request, response, timer, spider)
 
-        if index == 1:
-            write_test(test_dir, test_name, request['url'])
+        if index == 1 and not dry_run:
+            write_test(test_dir, test_name, request['url'],
+                       test_module=test_modules, write_config=not spooled)
 
-        self.fixture_counters[callback_name] += 1
+        if crawling:
+            self.seen_counts[callback_name] += 1
+        else:
+            self.fixture_counters[callback_name] += 1
 
         # if we don't return an empty list here, 'update' keeps on making
         # requests indefinitely!
         if '_update' in response.meta:
             return []
         return out
+
+    def _record(self, index, test_dir, test_name, data, request, extra, spider):
+        if self.node_id is not None:
+            extra['fixture_id'] = new_fixture_id(self.node_id)
+        if self.budget is None:
+            add_sample(index, test_dir, test_name, data,
+                       storage=self.crawl_storage)
+            write_json(test_dir, request, data['result'], index, extra=extra)
+            return
+
+        # encoded now, so that the budget knows its size even if deferred
+        blob = encode_sample(data)
+        path = os.path.join(test_dir, 'fixture%s.bin' % index)
+
+        def write():
+            storage = self.crawl_storage
+            replaced = storage.size(path) if storage.exists(path) else 0
+            add_sample(index, test_dir, test_name, data, storage=storage,
+                       blob=blob)
+            write_json(test_dir, request, data['result'], index, extra=extra)
+            self.stats.inc_value('testmaster/bytes_written', len(blob),
+                                 spider=spider)
+            return replaced
+
+        if not self.budget.write(len(blob), write):
+            self.stats.inc_value('testmaster/deferred/write_rate', spider=spider)
+
+    def _record_slow(self, test_dir, test_name, callback_name, data, request,
+                     response, timer, spider):
+        slow_dir = slow_fixtures_dir(test_dir)
+        index = self.slow_responses.admit(slow_dir, callback_name, timer)
+        if index is None:
+            return
+        create_dir(slow_dir, exist_ok=True)
+        if self.write_test_modules and self.spool_path is None:
+            with open(os.path.join(slow_dir, '__init__.py'), 'a'):
+                pass
+        slow_name = test_name + '__slow'
+        extra = self.slow_responses.view_fields(timer)
+        extra['status'] = response.status
+        self._record(index, slow_dir, slow_name, data, request, extra, spider)
+        if index == 1:
+            # replayed with the config.py of the callback
+            write_test(slow_dir, slow_name, request['url'],
+                       test_module=self.write_test_modules and self.spool_path is None,
+                       write_config=False)
+        self.stats.inc_value('testmaster/slow/recorded', spider=spider)
+
+    # None if a fixture may be recorded, or the budget it would be over
+    def _over_budget(self):
+        if self.budget is None:
+            return None
+        return self.budget.check()
+
+    def _flush_deferred(self, spider, force=False):
+        done = self.budget.flush(force=force)
+        if done:
+            self.stats.inc_value('testmaster/deferred/written', done,
+                                 spider=spider)
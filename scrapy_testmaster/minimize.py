@@ -0,0 +1,139 @@
+import os
+import copy
+import math
+import time
+
+import lxml.etree
+import lxml.html
+
+from .replay import ReplayCase
+from .utils import add_sample, generate_test, get_fixture_num, load_fixture_data
+
+
+# Classic ddmin: finds a 1-minimal subset of `items` for which `passes` still
+# holds, by trying to keep only one of n chunks, then to drop one of them, and
+# doubling the granularity when neither works.
+def ddmin(items, passes):
+    items = list(items)
+    if passes([]):
+        return []
+    n = 2
+    while len(items) >= 2:
+        size = int(math.ceil(len(items) / float(n)))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        for chunk in chunks:
+            if passes(chunk):
+                items, n = chunk, 2
+                break
+        else:
+            for i in range(len(chunks)):
+                complement = [x for j, c in enumerate(chunks) if j != i for x in c]
+                if passes(complement):
+                    items, n = complement, max(n - 1, 2)
+                    break
+            else:
+                if n >= len(items):
+                    break
+                n = min(len(items), n * 2)
+    return items
+
+
+def _serialize(tree, encoding):
+    return lxml.etree.tostring(tree, method='html', encoding=encoding)
+
+
+def _dropped(nodes, kept):
+    kept = set(map(id, kept))
+    return [node for node in nodes if id(node) not in kept]
+
+
+def _without(tree, nodes, encoding):
+    # detaches the nodes (with their tail text) just long enough to serialize
+    positions = [(node.getparent(), node.getparent().index(node), node)
+                 for node in nodes]
+    for parent, _, node in reversed(positions):
+        parent.remove(node)
+    try:
+        return _serialize(tree, encoding)
+    finally:
+        for parent, index, node in positions:
+            parent.insert(index, node)
+
+
+# Hierarchical delta debugging: runs ddmin over the children of the nodes
+# kept at each depth of the DOM, top down, so that whole subtrees go in as
+# few replays as possible. `passes` gets a candidate body and tells whether
+# the callback output is still the recorded one.
+def minimize_body(body, encoding, passes):
+    parser = lxml.html.HTMLParser(encoding=encoding)
+    root = lxml.html.document_fromstring(body, parser=parser)
+    tree = root.getroottree()
+    if not passes(_serialize(tree, encoding)):
+        raise ValueError("the callback output changes when the body is "
+                         "re-serialized, so it can't be minimized")
+
+    level = [root]
+    while level:
+        children = [child for node in level for child in node]
+        if not children:
+            break
+        keep = ddmin(children, lambda kept: passes(_without(
+            tree, _dropped(children, kept), encoding)))
+        for child in _dropped(children, keep):
+            child.getparent().remove(child)
+        level = [c for c in keep if isinstance(c.tag, str)]
+    return _serialize(tree, encoding)
+
+
+class FixtureMinimizer(object):
+    def __init__(self, fixture_path, timing_runs=3):
+        self.fixture_path = fixture_path
+        self.timing_runs = timing_runs
+        self.data = load_fixture_data(fixture_path)
+        self.replays = 0
+
+    def _with_body(self, body):
+        data = copy.deepcopy(self.data)
+        data['response']['body'] = body
+        return data
+
+    def _replay(self, data):
+        generate_test(self.fixture_path, data=data)(ReplayCase())
+
+    def passes(self, body):
+        self.replays += 1
+        try:
+            self._replay(self._with_body(body))
+        except Exception:
+            return False
+        return True
+
+    def replay_time(self, body):
+        timings = []
+        for _ in range(self.timing_runs):
+            data = self._with_body(body)
+            start = time.perf_counter()
+            self._replay(data)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def is_html(self):
+        cls = self.data['response'].get('cls', 'scrapy.http.HtmlResponse')
+        return cls.endswith('HtmlResponse')
+
+    def minimize(self):
+        if not self.is_html():
+            raise ValueError("only HTML responses can be minimized")
+        body = self.data['response']['body']
+        if not body.strip():
+            raise ValueError("the response body is empty")
+        if not self.passes(body):
+            raise ValueError("the fixture doesn't pass as recorded, "
+                             "update it first")
+        encoding = self.data['response'].get('encoding') or 'utf-8'
+        return minimize_body(body, encoding, self.passes)
+
+    def save(self, body):
+        test_dir, filename = os.path.split(self.fixture_path)
+        add_sample(get_fixture_num(self.fixture_path), test_dir, filename,
+                   self._with_body(body))
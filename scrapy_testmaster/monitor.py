@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import random
+import logging
+from collections import deque
+
+from scrapy.commands.genspider import sanitize_module_name
+from scrapy.exceptions import _InvalidOutput
+from twisted.internet import task
+
+from .utils import parse_callback_result, process_result
+from .utils_novel import (
+    _find_method,
+    atomic_write,
+    check_global_rules,
+    check_local_rules,
+    check_options,
+    get_cb_settings
+)
+
+logger = logging.getLogger(__name__)
+
+# violations kept as examples in the report, per callback
+MAX_EXAMPLES = 10
+
+
+def _check_fields(settings, config, items, requests, url):
+    check_options(settings, config, items, url)
+
+
+def _check_callback_rules(settings, config, items, requests, url):
+    check_local_rules(config, items, requests, url)
+
+
+def _check_project_rules(settings, config, items, requests, url):
+    check_global_rules(settings, items, requests, url)
+
+
+# the checks of validate_results, run one by one so that a response can fail
+# more than one of them
+CHECKS = (
+    ('fields', _check_fields),
+    ('callback_rules', _check_callback_rules),
+    ('project_rules', _check_project_rules),
+)
+
+
+# as the recorder names the callback dirs
+def callback_name(request, spider):
+    callback = request.callback
+    if callable(callback):
+        callback = _find_method(spider, callback)
+    return callback or 'parse'
+
+
+class _CallbackMonitor(object):
+    def __init__(self, config, sample_rate):
+        self.config = config
+        self.sample_rate = sample_rate
+        self.seen = self.validated = self.invalid = 0
+        self.violations = {}
+        self.examples = deque(maxlen=MAX_EXAMPLES)
+
+    def to_dict(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'seen': self.seen,
+            'validated': self.validated,
+            'invalid': self.invalid,
+            'violations': dict(self.violations),
+            'examples': list(self.examples),
+        }
+
+
+# TESTMASTER_MODE = 'monitor': instead of recording fixtures, `scrapy crawl`
+# runs the checks of validate_results (obligate/primary fields, config.py and
+# project rules) on a sample of the responses of each callback, and counts
+# the violations in the crawl stats and in a JSON report written every
+# TESTMASTER_MONITOR_REPORT_INTERVAL seconds. Responses that aren't sampled
+# go through untouched, and nothing is captured for them.
+class Monitor(object):
+    def __init__(self, base_path, settings, stats=None, report_path=None,
+                 report_interval=60, sample_rate=0.1, rng=None):
+        self.base_path = base_path
+        self.settings = settings
+        self.stats = stats
+        self.report_path = report_path
+        self.report_interval = report_interval
+        self.sample_rate = sample_rate
+        self.random = (rng or random.Random()).random
+        self.callbacks = {}
+        self.spider_name = None
+        self._task = None
+
+    @classmethod
+    def from_settings(cls, settings, base_path, stats=None):
+        if settings.get('TESTMASTER_MODE', 'record') != 'monitor':
+            return None
+        return cls(
+            base_path, settings, stats,
+            report_path=settings.get('TESTMASTER_MONITOR_REPORT'),
+            report_interval=settings.getfloat(
+                'TESTMASTER_MONITOR_REPORT_INTERVAL', 60),
+            sample_rate=settings.getfloat('TESTMASTER_MONITOR_SAMPLE_RATE', 0.1))
+
+    def _callback(self, spider, name):
+        if name not in self.callbacks:
+            test_dir = os.path.join(
+                self.base_path, 'tests', sanitize_module_name(spider.name),
+                spider.settings.get('TESTMASTER_EXTRA_PATH') or '', name)
+            # config.py is only read once per callback
+            config = get_cb_settings(test_dir)
+            sample_rate = getattr(config, 'MONITOR_SAMPLE_RATE', None)
+            self.callbacks[name] = _CallbackMonitor(
+                config, self.sample_rate if sample_rate is None else sample_rate)
+        return self.callbacks[name]
+
+    def process_spider_output(self, response, result, spider):
+        name = callback_name(response.request, spider)
+        callback = self._callback(spider, name)
+        callback.seen += 1
+        if callback.sample_rate < 1 and self.random() >= callback.sample_rate:
+            return result
+        processed_result, out = parse_callback_result(
+            result, spider, callback.config)
+        items, requests = process_result(
+            processed_result, spider.settings, callback.config)
+        self.validate(name, callback, items, requests, response.url)
+        return out
+
+    def validate(self, name, callback, items, requests, url):
+        callback.validated += 1
+        self._inc_stat('testmaster/monitor/validated')
+        failed = False
+        for check, func in CHECKS:
+            try:
+                func(self.settings, callback.config, items, requests, url)
+            except _InvalidOutput as e:
+                failed = True
+                if check not in callback.violations:
+                    logger.warning('%s (callback %s, further violations are '
+                                   'only counted)', e, name)
+                callback.violations[check] = callback.violations.get(check, 0) + 1
+                callback.examples.append(
+                    {'check': check, 'url': url, 'message': str(e)})
+                self._inc_stat('testmaster/monitor/violations/%s' % check)
+        if failed:
+            callback.invalid += 1
+            self._inc_stat('testmaster/monitor/invalid')
+        return not failed
+
+    def _inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+    def report(self):
+        return {
+            'spider': self.spider_name,
+            'updated_at': time.time(),
+            'callbacks': {name: callback.to_dict()
+                          for name, callback in sorted(self.callbacks.items())},
+        }
+
+    def write_report(self):
+        if not self.report_path:
+            return
+        dir_name = os.path.dirname(self.report_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        with atomic_write(self.report_path) as tmp_path, \
+                open(tmp_path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def open(self, spider):
+        self.spider_name = spider.name
+        if not self.report_path:
+            self.report_path = os.path.join(
+                self.base_path, 'monitor', '%s.json' % spider.name)
+        if self.report_interval > 0:
+            self._task = task.LoopingCall(self.write_report)
+            self._task.start(self.report_interval, now=False)
+
+    def close(self):
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        self.write_report()
@@ -1,8 +1,12 @@
 from __future__ import print_function
 import os
+import sys
 import json
+import pickle
 import logging
-import copy
+import tempfile
+import itertools
+from w3lib.url import is_url
 
 from scrapy.commands.genspider import sanitize_module_name
 from scrapy.http import Request
@@ -12,7 +16,7 @@ from scrapy.utils.conf import arglist_to_dict
 from scrapy.utils.spider import iterate_spider_output, spidercls_for_request
 from scrapy.exceptions import UsageError
 
-from .utils import parse_request, get_project_dirs
+from .utils import parse_request, get_project_dirs, to_jsonable
 from .utils_novel import get_cb_settings, get_homepage_cookies
 
 logger = logging.getLogger(__name__)
@@ -24,10 +28,90 @@ crawler_process = None
 pcrawler = None
 
 # spider = None
-items = {}
-requests = {}
-
 first_response = None
+homepage_cookies = None
+
+
+class _Repr(object):
+    # stands in for an entry that can't be spilled to disk, keeping only what
+    # is needed to print it
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+
+class ResultStore(object):
+    # Append-only, per-depth store for the results collected by the parse
+    # command. With a spill threshold (in MB), entries are pickled as they come
+    # in and flushed to a temporary file per depth level whenever the pickled
+    # backlog held in memory grows past the threshold.
+    def __init__(self, spill_mb=None):
+        self.spill_bytes = int(spill_mb * 1024 * 1024) if spill_mb else 0
+        self._memory = {}
+        self._files = {}
+        self._pending_bytes = 0
+
+    def __bool__(self):
+        return bool(self.levels())
+
+    def levels(self):
+        return sorted(set(self._memory) | set(self._files))
+
+    @property
+    def spilling(self):
+        return bool(self.spill_bytes)
+
+    def add(self, lvl, entries):
+        level = self._memory.setdefault(lvl, [])
+        if not self.spilling:
+            level.extend(entries)
+            return
+        for entry in entries:
+            try:
+                blob = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                blob = pickle.dumps(_Repr(repr(entry)),
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+            level.append(blob)
+            self._pending_bytes += len(blob)
+        if self._pending_bytes > self.spill_bytes:
+            self.spill()
+
+    def spill(self):
+        for lvl, blobs in self._memory.items():
+            if not blobs:
+                continue
+            f = self._files.get(lvl)
+            if f is None:
+                f = self._files[lvl] = tempfile.TemporaryFile()
+            f.seek(0, os.SEEK_END)
+            for blob in blobs:
+                f.write(blob)
+            self._memory[lvl] = []
+        self._pending_bytes = 0
+
+    def iter_level(self, lvl):
+        f = self._files.get(lvl)
+        if f is not None:
+            f.seek(0)
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+        for entry in self._memory.get(lvl, []):
+            yield pickle.loads(entry) if self.spilling else entry
+
+    def iter_all(self):
+        for lvl in self.levels():
+            for entry in self.iter_level(lvl):
+                yield entry
+
+
+items = ResultStore()
+requests = ResultStore()
 
 
 def syntax():
@@ -39,50 +123,59 @@ def short_desc():
 
 
 def max_level():
-    global items, requests
     max_items, max_requests = 0, 0
     if items:
-        max_items = max(items)
+        max_items = max(items.levels())
     if requests:
-        max_requests = max(requests)
+        max_requests = max(requests.levels())
     return max(max_items, max_requests)
 
 
-def add_items(lvl, new_items, remembered_items):
-    global items
-    old_items = remembered_items.get(lvl, [])
-    items[lvl] = old_items + new_items
+def add_items(lvl, new_items):
+    # shallow copies, so that what gets printed is what was yielded even if
+    # the spider goes on to mutate the item (e.g. after passing it in meta)
+    items.add(lvl, [dict(x) for x in new_items])
 
 
 def add_requests(lvl, new_reqs):
-    global requests
-    old_reqs = requests.get(lvl, [])
-    requests[lvl] = old_reqs + new_reqs
+    if requests.spilling:
+        # requests hold a reference to the spider via their callback, so only
+        # their printable form is spilled
+        new_reqs = [_Repr(repr(r)) for r in new_reqs]
+    requests.add(lvl, new_reqs)
+
+
+def _print_entries(entries, spilling, colour):
+    if spilling:
+        # print entry by entry so as not to pull the spilled results back
+        # into memory all at once
+        for entry in entries:
+            display.pprint(entry, colorize=colour)
+    else:
+        display.pprint(list(entries), colorize=colour)
 
 
 def print_items(lvl=None, colour=True):
-    global items
     if lvl is None:
-        items_out = [item for lst in items.values() for item in lst]
+        items_out = items.iter_all()
     else:
-        items_out = items.get(lvl, [])
+        items_out = items.iter_level(lvl)
 
     print("# Scraped Items ", "-" * 60)
-    display.pprint([dict(x) for x in items_out], colorize=colour)
+    _print_entries(items_out, items.spilling, colour)
 
 
 def print_requests(lvl=None, colour=True):
-    global requests
     if lvl is None:
         if requests:
-            requests_out = requests[max(requests)]
+            requests_out = requests.iter_level(max(requests.levels()))
         else:
             requests_out = []
     else:
-        requests_out = requests.get(lvl, [])
+        requests_out = requests.iter_level(lvl)
 
     print("# Requests ", "-" * 65)
-    display.pprint(requests_out, colorize=colour)
+    _print_entries(requests_out, requests.spilling, colour)
 
 
 def print_results(args):
@@ -103,7 +196,41 @@ def print_results(args):
             print_requests(colour=colour)
 
 
-def run_callback(response, callback, cb_kwargs=None):
+def request_to_jsonl_data(request):
+    callback = request.callback
+    return {
+        'url': request.url,
+        'method': request.method,
+        'callback': getattr(callback, '__name__', callback),
+        'meta': {k: v for k, v in request.meta.items() if not k.startswith('_')},
+        'cb_kwargs': request.cb_kwargs,
+    }
+
+
+# one line per item or request of `output`, written (and flushed) as soon as
+# it comes, so that consumers can start on the results of long callbacks
+def write_jsonl(depth, source_url, output, args):
+    for x in output:
+        if isinstance(x, Request):
+            if args.nolinks:
+                continue
+            _type, data = 'request', request_to_jsonl_data(x)
+        else:
+            if args.noitems:
+                continue
+            _type, data = 'item', dict(x)
+        sys.stdout.write(json.dumps({
+            'type': _type,
+            'depth': depth,
+            'source_url': source_url,
+            'data': to_jsonable(data),
+        }) + '\n')
+        sys.stdout.flush()
+
+
+# `on_output`, if given, is called with each item and request as the
+# callback yields it
+def run_callback(response, callback, cb_kwargs=None, on_output=None):
     cb_kwargs = cb_kwargs or {}
     items, requests = [], []
 
@@ -112,6 +239,10 @@ def run_callback(response, callback, cb_kwargs=None):
             items.append(x)
         elif isinstance(x, Request):
             requests.append(x)
+        else:
+            continue
+        if on_output is not None:
+            on_output(x)
     return items, requests
 
 
@@ -126,7 +257,7 @@ def get_callback_from_rules(spider, request):
                      {'spider': spider.name})
 
 
-def set_spidercls(url_list, args):
+def set_spidercls(url_specs, first_url, args):
     global crawler_process, spidercls
     spider_loader = crawler_process.spider_loader
     if args.spider:
@@ -136,20 +267,24 @@ def set_spidercls(url_list, args):
             logger.error('Unable to find spider: %(spider)s',
                          {'spider': args.spider})
     else:
-        spidercls = spidercls_for_request(spider_loader, Request(url_list[0]))
+        spidercls = spidercls_for_request(spider_loader, Request(first_url))
         if not spidercls:
-            logger.error('Unable to find spider for: %(url)s', {'url': url_list[0]})
+            logger.error('Unable to find spider for: %(url)s', {'url': first_url})
 
-    # Request requires callback argument as callable or None, not string
-    request_list = []
-    for url in url_list:
-        request_list.append(Request(url, None))
+    # requests are only built as the engine asks for them, so the url input
+    # can be arbitrarily long
+    def _start_requests(spider):
+        for spec in url_specs:
+            # Request requires callback argument as callable or None, not string
+            request = prepare_request(spider, Request(spec['url'], None), args, spec)
+            if request is not None:
+                yield request
 
-    _start_requests = lambda s: [prepare_request(s, request, args) for request in request_list]
-    spidercls.start_requests = _start_requests
+    if spidercls:
+        spidercls.start_requests = _start_requests
 
 
-def start_parsing(url_list, args):
+def start_parsing(first_url, args):
     global crawler_process, spidercls, first_response, pcrawler
     crawler_process.crawl(spidercls, **args.spargs)
     pcrawler = list(crawler_process.crawlers)[0]
@@ -157,7 +292,40 @@ def start_parsing(url_list, args):
 
     if not first_response:
         logger.error('No response downloaded for: %(url)s',
-                     {'url': url_list[0]})
+                     {'url': first_url})
+
+
+# Each line is either a plain url or a JSON object with a "url" key and any of
+# "meta", "cb_kwargs" and "callback", which apply to that url only
+def iter_url_specs(lines):
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            try:
+                spec = json.loads(line)
+            except ValueError:
+                logger.error('Invalid JSON line in urls input: %(line)s',
+                             {'line': line})
+                continue
+        else:
+            spec = {'url': line}
+        if not is_url(spec.get('url') or ''):
+            logger.error('Invalid url in urls input: %(url)r',
+                         {'url': spec.get('url')})
+            continue
+        yield spec
+
+
+def read_urls_file(path):
+    if path == '-':
+        for line in sys.stdin:
+            yield line
+    else:
+        with open(path, 'r') as f:
+            for line in f:
+                yield line
 
 
 def process_result_for_middleware(spider, callback, items, requests):
@@ -174,9 +342,12 @@ def process_result_for_middleware(spider, callback, items, requests):
     return processed_result
 
 
-def prepare_request(spider, request, args):
+def prepare_request(spider, request, args, spec=None):
+    global homepage_cookies
+    spec = spec or {}
+
     def callback(response, **cb_kwargs):
-        global items, first_response, pcrawler
+        global first_response
         # memorize first request
         if not first_response:
             first_response = response
@@ -194,15 +365,20 @@ def prepare_request(spider, request, args):
         # parse items and requests
         depth = response.meta['_depth']
 
-        remembered_items = copy.deepcopy(items)
-        itemz, requests = run_callback(response, cb, cb_kwargs)
-        if args.pipelines:
-            itemproc = pcrawler.engine.scraper.itemproc
-            for item in itemz:
-                itemproc.process_item(item, spider)
-        # print(items)
-        add_items(depth, itemz, remembered_items)
-        add_requests(depth, requests)
+        # items go through the pipelines, and out as JSON lines, as the
+        # callback yields them
+        itemproc = pcrawler.engine.scraper.itemproc if args.pipelines else None
+
+        def on_output(x):
+            if itemproc is not None and not isinstance(x, Request):
+                itemproc.process_item(x, spider)
+            if args.jsonl:
+                write_jsonl(depth, response.url, [x], args)
+
+        itemz, requests = run_callback(response, cb, cb_kwargs, on_output)
+        if not args.jsonl:
+            add_items(depth, itemz)
+            add_requests(depth, requests)
 
         response.meta["_processed_result"] = process_result_for_middleware(spider, cb, itemz, requests)
 
@@ -222,8 +398,14 @@ def prepare_request(spider, request, args):
     if args.meta:
         request.meta.update(args.meta)
 
+    if spec.get('meta'):
+        request.meta.update(spec['meta'])
+
     if args.homepage:
-        request.cookies = get_homepage_cookies(spider, mode="parse")
+        # one visit to the homepage serves every url
+        if homepage_cookies is None:
+            homepage_cookies = get_homepage_cookies(spider, mode="parse")
+        request.cookies = homepage_cookies
 
     # update request cookies if any cookies passed through the --cookies opt
     if args.cookies:
@@ -238,8 +420,13 @@ def prepare_request(spider, request, args):
     if args.cbkwargs:
         request.cb_kwargs.update(args.cbkwargs)
 
+    if spec.get('cb_kwargs'):
+        request.cb_kwargs.update(spec['cb_kwargs'])
+
     # get real callback
-    if args.callback:
+    if spec.get('callback'):
+        cb = spec['callback']
+    elif args.callback:
         cb = args.callback
     elif args.rules and not first_response:
         if not cb:
@@ -319,12 +506,22 @@ def process_request_cb_kwargs(args):
                              "Example: --cbkwargs='{\"foo\" : \"bar\"}'", print_help=False)
 
 
-def run_command(crawl_process, url_list, args):
+def run_command(crawl_process, url_specs, args):
     # prepare spidercls
-    global crawler_process, spidercls
+    global crawler_process, items, requests
     crawler_process = crawl_process
-    set_spidercls(url_list, args)
+    items = ResultStore(args.spill_mb)
+    requests = ResultStore(args.spill_mb)
+
+    url_specs = iter(url_specs)
+    first_spec = next(url_specs, None)
+    if first_spec is None:
+        logger.error('No urls to parse')
+        return
+    url_specs = itertools.chain([first_spec], url_specs)
+    set_spidercls(url_specs, first_spec['url'], args)
 
     if spidercls and args.depth > 0:
-        start_parsing(url_list, args)
-        print_results(args)
+        start_parsing(first_spec['url'], args)
+        if not args.jsonl:
+            print_results(args)
@@ -0,0 +1,148 @@
+import os
+import sys
+import string
+from configparser import ConfigParser
+from importlib import import_module
+
+# Project discovery and settings without importing Scrapy, which takes the
+# better part of a second to import: these follow scrapy.utils.conf and
+# scrapy.utils.project, so that the commands that only deal with fixture
+# files (inspect, clear, establish) start without it.
+
+ENVVAR = 'SCRAPY_SETTINGS_MODULE'
+_VALID_ENVVARS = {'CHECK', 'PROJECT', 'PYTHON_SHELL', 'SETTINGS_MODULE'}
+
+
+def closest_scrapy_cfg(path='.', prevpath=None):
+    if path == prevpath:
+        return ''
+    path = os.path.abspath(path)
+    cfgfile = os.path.join(path, 'scrapy.cfg')
+    if os.path.exists(cfgfile):
+        return cfgfile
+    return closest_scrapy_cfg(os.path.dirname(path), path)
+
+
+def _config_sources():
+    xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or \
+        os.path.expanduser('~/.config')
+    return ['/etc/scrapy.cfg', r'c:\scrapy\scrapy.cfg',
+            xdg_config_home + '/scrapy.cfg',
+            os.path.expanduser('~/.scrapy.cfg'), closest_scrapy_cfg()]
+
+
+def init_env(project='default', set_syspath=True):
+    cfg = ConfigParser()
+    cfg.read(_config_sources())
+    if cfg.has_option('settings', project):
+        os.environ[ENVVAR] = cfg.get('settings', project)
+    closest = closest_scrapy_cfg()
+    if closest:
+        projdir = os.path.dirname(closest)
+        if set_syspath and projdir not in sys.path:
+            sys.path.append(projdir)
+
+
+def inside_project():
+    scrapy_module = os.environ.get(ENVVAR)
+    if scrapy_module is not None:
+        try:
+            import_module(scrapy_module)
+        except ImportError:
+            pass
+        else:
+            return True
+    return bool(closest_scrapy_cfg())
+
+
+def get_project_dirs():
+    outer_dir = inner_dir = ""
+    closest_cfg = closest_scrapy_cfg()
+    if closest_cfg:
+        outer_dir = os.path.dirname(closest_cfg)
+    if os.environ.get('SCRAPY_PROJECT'):
+        inner_dir = os.environ.get('SCRAPY_PROJECT')
+    if outer_dir and inner_dir:
+        return (outer_dir, inner_dir)
+
+    init_env()
+    scrapy_module = os.environ.get(ENVVAR)
+    if scrapy_module is None and not outer_dir:
+        raise Exception("Project configuration awry")
+    if not inner_dir:
+        inner_dir = scrapy_module.split('.')[0]
+    if outer_dir and inner_dir:
+        return (outer_dir, inner_dir)
+
+    try:
+        module = import_module(scrapy_module)
+        outer_dir = os.path.dirname(os.path.dirname(module.__file__))
+        return (outer_dir, inner_dir)
+    except ImportError:
+        raise Exception("Project configuration awry")
+
+
+def sanitize_module_name(module_name):
+    # as in scrapy.commands.genspider
+    module_name = module_name.replace('-', '_').replace('.', '_')
+    if module_name[0] not in string.ascii_letters:
+        module_name = "a" + module_name
+    return module_name
+
+
+# The settings in the project's settings module (and SCRAPY_* environment
+# variables), as scrapy's get_project_settings() has them at project priority, but
+# without Scrapy's defaults. Has the getters of scrapy.settings.Settings that
+# the TESTMASTER_* settings are read with.
+class ProjectSettings(object):
+    def __init__(self, values=None):
+        self.attributes = dict(values or {})
+
+    def __contains__(self, name):
+        return name in self.attributes
+
+    def __getitem__(self, name):
+        return self.attributes.get(name)
+
+    def get(self, name, default=None):
+        value = self.attributes.get(name)
+        return value if value is not None else default
+
+    def getbool(self, name, default=False):
+        got = self.get(name, default)
+        try:
+            return bool(int(got))
+        except ValueError:
+            if got in ("True", "true"):
+                return True
+            if got in ("False", "false"):
+                return False
+            raise ValueError("Supported values for boolean settings "
+                             "are 0/1, True/False, '0'/'1', "
+                             "'True'/'False' and 'true'/'false'")
+
+    def getint(self, name, default=0):
+        return int(self.get(name, default))
+
+    def getfloat(self, name, default=0.0):
+        return float(self.get(name, default))
+
+    def getlist(self, name, default=None):
+        value = self.get(name, default or [])
+        if isinstance(value, str):
+            value = value.split(',')
+        return list(value)
+
+
+def read_project_settings():
+    if ENVVAR not in os.environ:
+        init_env(os.environ.get('SCRAPY_PROJECT', 'default'))
+    values = {}
+    settings_module_path = os.environ.get(ENVVAR)
+    if settings_module_path:
+        module = import_module(settings_module_path)
+        values.update((key, getattr(module, key))
+                      for key in dir(module) if key.isupper())
+    values.update((key[7:], value) for key, value in os.environ.items()
+                  if key.startswith('SCRAPY_') and key[7:] not in _VALID_ENVVARS)
+    return ProjectSettings(values)
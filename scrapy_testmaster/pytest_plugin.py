@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from .replay import ReplayCase, fixture_test_id
+from .storage import FIXTURE_NAME_RE, SQLITE_FILENAME, SqliteStorage, get_storage
+
+GENERATED_TEST_MARKER = '# THIS IS A GENERATED FILE'
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('testmaster')
+    group.addoption(
+        '--testmaster', action='store_true', dest='testmaster',
+        help='collect every testmaster fixture as a test of its own')
+    group.addoption(
+        '--testmaster-server', action='store_true', dest='testmaster_server',
+        help="replay the collected fixtures in the running 'testmaster serve' "
+             "process of the project")
+    group.addoption(
+        '--testmaster-collect-all', nargs='?', type=int, const=True, default=0,
+        dest='testmaster_collect_all', metavar='N',
+        help='keep comparing the callback output of a fixture after a '
+             'mismatch, up to N mismatches (default 20)')
+    parser.addini(
+        'testmaster', type='bool', default=False,
+        help='collect every testmaster fixture as a test of its own')
+
+
+def _enabled(config):
+    return config.getoption('testmaster') or config.getini('testmaster')
+
+
+def pytest_ignore_collect(collection_path, config):
+    # the generated unittest modules would replay the very same fixtures
+    if not _enabled(config) or collection_path.name != 'test_fixtures.py':
+        return None
+    try:
+        with open(str(collection_path), 'r') as f:
+            first_line = f.readline()
+    except OSError:
+        return None
+    if first_line.startswith(GENERATED_TEST_MARKER):
+        return True
+    return None
+
+
+def pytest_collect_file(file_path, parent):
+    if not _enabled(parent.config):
+        return None
+    if FIXTURE_NAME_RE.match(file_path.name):
+        return FixtureFile.from_parent(parent, path=file_path)
+    if file_path.name == SQLITE_FILENAME and \
+            isinstance(get_storage(), SqliteStorage):
+        return SqliteFixtureFile.from_parent(parent, path=file_path)
+    return None
+
+
+class FixtureFile(pytest.File):
+    def collect(self):
+        # only file metadata is looked at here; the fixture is decompressed
+        # and unpickled when the test actually runs
+        yield FixtureItem.from_parent(
+            self, name=fixture_test_id(str(self.path)),
+            fixture_path=str(self.path),
+            size=os.stat(str(self.path)).st_size)
+
+
+class SqliteFixtureFile(pytest.File):
+    def collect(self):
+        storage = get_storage()
+        for fixture_path in storage.iter_paths(os.path.dirname(str(self.path))):
+            yield FixtureItem.from_parent(
+                self, name=fixture_test_id(fixture_path),
+                fixture_path=fixture_path, size=storage.size(fixture_path))
+
+
+class FixtureItem(pytest.Item):
+    def __init__(self, *, fixture_path, size=0, **kwargs):
+        super().__init__(**kwargs)
+        self.fixture_path = fixture_path
+        self.size = size
+        self.user_properties.append(('fixture_size', size))
+
+    def runtest(self):
+        if self.config.getoption('testmaster_server'):
+            return self._runtest_on_server()
+        from .utils import generate_test
+        test = generate_test(
+            self.fixture_path,
+            collect_all=self.config.getoption('testmaster_collect_all'))
+        test(ReplayCase())
+
+    def _runtest_on_server(self):
+        from .server import ReplayClient, default_socket_path
+        from .project import get_project_dirs
+        client = ReplayClient(default_socket_path(get_project_dirs()[0]))
+        response = client.request(
+            'replay', paths=[os.path.abspath(self.fixture_path)],
+            collect_all=self.config.getoption('testmaster_collect_all'))
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        result = response['results'][0]
+        if result['outcome'] != 'passed':
+            raise AssertionError(result['message'])
+
+    def repr_failure(self, excinfo):
+        from scrapy.exceptions import _InvalidOutput
+        if isinstance(excinfo.value, (AssertionError, _InvalidOutput)):
+            return str(excinfo.value)
+        return super().repr_failure(excinfo)
+
+    def reportinfo(self):
+        return self.path, None, self.name
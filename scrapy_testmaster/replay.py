@@ -0,0 +1,162 @@
+import os
+import re
+import sys
+import json
+import heapq
+import time
+import unittest
+
+from .storage import get_storage
+from .utils_novel import atomic_write
+
+TIMINGS_FILE = 'timings.json'
+
+
+def iter_fixture_paths(test_dir):
+    return get_storage().iter_paths(test_dir)
+
+
+# spider/callback/fixtureN (with the extra path, if any, in the middle),
+# relative to the closest 'tests' dir
+def fixture_test_id(path):
+    parts = os.path.normpath(path).split(os.sep)
+    try:
+        start = len(parts) - parts[::-1].index('tests')
+    except ValueError:
+        start = len(parts) - 3
+    parts = parts[start:-1] + [os.path.splitext(parts[-1])[0]]
+    return '/'.join(parts)
+
+
+def load_timings(test_dir):
+    path = os.path.join(test_dir, TIMINGS_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def save_timings(test_dir, new_timings):
+    timings = load_timings(test_dir)
+    timings.update(new_timings)
+    with atomic_write(os.path.join(test_dir, TIMINGS_FILE)) as tmp_path, \
+            open(tmp_path, 'w') as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
+
+
+# Expected replay cost per fixture: the last recorded duration where there is
+# one. Fixtures without history are estimated from their size on disk, scaled
+# by the seconds-per-byte of the fixtures that do have history (or just by
+# their size if none do).
+def estimate_costs(fixture_paths):
+    storage = get_storage()
+    timings_cache = {}
+    known, unknown = {}, {}
+    for path in fixture_paths:
+        test_dir, name = os.path.split(path)
+        if test_dir not in timings_cache:
+            timings_cache[test_dir] = load_timings(test_dir)
+        duration = timings_cache[test_dir].get(name)
+        size = storage.size(path)
+        if duration is not None:
+            known[path] = (duration, size)
+        else:
+            unknown[path] = size
+
+    costs = {path: duration for path, (duration, _) in known.items()}
+    known_size = sum(size for _, size in known.values())
+    rate = sum(costs.values()) / known_size if known_size else 1.0
+    for path, size in unknown.items():
+        costs[path] = size * rate
+    return costs
+
+
+def parse_shard_arg(shard):
+    match = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', shard or '')
+    if not match:
+        raise ValueError("Shard must be given as i/N, e.g. 2/8")
+    index, total = int(match.group(1)), int(match.group(2))
+    if total < 1 or not 1 <= index <= total:
+        raise ValueError("Shard index must be between 1 and N")
+    return index, total
+
+
+# Greedy bin-packing (longest processing time first): fixtures are taken in
+# order of decreasing cost and each goes to the least loaded shard. Ties are
+# broken on the path, so every runner computes the same assignment.
+def assign_shards(fixture_paths, num_shards):
+    costs = estimate_costs(fixture_paths)
+    shards = [[] for _ in range(num_shards)]
+    loads = [(0.0, i) for i in range(num_shards)]
+    heapq.heapify(loads)
+    for path in sorted(costs, key=lambda p: (-costs[p], p)):
+        load, i = heapq.heappop(loads)
+        shards[i].append(path)
+        heapq.heappush(loads, (load + costs[path], i))
+    return [sorted(shard) for shard in shards]
+
+
+# Only there for the assertions of the tests generate_test makes, when the
+# replay isn't run as a test case of its own (pytest items, minimization...)
+class ReplayCase(unittest.TestCase):
+    maxDiff = None
+
+    def runTest(self):
+        pass
+
+
+class FixtureTestCase(unittest.TestCase):
+    maxDiff = None
+
+    def __init__(self, fixture_path, timings=None, data=None, collect_all=0):
+        super(FixtureTestCase, self).__init__()
+        self.fixture_path = fixture_path
+        self.timings = timings if timings is not None else {}
+        self.data = data
+        self.collect_all = collect_all
+
+    def id(self):
+        return fixture_test_id(self.fixture_path)
+
+    def __str__(self):
+        return self.id()
+
+    def shortDescription(self):
+        return None
+
+    def runTest(self):
+        from .utils import generate_test
+        start = time.perf_counter()
+        try:
+            test = generate_test(os.path.abspath(self.fixture_path),
+                                 data=self.data, collect_all=self.collect_all)
+            test(self)
+        finally:
+            self.timings[self.fixture_path] = time.perf_counter() - start
+
+
+def run_fixtures(fixture_paths, verbosity=2, record_timings=True,
+                 collect_all=0):
+    timings = {}
+    suite = unittest.TestSuite(
+        FixtureTestCase(path, timings, collect_all=collect_all)
+        for path in fixture_paths)
+    result = unittest.TextTestRunner(
+        stream=sys.stderr, verbosity=verbosity).run(suite)
+
+    if record_timings:
+        save_fixture_timings(timings)
+    return result
+
+
+# {fixture path: duration} -> the timings.json of each callback dir
+def save_fixture_timings(timings):
+    by_dir = {}
+    for path, duration in timings.items():
+        test_dir, name = os.path.split(path)
+        by_dir.setdefault(test_dir, {})[name] = round(duration, 6)
+    for test_dir, dir_timings in by_dir.items():
+        save_timings(test_dir, dir_timings)
@@ -0,0 +1,277 @@
+import os
+import sys
+import stat
+import json
+import time
+import socket
+import hashlib
+import logging
+import tempfile
+import importlib
+import traceback
+import socketserver
+
+from scrapy.exceptions import _InvalidOutput
+
+from .drift import static_update
+from .replay import FixtureTestCase, fixture_test_id, iter_fixture_paths
+from .storage import get_storage
+from .utils import load_fixture_data, to_jsonable
+
+logger = logging.getLogger(__name__)
+
+
+# One socket per project and user, in the temp dir to keep clear of the
+# length limit on unix socket paths. The socket is in a dir of its own, which
+# the server creates private to the user, since anyone who can connect to it
+# can run the project's code.
+def default_socket_path(project_dir):
+    digest = hashlib.sha1(os.path.abspath(project_dir).encode('utf-8')).hexdigest()
+    return os.path.join(
+        tempfile.gettempdir(),
+        'testmaster-%s-%s' % (os.getuid(), digest[:12]),
+        'server.sock')
+
+
+class ModuleReloader(object):
+    # Tracks the modules imported from the project dir and, when asked,
+    # reloads those whose source changed since, along with the project
+    # modules that hold references to them (e.g. spider modules importing
+    # from a changed helper module).
+    def __init__(self, project_dir):
+        self.project_dir = os.path.abspath(project_dir) + os.sep
+        self.mtimes = {}
+        self.snapshot()
+
+    def _project_modules(self):
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None)
+            if path and os.path.abspath(path).startswith(self.project_dir):
+                yield name, module, path
+
+    def snapshot(self):
+        for name, module, path in self._project_modules():
+            if name not in self.mtimes:
+                self.mtimes[name] = _mtime(path)
+
+    def _dependents(self, changed):
+        dependents = []
+        for name, module, _ in self._project_modules():
+            if name in changed:
+                continue
+            for value in vars(module).values():
+                source = value.__name__ if isinstance(value, type(sys)) \
+                    else getattr(value, '__module__', None)
+                if source in changed:
+                    dependents.append(name)
+                    break
+        return dependents
+
+    # the modules to reload: those changed and their dependents
+    def find_changed(self):
+        changed = [name for name, module, path in self._project_modules()
+                   if name in self.mtimes and _mtime(path) != self.mtimes[name]]
+        if not changed:
+            return []
+        return changed + self._dependents(set(changed))
+
+    def reload(self, names):
+        for name in names:
+            importlib.reload(sys.modules[name])
+            self.mtimes[name] = _mtime(sys.modules[name].__file__)
+        self.snapshot()
+
+    def reload_changed(self):
+        reloaded = self.find_changed()
+        self.reload(reloaded)
+        return reloaded
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def replay_fixture(fixture_path, data=None, collect_all=0):
+    start = time.perf_counter()
+    result = {'path': fixture_path, 'id': fixture_test_id(fixture_path)}
+    try:
+        FixtureTestCase(fixture_path, data=data,
+                        collect_all=collect_all).runTest()
+        result['outcome'] = 'passed'
+    except (AssertionError, _InvalidOutput) as e:
+        result['outcome'] = 'failed'
+        result['message'] = str(e)
+    except Exception:
+        result['outcome'] = 'error'
+        result['message'] = traceback.format_exc()
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+# The dir of the socket must be the user's own: a real dir (not a symlink)
+# that nobody else can write to, or list, since the default one has a
+# predictable name in the temp dir that someone else could have made first
+def check_socket_dir(socket_dir):
+    st = os.lstat(socket_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+            stat.S_IMODE(st.st_mode) != 0o700:
+        raise ValueError(
+            "The socket dir %s must be a dir of your own with mode 0700 "
+            "(not a symlink)" % socket_dir)
+
+
+def _is_listening(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+# Requests may only name fixtures (or dirs of them) in the project's tests
+# dir, symlinks resolved
+def check_path(path, tests_dir):
+    real_path = os.path.realpath(path)
+    real_tests_dir = os.path.realpath(tests_dir)
+    if real_path != real_tests_dir and \
+            not real_path.startswith(real_tests_dir + os.sep):
+        raise ValueError("'%s' is not in the tests dir %s" % (path, tests_dir))
+    return path
+
+
+def _expand_paths(paths, tests_dir):
+    for path in paths:
+        check_path(path, tests_dir)
+        if get_storage().exists(path):
+            yield path
+        else:
+            for fixture_path in iter_fixture_paths(path):
+                yield fixture_path
+
+
+class ReplayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line.decode('utf-8'))
+                response = self.server.dispatch(message)
+            except Exception as e:
+                response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if response.get('shutdown'):
+                self.server.shutdown_requested = True
+                break
+
+
+# Keeps the project imported between requests, which are JSON lines over a
+# unix socket: {"command": ..., ...}, answered with {"ok": ..., ...}. Requests
+# are handled one at a time, since spider modules may be reloaded in between.
+class ReplayServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path, project_dir, tests_dir=None):
+        socket_dir = os.path.dirname(os.path.abspath(socket_path))
+        if not os.path.lexists(socket_dir):
+            os.makedirs(socket_dir, mode=0o700)
+        check_socket_dir(socket_dir)
+        if os.path.lexists(socket_path):
+            if _is_listening(socket_path):
+                raise ValueError("A testmaster server is already running on %s"
+                                 % socket_path)
+            # left over by a server that didn't shut down cleanly
+            os.remove(socket_path)
+        super(ReplayServer, self).__init__(socket_path, ReplayHandler)
+        self.socket_path = socket_path
+        self.tests_dir = tests_dir or os.path.join(project_dir, 'testmaster', 'tests')
+        self.reloader = ModuleReloader(project_dir)
+        self.shutdown_requested = False
+
+    def server_bind(self):
+        # only the user may connect, from the moment the socket exists
+        umask = os.umask(0o177)
+        try:
+            super(ReplayServer, self).server_bind()
+        finally:
+            os.umask(umask)
+
+    def dispatch(self, message):
+        command = message.get('command')
+        handler = getattr(self, 'do_%s' % command, None)
+        if handler is None:
+            return {'ok': False, 'error': "Unknown command '%s'" % command}
+        reloaded = self.reloader.reload_changed()
+        if reloaded:
+            logger.info("Reloaded %s", ', '.join(reloaded))
+        try:
+            response = handler(message)
+        finally:
+            # track the modules first imported by this request
+            self.reloader.snapshot()
+        response.setdefault('ok', True)
+        response['reloaded'] = reloaded
+        return response
+
+    def do_ping(self, message):
+        return {'pid': os.getpid()}
+
+    def do_replay(self, message):
+        collect_all = message.get('collect_all', 0)
+        return {'results': [replay_fixture(path, collect_all=collect_all)
+                            for path in _expand_paths(message.get('paths', []),
+                                                      self.tests_dir)]}
+
+    def do_inspect(self, message):
+        path = check_path(message['path'], self.tests_dir)
+        return {'data': to_jsonable(load_fixture_data(path))}
+
+    def do_update(self, message):
+        write = not message.get('dry_run', False)
+        return {'records': [static_update(path, write=write) for path in
+                            _expand_paths(message.get('paths', []),
+                                          self.tests_dir)]}
+
+    def do_shutdown(self, message):
+        return {'shutdown': True}
+
+    def serve(self):
+        try:
+            while not self.shutdown_requested:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class ReplayClient(object):
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def is_running(self):
+        try:
+            return self.request('ping').get('ok', False)
+        except (OSError, ValueError):
+            return False
+
+    def request(self, command, **kwargs):
+        kwargs['command'] = command
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+            with sock.makefile('rb') as f:
+                line = f.readline()
+        finally:
+            sock.close()
+        if not line:
+            raise ValueError("No response from the testmaster server")
+        return json.loads(line.decode('utf-8'))
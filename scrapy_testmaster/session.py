@@ -0,0 +1,78 @@
+import atexit
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+
+from .project import read_project_settings
+from .utils import build_middlewares, get_replay_settings, set_spider_attrs
+
+# Sent with the spider before each fixture replayed in a session, for the
+# middlewares, extensions and pipelines that keep state between responses
+# to reset it: crawler.signals.connect(self.reset, signal=fixture_reset)
+fixture_reset = object()
+
+
+# Replays with TESTMASTER_REPLAY_SESSION enabled share a crawler, a spider
+# and its middleware chain per spider class, recorded settings and middleware
+# list. They are set up, and the spider opened, by the first fixture that
+# needs them; the spider is closed when the process exits. Before each
+# fixture the spider's attributes are restored to what they were once it was
+# opened, and fixture_reset is sent.
+class ReplaySession(object):
+    def __init__(self):
+        self.entries = {}
+        self.snapshots = {}
+
+    def open(self, data, fixture_path):
+        # -> (crawler, spider, settings, middlewares) to replay `data` with
+        spider_cls, settings = get_replay_settings(data, fixture_path)
+        key = (spider_cls, repr(sorted(data.get('settings', {}).items())),
+               tuple(data['middlewares']))
+        if key not in self.entries:
+            self._close_stale(spider_cls)
+            crawler = Crawler(spider_cls, settings)
+            spider = spider_cls.from_crawler(crawler)
+            crawler.spider = spider
+            middlewares = build_middlewares(data['middlewares'], settings, crawler)
+            crawler.signals.send_catch_log(
+                signal=signals.spider_opened, spider=spider)
+            self.snapshots[spider] = dict(spider.__dict__)
+            self.entries[key] = (crawler, spider, settings, middlewares)
+        return self.entries[key]
+
+    def reset(self, spider, spider_args):
+        spider.__dict__.clear()
+        spider.__dict__.update(self.snapshots[spider])
+        set_spider_attrs(spider, spider_args)
+        spider.crawler.signals.send_catch_log(signal=fixture_reset, spider=spider)
+
+    def _close_stale(self, spider_cls):
+        # the spiders of a module since reloaded (`testmaster serve`/`watch`)
+        for key in list(self.entries):
+            if key[0] is not spider_cls and key[0].name == spider_cls.name:
+                self._close(self.entries.pop(key))
+
+    def _close(self, entry):
+        crawler, spider = entry[:2]
+        crawler.signals.send_catch_log(
+            signal=signals.spider_closed, spider=spider, reason='finished')
+        self.snapshots.pop(spider, None)
+
+    def close(self):
+        while self.entries:
+            self._close(self.entries.popitem()[1])
+
+
+_session = None
+
+
+# The process's replay session, or None if TESTMASTER_REPLAY_SESSION isn't
+# enabled in the project settings
+def get_replay_session():
+    global _session
+    if _session is None:
+        _session = False
+        if read_project_settings().getbool('TESTMASTER_REPLAY_SESSION'):
+            _session = ReplaySession()
+            atexit.register(_session.close)
+    return _session or None
@@ -0,0 +1,86 @@
+import re
+import hashlib
+
+from scrapy.http import HtmlResponse, TextResponse
+
+from .admission import load_view_field
+
+SHINGLE_SIZE = 3
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+TEXT_XPATH = '//body//text()[not(ancestor::script) and not(ancestor::style)]'
+
+
+def _hash_token(token):
+    return int.from_bytes(
+        hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text):
+    tokens = TOKEN_RE.findall(text.lower())
+    if len(tokens) >= SHINGLE_SIZE:
+        shingles = {' '.join(tokens[i:i + SHINGLE_SIZE])
+                    for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    else:
+        shingles = {' '.join(tokens)}
+    bits = [format(_hash_token(s), '064b') for s in shingles]
+    threshold = len(bits) / 2.0
+    fingerprint = 0
+    # zip(*bits) walks the hashes column by column, i.e. bit by bit
+    for column in zip(*bits):
+        fingerprint = (fingerprint << 1) | (column.count('1') > threshold)
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def response_text(response, source='body'):
+    if source == 'text' and isinstance(response, HtmlResponse):
+        return ' '.join(response.xpath(TEXT_XPATH).getall())
+    if isinstance(response, TextResponse):
+        return response.text
+    return response.body.decode('utf-8', 'replace')
+
+
+# Skips responses whose SimHash fingerprint is within the given Hamming
+# distance of that of a fixture already stored for the callback. The
+# fingerprints of stored fixtures are kept in view.json, so that the
+# deduplication holds across crawl runs.
+class NearDuplicateFilter(object):
+    def __init__(self, max_distance, source='body'):
+        self.max_distance = max_distance
+        self.source = source
+        self.fingerprints = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        max_distance = settings.get('TESTMASTER_SIMHASH_DISTANCE')
+        if max_distance is None or max_distance == '':
+            return None
+        return cls(int(max_distance),
+                   settings.get('TESTMASTER_SIMHASH_SOURCE', 'body'))
+
+    def _load(self, test_dir, callback_name):
+        if callback_name not in self.fingerprints:
+            self.fingerprints[callback_name] = {
+                index: int(fp, 16)
+                for index, fp in load_view_field(test_dir, 'simhash').items()
+                if fp
+            }
+        return self.fingerprints[callback_name]
+
+    def fingerprint(self, response):
+        return simhash(response_text(response, self.source))
+
+    def find_near_duplicate(self, test_dir, callback_name, fingerprint):
+        for index, stored in self._load(test_dir, callback_name).items():
+            if hamming_distance(fingerprint, stored) <= self.max_distance:
+                return index
+        return None
+
+    def add(self, callback_name, index, fingerprint):
+        self.fingerprints.setdefault(callback_name, {})[index] = fingerprint
+
+    def view_fields(self, fingerprint):
+        return {'simhash': '%016x' % fingerprint}
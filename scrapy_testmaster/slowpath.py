@@ -0,0 +1,72 @@
+import os
+import time
+import heapq
+
+from .admission import _first_free_index, load_view_field
+from .utils_novel import SLOW_FIXTURES_DIR
+
+
+class CallbackTimer(object):
+    # Wall and CPU time, in seconds, spent while active (added up over the
+    # times it was)
+    def __init__(self):
+        self.wall = self.cpu = 0.0
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall += time.perf_counter() - self._wall
+        self.cpu += time.process_time() - self._cpu
+        return False
+
+
+def slow_fixtures_dir(test_dir):
+    return os.path.join(test_dir, SLOW_FIXTURES_DIR)
+
+
+# Keeps the `size` slowest responses of each callback (by the wall time of the
+# callback, output drained) as performance fixtures, in the slow/ subdir of
+# the callback dir. A min-heap of (wall_ms, index) per callback is seeded from
+# the view.json of that dir, so the slowest are kept over all crawls.
+class SlowResponses(object):
+    def __init__(self, size):
+        self.size = size
+        self.heaps = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        size = settings.getint('TESTMASTER_SLOW_FIXTURES', 0)
+        if size <= 0:
+            return None
+        return cls(size)
+
+    def _load(self, slow_dir, callback_name):
+        if callback_name not in self.heaps:
+            heap = [(wall_ms, index) for index, wall_ms
+                    in load_view_field(slow_dir, 'wall_ms').items()
+                    if wall_ms is not None]
+            heapq.heapify(heap)
+            self.heaps[callback_name] = heap
+        return self.heaps[callback_name]
+
+    def admit(self, slow_dir, callback_name, timer):
+        # -> the index to record the response under, or None
+        wall_ms = round(timer.wall * 1000, 3)
+        heap = self._load(slow_dir, callback_name)
+        if len(heap) < self.size:
+            index = _first_free_index({i for _, i in heap})
+            heapq.heappush(heap, (wall_ms, index))
+            return index
+        if wall_ms > heap[0][0]:
+            return heapq.heapreplace(heap, (wall_ms, heap[0][1]))[1]
+        return None
+
+    def view_fields(self, timer):
+        return {
+            'performance': True,
+            'wall_ms': round(timer.wall * 1000, 3),
+            'cpu_ms': round(timer.cpu * 1000, 3),
+        }
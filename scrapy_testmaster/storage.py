@@ -0,0 +1,388 @@
+import os
+import re
+import time
+import zlib
+import pickle
+
+from .project import get_project_dirs, read_project_settings
+
+FIXTURE_NAME_RE = re.compile(r'^fixture(\d+)\.bin$')
+SQLITE_FILENAME = 'fixtures.sqlite'
+
+
+def fixture_name(fixture_num):
+    return 'fixture%s.bin' % fixture_num
+
+
+def _split_fixture_path(fixture_path):
+    test_dir, name = os.path.split(fixture_path)
+    match = FIXTURE_NAME_RE.match(name)
+    if not match:
+        raise ValueError("Not a fixture path: %s" % fixture_path)
+    return test_dir, int(match.group(1))
+
+
+# Storage backends hold the (compressed, pickled) fixture blobs. Whatever the
+# backend, fixtures are identified by their path as in the default layout,
+# i.e. <callback dir>/fixtureN.bin, so that the callback dir (with its
+# config.py and view.json) is always where the rest of the code expects it.
+class FileStorage(object):
+    def __init__(self, settings):
+        self.settings = settings
+
+    def save(self, fixture_path, blob, data):
+        with open(fixture_path, 'wb') as f:
+            f.write(blob)
+
+    def load(self, fixture_path):
+        with open(str(fixture_path), 'rb') as f:
+            return f.read()
+
+    def exists(self, fixture_path):
+        return os.path.isfile(fixture_path)
+
+    def size(self, fixture_path):
+        return os.path.getsize(fixture_path)
+
+    def delete(self, fixture_path):
+        os.remove(fixture_path)
+
+    def rename(self, fixture_path, new_path):
+        os.rename(fixture_path, new_path)
+
+    def iter_paths(self, test_dir, recursive=True):
+        if not os.path.isdir(test_dir):
+            return
+        for root, dirs, files in os.walk(test_dir):
+            dirs.sort()
+            for name in sorted(files, key=_fixture_sort_key):
+                if FIXTURE_NAME_RE.match(name):
+                    yield os.path.join(root, name)
+            if not recursive:
+                break
+
+    def count(self, test_dir):
+        return sum(1 for _ in self.iter_paths(test_dir, recursive=False))
+
+    # (path, metadata) for each fixture, where the url and status come from
+    # view.json and the recording time is the file's mtime
+    def iter_records(self, test_dir):
+        from .utils_novel import load_view
+        views = {}
+        for path in self.iter_paths(test_dir):
+            callback_dir, fixture_num = _split_fixture_path(path)
+            if callback_dir not in views:
+                views[callback_dir] = load_view(callback_dir)
+            entry = views[callback_dir].get(str(fixture_num), {})
+            stat = os.stat(path)
+            yield path, {
+                'url': entry.get('request', {}).get('url'),
+                'status': entry.get('status'),
+                'recorded_at': stat.st_mtime,
+                'size': stat.st_size,
+            }
+
+
+def _fixture_sort_key(name):
+    match = FIXTURE_NAME_RE.match(name)
+    return (int(match.group(1)) if match else 0, name)
+
+
+# One SQLite database per spider (<tests dir>/<spider>/fixtures.sqlite), with
+# a row per fixture keyed on the callback dir (relative to the spider dir, so
+# including any extra path) and the fixture number. Counting and listing are
+# indexed queries rather than directory scans, and the metadata columns can
+# be queried without unpickling anything.
+class SqliteStorage(object):
+    SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS fixtures (
+            callback TEXT NOT NULL,
+            fixture_num INTEGER NOT NULL,
+            url TEXT,
+            status INTEGER,
+            body_size INTEGER,
+            data_size INTEGER,
+            content_hash TEXT,
+            created_at REAL,
+            updated_at REAL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (callback, fixture_num)
+        )''',
+        'CREATE INDEX IF NOT EXISTS fixtures_url ON fixtures (url)',
+        'CREATE INDEX IF NOT EXISTS fixtures_status ON fixtures (status)',
+        'CREATE INDEX IF NOT EXISTS fixtures_content_hash '
+        'ON fixtures (content_hash)',
+    )
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._tests_dir = None
+        self._connections = {}
+        self._pid = os.getpid()
+
+    @property
+    def tests_dir(self):
+        if self._tests_dir is None:
+            base_path = self.settings.get('TESTMASTER_BASE_PATH')
+            if not base_path:
+                base_path = os.path.join(get_project_dirs()[0], 'testmaster')
+            self._tests_dir = os.path.abspath(os.path.join(base_path, 'tests'))
+        return self._tests_dir
+
+    def _locate(self, test_dir):
+        # -> (spider dir, callback dir relative to it), either may be ''
+        rel = os.path.relpath(os.path.abspath(test_dir), self.tests_dir)
+        if rel == os.curdir:
+            return '', ''
+        if rel.startswith(os.pardir):
+            raise ValueError("%s is outside of the testmaster tests dir %s" % (
+                test_dir, self.tests_dir))
+        parts = rel.split(os.sep)
+        return (os.path.join(self.tests_dir, parts[0]),
+                '/'.join(parts[1:]))
+
+    def _connect(self, spider_dir, create=False):
+        if self._pid != os.getpid():
+            # connections can't be used across a fork, so a forked process
+            # opens its own
+            self._connections = {}
+            self._pid = os.getpid()
+        if spider_dir not in self._connections:
+            db_path = os.path.join(spider_dir, SQLITE_FILENAME)
+            if not create and not os.path.exists(db_path):
+                return None
+            import sqlite3
+            conn = sqlite3.connect(db_path, timeout=30)
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._connections[spider_dir] = conn
+        return self._connections[spider_dir]
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections = {}
+
+    def _key(self, fixture_path):
+        test_dir, fixture_num = _split_fixture_path(fixture_path)
+        spider_dir, callback = self._locate(test_dir)
+        if not callback:
+            raise ValueError("Not a fixture path: %s" % fixture_path)
+        return spider_dir, callback, fixture_num
+
+    def _fetch(self, fixture_path, column):
+        spider_dir, callback, fixture_num = self._key(fixture_path)
+        conn = self._connect(spider_dir)
+        if conn is None:
+            return None
+        return conn.execute(
+            'SELECT %s FROM fixtures WHERE callback = ? AND fixture_num = ?'
+            % column, (callback, fixture_num)).fetchone()
+
+    def save(self, fixture_path, blob, data):
+        import hashlib
+        spider_dir, callback, fixture_num = self._key(fixture_path)
+        response = data.get('response', {})
+        body = response.get('body') or b''
+        now = time.time()
+        values = (data.get('request', {}).get('url'), response.get('status'),
+                  len(body), len(blob), hashlib.sha1(body).hexdigest(), now,
+                  blob)
+        conn = self._connect(spider_dir, create=True)
+        # update, else insert, rather than an upsert, which needs SQLite 3.24
+        # (INSERT OR REPLACE would lose created_at)
+        with conn:
+            updated = conn.execute(
+                '''UPDATE fixtures SET url = ?, status = ?, body_size = ?,
+                       data_size = ?, content_hash = ?, updated_at = ?,
+                       data = ?
+                   WHERE callback = ? AND fixture_num = ?''',
+                values + (callback, fixture_num)).rowcount
+            if not updated:
+                conn.execute(
+                    '''INSERT INTO fixtures (url, status, body_size,
+                           data_size, content_hash, updated_at, data,
+                           callback, fixture_num, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    values + (callback, fixture_num, now))
+
+    def load(self, fixture_path):
+        row = self._fetch(fixture_path, 'data')
+        if row is None:
+            raise IOError("No such fixture: %s" % fixture_path)
+        return bytes(row[0])
+
+    def exists(self, fixture_path):
+        return self._fetch(fixture_path, '1') is not None
+
+    def size(self, fixture_path):
+        row = self._fetch(fixture_path, 'data_size')
+        if row is None:
+            raise IOError("No such fixture: %s" % fixture_path)
+        return row[0]
+
+    def delete(self, fixture_path):
+        spider_dir, callback, fixture_num = self._key(fixture_path)
+        conn = self._connect(spider_dir)
+        if conn is None:
+            raise IOError("No such fixture: %s" % fixture_path)
+        with conn:
+            conn.execute(
+                'DELETE FROM fixtures WHERE callback = ? AND fixture_num = ?',
+                (callback, fixture_num))
+
+    def rename(self, fixture_path, new_path):
+        spider_dir, callback, fixture_num = self._key(fixture_path)
+        new_spider_dir, new_callback, new_num = self._key(new_path)
+        if new_spider_dir != spider_dir:
+            raise ValueError("Can't move fixtures across spiders")
+        conn = self._connect(spider_dir)
+        with conn:
+            conn.execute(
+                '''UPDATE fixtures SET callback = ?, fixture_num = ?
+                   WHERE callback = ? AND fixture_num = ?''',
+                (new_callback, new_num, callback, fixture_num))
+
+    def _spider_dirs(self, spider_dir):
+        if spider_dir:
+            return [spider_dir]
+        if not os.path.isdir(self.tests_dir):
+            return []
+        return [os.path.join(self.tests_dir, name)
+                for name in sorted(os.listdir(self.tests_dir))]
+
+    def _select(self, test_dir, columns, recursive=True):
+        spider_dir, callback = self._locate(test_dir)
+        for spider_dir in self._spider_dirs(spider_dir):
+            conn = self._connect(spider_dir)
+            if conn is None:
+                continue
+            if not callback:
+                where, args = ('1', ()) if recursive else ('0', ())
+            elif recursive:
+                # the callback and the subdirs of it, i.e. those starting
+                # with callback + '/' ('0' being the character after '/')
+                where, args = ('callback = ? OR (callback >= ? AND callback < ?)',
+                               (callback, callback + '/', callback + '0'))
+            else:
+                where, args = 'callback = ?', (callback,)
+            rows = conn.execute(
+                'SELECT callback, fixture_num%s FROM fixtures WHERE %s '
+                'ORDER BY callback, fixture_num' % (
+                    ''.join(', ' + c for c in columns), where), args)
+            for row in rows.fetchall():
+                cb, fixture_num = row[:2]
+                path = os.path.join(
+                    spider_dir, *(cb.split('/') + [fixture_name(fixture_num)]))
+                yield path, row[2:]
+
+    def iter_paths(self, test_dir, recursive=True):
+        for path, _ in self._select(test_dir, (), recursive=recursive):
+            yield path
+
+    def iter_records(self, test_dir):
+        columns = ('url', 'status', 'updated_at', 'data_size')
+        for path, (url, status, updated_at, size) in self._select(test_dir, columns):
+            yield path, {'url': url, 'status': status,
+                         'recorded_at': updated_at, 'size': size}
+
+    def count(self, test_dir):
+        spider_dir, callback = self._locate(test_dir)
+        conn = self._connect(spider_dir) if spider_dir else None
+        if conn is None or not callback:
+            return 0
+        return conn.execute(
+            'SELECT COUNT(*) FROM fixtures WHERE callback = ?',
+            (callback,)).fetchone()[0]
+
+
+STORAGE_BACKENDS = {
+    'files': FileStorage,
+    'sqlite': SqliteStorage,
+}
+
+_default_storage = None
+
+
+# Without settings, the storage set in the project settings module (read
+# without importing Scrapy)
+def get_storage(settings=None):
+    global _default_storage
+    if settings is None:
+        if _default_storage is None:
+            _default_storage = get_storage(read_project_settings())
+        return _default_storage
+    name = settings.get('TESTMASTER_STORAGE', 'files')
+    storage_cls = STORAGE_BACKENDS.get(name)
+    if storage_cls is None:
+        from scrapy.utils.misc import load_object
+        storage_cls = load_object(name)
+    return storage_cls(settings)
+
+
+# Closes whatever the default storage has open (e.g. sqlite connections), so
+# that processes forked next don't inherit it
+def reset_default_storage():
+    global _default_storage
+    if _default_storage is not None and hasattr(_default_storage, 'close'):
+        _default_storage.close()
+    _default_storage = None
+
+
+_worker_storage = (None, None)
+
+
+# The storage of the current worker process of a pool, if it was set up by a
+# WorkerTask. Each process opens its own, on its first task (rather than in
+# the initializer of the pool, which needs Python 3.7).
+def get_worker_storage(settings=None):
+    global _worker_storage
+    pid, storage = _worker_storage
+    if pid != os.getpid():
+        storage = get_storage(settings) if settings is not None else None
+        _worker_storage = (os.getpid(), storage)
+    return storage
+
+
+# Wraps `func` for a process pool, setting up the worker storage before each
+# call (`func` must be picklable, e.g. a module-level function)
+class WorkerTask(object):
+    def __init__(self, func, settings):
+        self.func = func
+        self.settings = settings
+
+    def __call__(self, *args):
+        get_worker_storage(self.settings)
+        return self.func(*args)
+
+
+def compress_data(data):
+    return zlib.compress(data)
+
+
+def decompress_data(data):
+    return zlib.decompress(data)
+
+
+def pickle_data(data):
+    return pickle.dumps(data, protocol=2)
+
+
+def unpickle_data(data, encoding):
+    return pickle.loads(data, encoding=encoding)
+
+
+def load_fixture_data(fixture_path, encoding="utf-8", storage=None):
+    raw_data = (storage or get_storage()).load(fixture_path)
+    return decode_fixture_data(raw_data, encoding)
+
+
+def decode_fixture_data(raw_data, encoding="utf-8"):
+    fixture_info = unpickle_data(decompress_data(raw_data), encoding)
+    if 'fixture_version' in fixture_info:
+        encoding = fixture_info['encoding']
+        data = unpickle_data(fixture_info['data'], encoding)
+    else:
+        data = fixture_info  # legacy tests
+    return data
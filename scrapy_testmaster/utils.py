@@ -1,14 +1,32 @@
 import os
+import re
 import sys
 import copy
-import zlib
-import pickle
 import json
 import shutil
+import tracemalloc
 from importlib import import_module
 from itertools import islice
 
-from .utils_novel import get_cb_settings, request_to_dict, validate_results
+from .project import get_project_dirs  # noqa: F401
+from .storage import (  # noqa: F401
+    compress_data,
+    decompress_data,
+    get_storage,
+    load_fixture_data,
+    pickle_data,
+    unpickle_data
+)
+from .utils_novel import (  # noqa: F401
+    create_dir,
+    get_cb_settings,
+    get_max_peak_memory,
+    get_or_create_test_dir,
+    request_to_dict,
+    to_jsonable,
+    update_json,
+    validate_results
+)
 
 import six
 from scrapy import signals
@@ -16,17 +34,15 @@ from scrapy.crawler import Crawler
 from scrapy.exceptions import NotConfigured, _InvalidOutput
 from scrapy.http import Request, Response
 from scrapy.item import Item
-from scrapy.utils.conf import (build_component_list, closest_scrapy_cfg,
-                               init_env)
+from scrapy.utils.conf import build_component_list
 from scrapy.utils.misc import arg_to_iter, load_object, walk_modules
 from scrapy.utils.project import get_project_settings
 from scrapy.utils.python import to_bytes
 from scrapy.utils.reqser import request_from_dict
 from scrapy.utils.spider import iter_spider_classes
 
-import datadiff.tools
-
 NO_ITEM_MARKER = object()
+COLLECT_ALL_LIMIT = 20
 FIXTURE_VERSION = 1
 
 
@@ -48,33 +64,6 @@ def create_instance(objcls, settings, crawler, *args, **kwargs):
         return objcls(*args, **kwargs)
 
 
-def get_project_dirs():
-    outer_dir = inner_dir = ""
-    closest_cfg = closest_scrapy_cfg()
-    if closest_cfg:
-        outer_dir = os.path.dirname(closest_cfg)
-    if os.environ.get('SCRAPY_PROJECT'):
-        inner_dir = os.environ.get('SCRAPY_PROJECT')
-    if outer_dir and inner_dir:
-        return (outer_dir, inner_dir)
-
-    init_env()
-    scrapy_module = os.environ.get('SCRAPY_SETTINGS_MODULE')
-    if scrapy_module is None and not outer_dir:
-        raise Exception("Project configuration awry")
-    if not inner_dir:
-        inner_dir = scrapy_module.split('.')[0]
-    if outer_dir and inner_dir:
-        return (outer_dir, inner_dir)
-
-    try:
-        module = import_module(scrapy_module)
-        outer_dir = os.path.dirname(os.path.dirname(module.__file__))
-        return (outer_dir, inner_dir)
-    except ImportError:
-        raise Exception("Project configuration awry")
-
-
 def get_middlewares(spider):
     full_list = build_component_list(
         spider.settings.getwithbase('SPIDER_MIDDLEWARES'))
@@ -86,46 +75,23 @@ def get_middlewares(spider):
     return mw_paths
 
 
-def create_dir(path, parents=False, exist_ok=False):
-    try:
-        if parents:
-            os.makedirs(path)
-        else:
-            os.mkdir(path)
-    except OSError:
-        if not exist_ok:
-            raise
-
-
-def get_or_create_test_dir(base_path, spider_name, callback_name, extra=None):
-    components = [base_path, 'tests', spider_name]
-    if extra:
-        components.append(extra)
-    components.append(callback_name)
-    test_dir = None
-    for component in components:
-        test_dir = os.path.join(test_dir, component) if test_dir else component
-        create_dir(test_dir, parents=True, exist_ok=True)
-        init_file = os.path.join(test_dir, '__init__.py')
-        with open(init_file, 'a'):
-            os.utime(init_file, None)
-
-    test_name = '__'.join(components[2:])
-    return test_dir, test_name
-
-
-def add_sample(index, test_dir, test_name, data):
-    encoding = data['response']['encoding']
-    filename = 'fixture%s.bin' % str(index)
-    path = os.path.join(test_dir, filename)
+def encode_sample(data):
     info = pickle_data({
         'data': pickle_data(data),
-        'encoding': encoding,
+        'encoding': data['response']['encoding'],
         'fixture_version': FIXTURE_VERSION,
     })
-    data = compress_data(info)
-    with open(path, 'wb') as outfile:
-        outfile.write(data)
+    return compress_data(info)
+
+
+# `blob` is the fixture as encoded by encode_sample, if it already was
+def add_sample(index, test_dir, test_name, data, storage=None, blob=None):
+    filename = 'fixture%s.bin' % str(index)
+    path = os.path.join(test_dir, filename)
+    if blob is None:
+        blob = encode_sample(data)
+    storage = storage or get_storage()
+    storage.save(path, blob, data)
 
 
 # def clear_fixtures(base_path, spider_name):
@@ -133,24 +99,6 @@ def add_sample(index, test_dir, test_name, data):
 #     shutil.rmtree(path, ignore_errors=True)
 
 
-def compress_data(data):
-    return zlib.compress(data)
-
-
-def decompress_data(data):
-    return zlib.decompress(data)
-
-
-def pickle_data(data):
-    return pickle.dumps(data, protocol=2)
-
-
-def unpickle_data(data, encoding):
-    if six.PY2:
-        return pickle.loads(data)
-    return pickle.loads(data, encoding=encoding)
-
-
 def response_to_dict(response):
     return {
         'cls': '{}.{}'.format(
@@ -350,7 +298,7 @@ def erase_special_metakeys(request):
     return new_req
 
 
-def write_test(path, test_name, url):
+def write_test(path, test_name, url, test_module=True, write_config=True):
     command = 'scrapy {}'.format(' '.join(sys.argv))
     test_path = os.path.join(path, 'test_fixtures.py')
     config_file = os.path.join(path, 'config.py')
@@ -360,22 +308,18 @@ def write_test(path, test_name, url):
 # Request URL: {url}  # noqa: E501
 import os
 import unittest
+from scrapy_testmaster.storage import get_storage
 from scrapy_testmaster.utils import generate_test
 
 
 class TestMaster(unittest.TestCase):
     def test__{test_name}(self):
-        files = os.listdir(
-            os.path.dirname(
-                os.path.abspath(__file__)
-            )
-        )
-        files = [f for f in files if f.endswith('.bin')]
+        test_dir = os.path.dirname(os.path.abspath(__file__))
         self.maxDiff = None
-        for f in files:
-            file_path = os.path.join(os.path.dirname(__file__), f)
+        for file_path in get_storage().iter_paths(test_dir, recursive=False):
+            f = os.path.basename(file_path)
             print("Testing fixture '%s' in location: %s" % (f, file_path))
-            test = generate_test(os.path.abspath(file_path))
+            test = generate_test(file_path)
             test(self)
 
 
@@ -387,10 +331,11 @@ if __name__ == '__main__':
         url=url,
     )
 
-    with open(str(test_path), 'w') as f:
-        f.write(test_code)
+    if test_module:
+        with open(str(test_path), 'w') as f:
+            f.write(test_code)
 
-    if not os.path.exists(config_file):
+    if write_config and not os.path.exists(config_file):
         config_src = os.path.dirname(__file__) + '/config_doc.py'
         shutil.copyfile(config_src, config_file)
 
@@ -444,17 +389,67 @@ def parse_callback_result(result, spider, cb_settings):
     return processed_result, out
 
 
-def prepare_callback_replay(fixture_path, encoding="utf-8"):
-    with open(str(fixture_path), 'rb') as f:
-        raw_data = f.read()
+# Traces allocations while entered (if `active`), after which `peak` is the
+# peak memory (in bytes) allocated on top of what was in use when entered. If
+# something else is already tracing, its peak can only be reset from Python
+# 3.9 on; before that, it could predate the replay, so entering fails instead.
+class PeakMemory(object):
+    def __init__(self, active=True):
+        self.active = active
+        self.peak = 0
+        self._was_tracing = False
+
+    def __enter__(self):
+        if not self.active:
+            return self
+        self._was_tracing = tracemalloc.is_tracing()
+        if not self._was_tracing:
+            tracemalloc.start()
+        elif hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            raise RuntimeError(
+                "Can't measure peak memory while tracemalloc is already "
+                "tracing before Python 3.9: stop tracing or unset "
+                "TESTMASTER_MAX_PEAK_MEMORY_MB")
+        self._baseline, _ = tracemalloc.get_traced_memory()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.active:
+            return False
+        _, peak = tracemalloc.get_traced_memory()
+        if not self._was_tracing:
+            tracemalloc.stop()
+        self.peak = max(peak - self._baseline, 0)
+        return False
 
-    fixture_info = unpickle_data(decompress_data(raw_data), encoding)
-    if 'fixture_version' in fixture_info:
-        encoding = fixture_info['encoding']
-        data = unpickle_data(fixture_info['data'], encoding)
-    else:
-        data = fixture_info  # legacy tests
 
+def get_fixture_num(fixture_path):
+    match = re.search(r'(\d+)\.bin$', os.path.basename(fixture_path))
+    return int(match.group(1)) if match else None
+
+
+# `data` can be given to replay modified fixture data (e.g. a candidate body
+# while minimizing) instead of what is stored at fixture_path
+def prepare_callback_replay(fixture_path, encoding="utf-8", data=None):
+    if data is None:
+        data = load_fixture_data(fixture_path, encoding)
+
+    spider_cls, settings = get_replay_settings(data, fixture_path)
+    crawler = Crawler(spider_cls, settings)
+    spider_args_in = data.get('spider_args', data.get('spider_args_in', {}))
+    spider = spider_cls.from_crawler(crawler)
+    for k, v in spider_args_in.items():
+        setattr(spider, k, v)
+    crawler.spider = spider
+
+    return data, crawler, spider, settings
+
+
+# The spider class of a fixture and the settings it is replayed with: the
+# project's, the spider's custom_settings and those recorded in the fixture
+def get_replay_settings(data, fixture_path):
     settings = get_project_settings()
 
     spider_name = data.get('spider_name')
@@ -471,20 +466,39 @@ def prepare_callback_replay(fixture_path, encoding="utf-8"):
     for k, v in data.get('settings', {}).items():
         settings.set(k, v, 50)
 
-    crawler = Crawler(spider_cls, settings)
-    spider_args_in = data.get('spider_args', data.get('spider_args_in', {}))
-    spider = spider_cls.from_crawler(crawler)
-    for k, v in spider_args_in.items():
-        setattr(spider, k, v)
-    crawler.spider = spider
+    return spider_cls, settings
 
-    return data, crawler, spider, settings
 
+def build_middlewares(middleware_paths, settings, crawler):
+    middlewares = []
+    for mw_path in middleware_paths:
+        try:
+            mw_cls = load_object(mw_path)
+            middlewares.append(create_instance(mw_cls, settings, crawler))
+        except NotConfigured:
+            continue
+    return middlewares
+
+
+# `collect_all` keeps comparing the callback output after a mismatch, up to
+# that many mismatches (COLLECT_ALL_LIMIT if True)
+def generate_test(fixture_path, encoding='utf-8', data=None, collect_all=0):
+    # only replays need datadiff, not the middleware
+    import datadiff.tools
+    from .session import get_replay_session
+
+    session = get_replay_session()
+    if session is not None:
+        if data is None:
+            data = load_fixture_data(fixture_path, encoding)
+        crawler, spider, settings, session_middlewares = session.open(
+            data, fixture_path)
+    else:
+        data, crawler, spider, settings = prepare_callback_replay(
+            fixture_path, encoding=encoding, data=data
+        )
 
-def generate_test(fixture_path, encoding='utf-8'):
-    data, crawler, spider, settings = prepare_callback_replay(
-        fixture_path, encoding=encoding
-    )
+    limit = COLLECT_ALL_LIMIT if collect_all is True else max(int(collect_all or 0), 1)
 
     def test(self):
         fx_result = data['result']
@@ -492,26 +506,24 @@ def generate_test(fixture_path, encoding='utf-8'):
 
         spider_args_in = data.get(
             'spider_args', data.get('spider_args_in', {}))
-        set_spider_attrs(spider, spider_args_in)
+        if session is not None:
+            # the spider is already open, with the middlewares built
+            session.reset(spider, spider_args_in)
+            middlewares = list(session_middlewares)
+        else:
+            set_spider_attrs(spider, spider_args_in)
         request = request_from_dict(data['request'], spider)
-        response_cls = auto_import(data['response'].pop(
+        response_kwargs = dict(data['response'])
+        response_cls = auto_import(response_kwargs.pop(
             'cls', 'scrapy.http.HtmlResponse'))
-        response = response_cls(request=request, **data['response'])
+        response = response_cls(request=request, **response_kwargs)
 
-        middlewares = []
-        middleware_paths = data['middlewares']
-        for mw_path in middleware_paths:
-            try:
-                mw_cls = load_object(mw_path)
-                mw = create_instance(mw_cls, settings, crawler)
-                middlewares.append(mw)
-            except NotConfigured:
-                continue
-
-        crawler.signals.send_catch_log(
-            signal=signals.spider_opened,
-            spider=spider
-        )
+        if session is None:
+            middlewares = build_middlewares(data['middlewares'], settings, crawler)
+            crawler.signals.send_catch_log(
+                signal=signals.spider_opened,
+                spider=spider
+            )
         result_attr_in = {
             k: v for k, v in spider.__dict__.items()
             if k not in ('crawler', 'settings', 'start_urls')
@@ -524,28 +536,12 @@ def generate_test(fixture_path, encoding='utf-8'):
             if hasattr(mw, 'process_spider_input'):
                 mw.process_spider_input(response, spider)
 
-        result = arg_to_iter(request.callback(response))
-        middlewares.reverse()
+        test_dir = os.path.dirname(fixture_path)
+        cb_settings = get_cb_settings(test_dir)
 
-        for mw in middlewares:
-            if hasattr(mw, 'process_spider_output'):
-                result = mw.process_spider_output(response, result, spider)
-
-        for index, (cb_obj, fx_item) in enumerate(six.moves.zip_longest(
-            result, fx_result, fillvalue=NO_ITEM_MARKER
-        )):
-            if any(item == NO_ITEM_MARKER for item in (cb_obj, fx_item)):
-                raise AssertionError(
-                    "The fixture's data length doesn't match with "
-                    "the current callback's output length. "
-                    "Expected %s elements, found %s.\nFixture path: %s" % (
-                        len(fx_result), index + 1 + len(list(result)),
-                        fixture_path)
-                )
-
-            test_dir = '/'.join(fixture_path.split('/')[:-1])
-            cb_settings = get_cb_settings(test_dir)
+        max_peak_memory = get_max_peak_memory(cb_settings, settings)
 
+        def check_output(index, cb_obj, fx_item):
             cb_obj = parse_object(cb_obj, spider, cb_settings)
 
             fx_obj = fx_item['data']
@@ -584,6 +580,68 @@ def generate_test(fixture_path, encoding='utf-8'):
                         "output: {}.\nFixture path: {}".format(index, e, fixture_path)),
                     None)
 
+        # The output is compared as the callback yields it, and by default the
+        # comparison stops at the first mismatch: nothing after it is parsed,
+        # cleaned or validated. With collect_all, it goes on until `limit`
+        # mismatches have been found. With a memory budget, the peak is that
+        # of the callback call and this loop, so the output is never held all
+        # at once (unless the callback returns a list).
+        mismatches = []
+        stopped = False
+        with PeakMemory(active=bool(max_peak_memory)) as peak_memory:
+            result = arg_to_iter(request.callback(response))
+            middlewares.reverse()
+
+            for mw in middlewares:
+                if hasattr(mw, 'process_spider_output'):
+                    result = mw.process_spider_output(response, result, spider)
+
+            result = iter(result)
+            for index, (cb_obj, fx_item) in enumerate(six.moves.zip_longest(
+                result, fx_result, fillvalue=NO_ITEM_MARKER
+            )):
+                if cb_obj is NO_ITEM_MARKER or fx_item is NO_ITEM_MARKER:
+                    # the rest of the output isn't drained, there's nothing
+                    # left to compare it to
+                    found = index if cb_obj is NO_ITEM_MARKER else \
+                        "more (output #%s onwards is extra)" % index
+                    mismatches.append(AssertionError(
+                        "The fixture's data length doesn't match with "
+                        "the current callback's output length. "
+                        "Expected %s elements, found %s.\nFixture path: %s" % (
+                            len(fx_result), found, fixture_path)))
+                    break
+                try:
+                    check_output(index, cb_obj, fx_item)
+                except (AssertionError, _InvalidOutput) as e:
+                    mismatches.append(e)
+                    if len(mismatches) >= limit:
+                        # only an early stop if there was more to compare
+                        stopped = index + 1 < len(fx_result) or \
+                            next(result, NO_ITEM_MARKER) is not NO_ITEM_MARKER
+                        break
+        if len(mismatches) == 1:
+            raise mismatches[0]
+        if mismatches:
+            raise AssertionError("%s mismatches%s:\n\n%s" % (
+                len(mismatches),
+                " (stopped at the limit)" if stopped else "",
+                "\n\n".join(str(e) for e in mismatches)))
+
+        if max_peak_memory:
+            peak_memory_mb = round(peak_memory.peak / (1024 * 1024), 3)
+            fixture_num = get_fixture_num(fixture_path)
+            # replays don't write to the tests dir unless asked to
+            if fixture_num is not None and \
+                    settings.getbool('TESTMASTER_RECORD_PEAK_MEMORY'):
+                update_json(test_dir, fixture_num,
+                            {'peak_memory_mb': peak_memory_mb})
+            if peak_memory_mb > max_peak_memory:
+                raise AssertionError(
+                    "Peak memory while replaying the callback was %s MB, "
+                    "exceeding the budget of %s MB.\nFixture path: %s" % (
+                        peak_memory_mb, max_peak_memory, fixture_path))
+
         # Spider attributes get updated after the yield
         result_attr_out = {
             k: v for k, v in spider.__dict__.items()
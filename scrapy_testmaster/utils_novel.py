@@ -1,19 +1,94 @@
 import os
 import shutil
 import importlib
-import inspect
+from collections.abc import Mapping
+from datetime import date
 from glob import glob
 import re
 import json
+from contextlib import contextmanager
 
-from scrapy.http import Request
-from scrapy.utils.python import to_unicode
-from scrapy.utils.reqser import request_from_dict, _get_method
-from scrapy.exceptions import _InvalidOutput, UsageError
+from .storage import get_storage, fixture_name
 
+# Scrapy is imported in the functions that need it, so that the commands that
+# only deal with fixture files (see project.py) can do without it.
 
-def get_cb_settings(test_dir):
+
+def create_dir(path, parents=False, exist_ok=False):
+    try:
+        if parents:
+            os.makedirs(path)
+        else:
+            os.mkdir(path)
+    except OSError:
+        if not exist_ok:
+            raise
+
+
+def get_or_create_test_dir(base_path, spider_name, callback_name, extra=None,
+                           init_files=True):
+    components = [base_path, 'tests', spider_name]
+    if extra:
+        components.append(extra)
+    components.append(callback_name)
+    test_dir = None
+    for component in components:
+        test_dir = os.path.join(test_dir, component) if test_dir else component
+        create_dir(test_dir, parents=True, exist_ok=True)
+        # the __init__.py files are only needed for unittest discovery
+        if not init_files:
+            continue
+        init_file = os.path.join(test_dir, '__init__.py')
+        with open(init_file, 'a'):
+            os.utime(init_file, None)
+
+    test_name = '__'.join(components[2:])
+    return test_dir, test_name
+
+
+# converts fixture/callback data into something json.dumps can handle
+# (mappings include scrapy Items): nulls, booleans and numbers are kept as
+# such, tuples and sets become lists, bytes are decoded (never failing on
+# bytes that aren't UTF-8) and anything else becomes its str
+def to_jsonable(data):
+    if data is None or isinstance(data, (bool, int, float, str)):
+        return data
+    elif isinstance(data, Mapping):
+        return {
+            _jsonable_key(k): to_jsonable(v)
+            for k, v in data.items()
+        }
+    elif isinstance(data, (list, tuple, set, frozenset)):
+        return [to_jsonable(x) for x in data]
+    elif isinstance(data, bytes):
+        return data.decode('utf-8', errors='replace')
+    elif isinstance(data, date):
+        return data.isoformat()
+    return str(data)
+
+
+def _jsonable_key(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8', errors='replace')
+    return key if isinstance(key, str) else str(key)
+
+
+# performance fixtures are kept in this subdir of their callback dir, and
+# share its config.py
+SLOW_FIXTURES_DIR = 'slow'
+
+
+def _config_path(test_dir):
     config_path = os.path.join(test_dir, 'config.py')
+    test_dir = os.path.normpath(test_dir)
+    if os.path.basename(test_dir) == SLOW_FIXTURES_DIR and \
+            not os.path.exists(config_path):
+        config_path = os.path.join(os.path.dirname(test_dir), 'config.py')
+    return config_path
+
+
+def get_cb_settings(test_dir):
+    config_path = _config_path(test_dir)
     if not os.path.exists(config_path):
         return None
     spec = importlib.util.spec_from_file_location("config", config_path)
@@ -35,15 +110,17 @@ def get_test_paths(spider_test_dir, spider_path, extra_path, fixture=False):
             for cb in cb_list:
                 target = os.path.join(diff_path, cb)
                 if fixture:
-                    target = os.path.join(target, '*.bin')
-                paths += glob(target)
+                    paths += get_storage().iter_paths(target, recursive=False)
+                else:
+                    paths += glob(target)
     else:
         cb_list = filter(lambda d: '.' not in d, dir_list)
         for cb in cb_list:
             target = os.path.join(spider_test_dir, cb)
             if fixture:
-                target = os.path.join(target, '*.bin')
-            paths += glob(target)
+                paths += get_storage().iter_paths(target, recursive=False)
+            else:
+                paths += glob(target)
 
     return paths
 
@@ -56,15 +133,19 @@ def update_max_fixtures(cb_settings, global_max_fixtures):
         return global_max_fixtures
 
 
-def get_num_fixtures(test_dir):
+def get_max_peak_memory(cb_settings, spider_settings):
+    global_max = spider_settings.getfloat('TESTMASTER_MAX_PEAK_MEMORY_MB', 0)
+    try:
+        local_max = cb_settings.MAX_PEAK_MEMORY_MB
+    except AttributeError:
+        local_max = None
+    return local_max if local_max else global_max
+
+
+def get_num_fixtures(test_dir, storage=None):
     if not os.path.exists(test_dir):
         return 0
-    try:
-        dir_list = os.listdir(test_dir)
-        fixture_count = len(list(filter(lambda d: '.bin' in d, dir_list)))
-    except IndexError:
-        fixture_count = 0
-    return fixture_count
+    return (storage or get_storage()).count(test_dir)
 
 
 def get_fixture_counts(spider_dir, spider, extra_path):
@@ -92,6 +173,7 @@ def get_fixture_counts(spider_dir, spider, extra_path):
 
 
 def basic_items_check(items, obligate_fields, primary_fields, request_url):
+    from scrapy.exceptions import _InvalidOutput
     for item in items:
         if not set(item.keys()).intersection(obligate_fields) == obligate_fields:
             missing_fields = obligate_fields.difference(item.keys())
@@ -153,7 +235,7 @@ def check_local_rules(config, items, requests, request_url):
 
 
 def validate_results(test_dir, spider_settings, items, requests, request_url):
-    config_path = os.path.join(test_dir, 'config.py')
+    config_path = _config_path(test_dir)
     if not os.path.exists(config_path):
         config = None
     else:
@@ -165,6 +247,7 @@ def validate_results(test_dir, spider_settings, items, requests, request_url):
 
 
 def check_item_rules(itemclass, items, request_url):
+    from scrapy.exceptions import _InvalidOutput
     itemclass_attrs = [(name, getattr(itemclass, name)) for name in dir(itemclass)
                        if not name.startswith('__')]
     item_rules = list(filter(lambda entry: callable(entry[1]), itemclass_attrs))
@@ -178,6 +261,7 @@ def check_item_rules(itemclass, items, request_url):
 
 
 def check_req_rules(reqclass, requests, request_url):
+    from scrapy.exceptions import _InvalidOutput
     reqclass_attrs = [(name, getattr(reqclass, name)) for name in dir(reqclass)
                       if not name.startswith('__')]
     req_rules = list(filter(lambda entry: callable(entry[1]), reqclass_attrs))
@@ -194,23 +278,84 @@ def _get_num_objects(result, _type):
     return len(list(filter(lambda entry: entry['type'] == _type, result)))
 
 
-def write_json(test_dir, request, result, fixture_num):
+# Yields a temp path in the dir of `path` to write to, which then replaces
+# `path` in one go (or is removed if writing fails), so that a reader never
+# sees a half-written file, e.g. when parallel processes share it
+@contextmanager
+def atomic_write(path):
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# {fixture num (as a str): entry} from the view.json of a callback dir, or {}
+# if there is none (or it can't be read)
+def load_view(test_dir):
+    try:
+        with open(os.path.join(test_dir, 'view.json'), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_view(test_dir, view):
+    with atomic_write(os.path.join(test_dir, 'view.json')) as tmp_path, \
+            open(tmp_path, 'w') as f:
+        json.dump(view, f)
+
+
+# merged into the fixture's entry in view.json, so that what was added to it
+# besides the request info (by the admission policy, replays, merges...)
+# survives updates of the fixture
+def write_json(test_dir, request, result, fixture_num, extra=None):
     fixture = {}
     fixture["request"] = request
     fixture["num_items"] = _get_num_objects(result, "item")
     fixture["num_requests"] = _get_num_objects(result, "request")
-    json_path = os.path.join(test_dir, 'view.json')
-    if os.path.exists(json_path):
-        with open(json_path, 'r') as f:
-            extant_fixtures = json.load(f)
-        extant_fixtures[str(fixture_num)] = fixture
+    if extra:
+        fixture.update(extra)
+    update_json(test_dir, fixture_num, fixture)
 
-        with open(json_path, 'w') as f:
-            json.dump(extant_fixtures, f)
-    else:
-        new_fixtures = {"1": fixture}
-        with open(json_path, 'w') as f:
-            json.dump(new_fixtures, f)
+
+# adds fields (e.g. replay measurements) to the entry for an existing fixture
+# in view.json without touching the recorded request info
+def update_json(test_dir, fixture_num, fields):
+    extant_fixtures = load_view(test_dir)
+    extant_fixtures.setdefault(str(fixture_num), {}).update(fields)
+    # replays of the same callback may run in parallel (e.g. with
+    # pytest-xdist)
+    write_view(test_dir, extant_fixtures)
+
+
+SEEN_COUNTS_FILE = 'seen.json'
+
+
+# {callback: responses seen} by `scrapy crawl` over all its runs, which the
+# random admission policy samples from. Kept in the dir the callback dirs of
+# a spider are in (and per URL template, for stratified admission, in
+# templates.json in the callback dir).
+def read_seen_counts(base_dir, filename=SEEN_COUNTS_FILE):
+    try:
+        with open(os.path.join(base_dir, filename), 'r') as f:
+            return {cb: int(seen) for cb, seen in json.load(f).items()}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+# adds the responses seen since `initial` was read to what is on disk now, so
+# that crawls of the same spider running side by side don't lose counts
+def write_seen_counts(base_dir, initial, counts, filename=SEEN_COUNTS_FILE):
+    merged = read_seen_counts(base_dir, filename)
+    for cb, seen in counts.items():
+        base = initial.get(cb, 0)
+        merged[cb] = merged.get(cb, base) + seen - base
+    with atomic_write(os.path.join(base_dir, filename)) as tmp_path, \
+            open(tmp_path, 'w') as f:
+        json.dump(merged, f, indent=2, sort_keys=True)
 
 
 # The requests involved in the current fixtures will be written here, in JSON format
@@ -249,6 +394,7 @@ def write_config(path):
 
 def get_homepage_cookies(spider, mode=""):
     import requests
+    from scrapy.exceptions import UsageError
     user_agent = spider.settings.get('USER_AGENT')
     if len(spider.start_urls) == 1:
         inferred_homepage = spider.start_urls[0]
@@ -265,6 +411,7 @@ def get_homepage_cookies(spider, mode=""):
 
 
 def get_config_requests(test_dir, spider, max_fixtures):
+    from scrapy.utils.reqser import request_from_dict, _get_method
     curr_fixture_count = get_num_fixtures(test_dir)
     config = get_cb_settings(test_dir)
     try:
@@ -319,7 +466,9 @@ def trigger_requests(crawler_process, spider, requests):
 
 
 def cascade_fixtures(test_dir, min_fixture_cleared):
-    fixtures = list(filter(lambda d: '.bin' in d, os.listdir(test_dir)))
+    storage = get_storage()
+    fixtures = [os.path.basename(path) for path in
+                storage.iter_paths(test_dir, recursive=False)]
     fixtures_store = [(f, int(re.search(r'(\d+)\.bin', f).group(1))) for f in
                       fixtures]
     fixtures_to_move = list(filter(lambda f: f[1] > min_fixture_cleared,
@@ -330,8 +479,8 @@ def cascade_fixtures(test_dir, min_fixture_cleared):
         curr_json = json.load(f)
     new_num = min_fixture_cleared
     for name, num in fixtures_to_move:
-        os.rename(os.path.join(test_dir, name),
-                  os.path.join(test_dir, 'fixture%d.bin' % new_num))
+        storage.rename(os.path.join(test_dir, name),
+                       os.path.join(test_dir, fixture_name(new_num)))
         curr_json[str(new_num)] = curr_json[str(num)]
         del curr_json[str(num)]
         new_num += 1
@@ -358,6 +507,8 @@ def request_to_dict(request, spider=None):
     If a spider is given, it will try to find out the name of the spider method
     used in the callback and store that as the callback.
     """
+    from scrapy.http import Request
+    from scrapy.utils.python import to_unicode
     cb = request.callback
     if callable(cb):
         cb = _find_method(spider, cb)
@@ -385,6 +536,7 @@ def request_to_dict(request, spider=None):
 
 
 def _find_method(obj, func):
+    import inspect
     if obj:
         try:
             func_self = func.__self__
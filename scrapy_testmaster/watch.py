@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import time
+import types
+import hashlib
+import inspect
+
+from .server import ModuleReloader, replay_fixture
+from .storage import decode_fixture_data, get_storage
+
+_ADDRESS_RE = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def find_callback_dirs(spider_dir, extra_path='', callback=None):
+    base_dir = os.path.join(spider_dir, extra_path)
+    if callback:
+        return {callback: os.path.join(base_dir, callback)}
+    if not os.path.isdir(base_dir):
+        return {}
+    return {name: os.path.join(base_dir, name)
+            for name in sorted(os.listdir(base_dir))
+            if os.path.isdir(os.path.join(base_dir, name)) and not name.startswith('__')}
+
+
+def _code_key(code):
+    # everything that makes up what the code does, but not where it is in the
+    # file, so that editing one method doesn't change the key of those below
+    return (code.co_code, code.co_names, code.co_varnames, code.co_freevars,
+            code.co_cellvars, tuple(
+                _code_key(c) if isinstance(c, types.CodeType) else repr(c)
+                for c in code.co_consts))
+
+
+def _digest(value):
+    value = getattr(value, '__func__', value)  # class and static methods
+    value = getattr(value, 'fget', value)  # properties
+    code = getattr(inspect.unwrap(value), '__code__', None)
+    key = _code_key(code) if code is not None else _ADDRESS_RE.sub('', repr(value))
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+# {name: digest} of what is defined in a module: its functions and other
+# values by name, and the attributes of its classes as Class.attr
+def module_fingerprint(module):
+    fingerprint = {}
+    for name, value in vars(module).items():
+        if name.startswith('__') or isinstance(value, types.ModuleType):
+            continue
+        if getattr(value, '__module__', module.__name__) != module.__name__:
+            continue  # imported from elsewhere
+        if isinstance(value, type):
+            for attr, attr_value in vars(value).items():
+                if not attr.startswith('__'):
+                    fingerprint['%s.%s' % (name, attr)] = _digest(attr_value)
+        else:
+            fingerprint[name] = _digest(value)
+    return fingerprint
+
+
+# The callbacks whose fixtures need replaying after the modules were reloaded,
+# given their fingerprints before and after: if all that changed is methods
+# named after callbacks, only those callbacks; otherwise all of them.
+def affected_callbacks(before, after, callbacks):
+    affected = set()
+    for module_name in set(before) | set(after):
+        old, new = before.get(module_name, {}), after.get(module_name, {})
+        for key in set(old) | set(new):
+            if old.get(key) == new.get(key):
+                continue
+            attr = key.split('.')[-1]
+            if '.' not in key or attr not in callbacks:
+                return set(callbacks)
+            affected.add(attr)
+    return affected
+
+
+def _signature(records):
+    return [(path, meta.get('recorded_at'), meta.get('size'))
+            for path, meta in records]
+
+
+class FixtureCache(object):
+    # Fixture blobs by path, loaded again only when their storage metadata
+    # (recording time and size) changes. Each `get` decodes a fresh copy:
+    # replays change the fixture data they're given (the spider attributes
+    # set from it, items cleaned in place), which mustn't carry over to the
+    # next replay.
+    def __init__(self, storage):
+        self.storage = storage
+        self.entries = {}
+
+    def get(self, path, meta):
+        key = (meta.get('recorded_at'), meta.get('size'))
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != key:
+            entry = (key, self.storage.load(path))
+            self.entries[path] = entry
+        return decode_fixture_data(entry[1])
+
+    def prune(self, paths):
+        for path in set(self.entries) - set(paths):
+            del self.entries[path]
+
+
+# Replays the fixtures of a spider's callbacks whenever the project modules,
+# the callbacks' config.py or their fixtures change. Changes are polled for;
+# changed modules are reloaded in place, and only the fixtures of the
+# callbacks affected are replayed, from fixtures kept in memory.
+class Watcher(object):
+    def __init__(self, callback_dirs, project_dir, storage=None, out=None):
+        self.callback_dirs = callback_dirs
+        self.reloader = ModuleReloader(project_dir)
+        self.storage = storage or get_storage()
+        self.cache = FixtureCache(self.storage)
+        self.out = out or sys.stdout
+        self.config_mtimes = {}
+        self.records = {}
+
+    def _config_mtime(self, callback):
+        try:
+            return os.stat(os.path.join(
+                self.callback_dirs[callback], 'config.py')).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan(self, callback):
+        # -> whether the config or the fixtures of the callback changed
+        records = list(self.storage.iter_records(self.callback_dirs[callback]))
+        config_mtime = self._config_mtime(callback)
+        changed = self.config_mtimes.get(callback) != config_mtime
+        changed = changed or _signature(self.records.get(callback, [])) != _signature(records)
+        self.config_mtimes[callback] = config_mtime
+        self.records[callback] = records
+        return changed
+
+    def poll(self):
+        affected = set()
+        reload_names = self.reloader.find_changed()
+        if reload_names:
+            before = {name: module_fingerprint(sys.modules[name])
+                      for name in reload_names}
+            self.reloader.reload(reload_names)
+            after = {name: module_fingerprint(sys.modules[name])
+                     for name in reload_names}
+            self.write("Reloaded %s" % ', '.join(reload_names))
+            affected |= affected_callbacks(before, after, self.callback_dirs)
+        for callback in self.callback_dirs:
+            if self._scan(callback):
+                affected.add(callback)
+        return sorted(affected)
+
+    def replay(self, callbacks):
+        failures = 0
+        for callback in callbacks:
+            outcomes = []
+            start = time.perf_counter()
+            for path, meta in self.records.get(callback, []):
+                result = replay_fixture(path, data=self.cache.get(path, meta))
+                outcomes.append(result['outcome'])
+                if result['outcome'] != 'passed':
+                    self.write("%s ... %s\n%s" % (
+                        result['id'], result['outcome'], result['message']))
+            failures += len(outcomes) - outcomes.count('passed')
+            self.write("%s: %d passed, %d failed in %.1f ms" % (
+                callback, outcomes.count('passed'),
+                len(outcomes) - outcomes.count('passed'),
+                (time.perf_counter() - start) * 1000))
+        self.cache.prune([path for records in self.records.values()
+                          for path, _ in records])
+        # track the modules first imported by the replays
+        self.reloader.snapshot()
+        return failures
+
+    def write(self, line):
+        self.out.write(line + '\n')
+        self.out.flush()
+
+    def run(self, interval=0.5):
+        self.poll()
+        self.replay(sorted(self.callback_dirs))
+        while True:
+            time.sleep(interval)
+            callbacks = self.poll()
+            if callbacks:
+                self.write("--- %s" % time.strftime('%H:%M:%S'))
+                self.replay(callbacks)
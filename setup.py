@@ -26,9 +26,15 @@ setuptools.setup(
         'datadiff==2.0.0',
         'requests'
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     entry_points={
         'console_scripts': [
             'testmaster=scrapy_testmaster.cli:main',
         ],
+        'pytest11': [
+            'testmaster=scrapy_testmaster.pytest_plugin',
+        ],
     },
 )
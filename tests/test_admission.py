@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+from scrapy.settings import Settings
+
+from scrapy_testmaster.admission import (
+    CoverageAdmission,
+    NoveltyAdmission,
+    RandomAdmission,
+    StratifiedAdmission,
+    get_admission_policy,
+    result_shape,
+    url_template
+)
+
+
+class FakeTracer(object):
+    def __init__(self, coverage):
+        self.coverage = set(coverage)
+
+
+class TestCoverageAdmission(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.policy = CoverageAdmission(Settings())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def admit(self, coverage, max_fixtures=2):
+        return self.policy.admit(self.dir, 'parse', 0, max_fixtures, [],
+                                 tracer=FakeTracer(coverage))
+
+    def test_new_coverage_only(self):
+        self.assertEqual(self.admit({1, 2}), 1)
+        self.assertIsNone(self.admit({1, 2}))
+        self.assertIsNone(self.admit({1}))
+        self.assertEqual(self.admit({1, 3}), 2)
+
+    def test_strict_superset_replaces(self):
+        self.assertEqual(self.admit({1, 2}), 1)
+        self.assertEqual(self.admit({3}), 2)
+        # full: new coverage alone isn't enough...
+        self.assertIsNone(self.admit({4, 5}))
+        # ...but containing a stored fixture's coverage is
+        self.assertEqual(self.admit({3, 6}), 2)
+
+    def test_nothing_traced_admitted_at_random(self):
+        # callbacks that aren't generators run before their output is traced
+        self.assertEqual(self.admit(set()), 1)
+        self.assertEqual(self.policy.fixture_coverage['parse'], {1: frozenset()})
+
+    def test_untraced_dropped(self):
+        self.assertIsNone(self.policy.admit(self.dir, 'parse', 0, 2, []))
+
+    def test_get_policy(self):
+        self.assertIsInstance(get_admission_policy(Settings()), RandomAdmission)
+        settings = Settings({'TESTMASTER_ADMISSION': 'coverage'})
+        self.assertIsInstance(get_admission_policy(settings), CoverageAdmission)
+
+
+def item(**fields):
+    return {'type': 'item', 'data': fields}
+
+
+def request(callback):
+    return {'type': 'request', 'data': {'url': 'http://x.com', 'callback': callback}}
+
+
+class TestNoveltyAdmission(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.policy = NoveltyAdmission(Settings())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def admit(self, result, max_fixtures=2):
+        return self.policy.admit(self.dir, 'parse', 0, max_fixtures, result)
+
+    def test_result_shape(self):
+        self.assertEqual(result_shape([item(a='x', b=1)]),
+                         result_shape([item(a='y', b=2)]))
+        self.assertNotEqual(result_shape([item(a='x')]),
+                            result_shape([item(a='')]))
+        self.assertNotEqual(result_shape([item(a='x')]),
+                            result_shape([item(a=1)]))
+        # counts are bucketed
+        self.assertEqual(result_shape([item(a='x')] * 5),
+                         result_shape([item(a='x')] * 7))
+        self.assertNotEqual(result_shape([item(a='x')] * 3),
+                            result_shape([item(a='x')] * 4))
+        self.assertNotEqual(result_shape([request('parse')]),
+                            result_shape([request('parse_item')]))
+
+    def test_admission(self):
+        self.assertEqual(self.admit([item(a='x')]), 1)
+        self.assertIsNone(self.admit([item(a='y')]))
+        self.assertEqual(self.admit([item(a='')]), 2)
+        # full and every stored shape unique
+        self.assertIsNone(self.admit([item(b=1)]))
+
+    def test_replaces_repeated_shape(self):
+        self.policy.fixture_shapes['parse'] = {1: 'aaa', 2: 'aaa', 3: 'bbb'}
+        self.assertEqual(self.admit([item(a='x')], max_fixtures=3), 2)
+
+
+class TestStratifiedAdmission(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def crawl(self, policy, urls, max_fixtures=4):
+        for url in urls:
+            policy.admit(self.dir, 'parse', 0, max_fixtures, [], url=url)
+        stored = policy.strata['parse'].stored
+        return sorted(Counter(stored.values()).items())
+
+    def test_url_template(self):
+        self.assertEqual(url_template('http://x.com/p/123?a=b'), '/p/<id>')
+        self.assertEqual(url_template('http://x.com/sale/2020-01/shoes'),
+                         '/sale/<id>/shoes')
+        self.assertEqual(url_template('http://x.com'), '/')
+        self.assertEqual(url_template('http://x.com/p/blue-shirt', [r'/p/']), r'/p/')
+
+    def test_rare_templates_kept(self):
+        urls = ['http://x.com/p/%s' % i for i in range(50)]
+        urls[10:10] = ['http://x.com/sale/1']
+        urls[30:30] = ['http://x.com/bundle/1']
+        self.assertEqual(
+            self.crawl(StratifiedAdmission(Settings()), urls),
+            [('/bundle/<id>', 1), ('/p/<id>', 2), ('/sale/<id>', 1)])
+
+    def test_max_per_template(self):
+        policy = StratifiedAdmission(Settings({
+            'TESTMASTER_MAX_FIXTURES_PER_TEMPLATE': 2}))
+        urls = ['http://x.com/p/%s' % i for i in range(10)]
+        self.assertEqual(self.crawl(policy, urls), [('/p/<id>', 2)])
+
+    def test_counts_persist(self):
+        policy = StratifiedAdmission(Settings())
+        self.crawl(policy, ['http://x.com/p/%s' % i for i in range(6)])
+        policy.close()
+        with open(os.path.join(self.dir, 'templates.json')) as f:
+            self.assertEqual(json.load(f), {'/p/<id>': 6})
+
+    def test_cancel_keeps_counts(self):
+        policy = StratifiedAdmission(Settings())
+        self.assertEqual(policy.admit(self.dir, 'parse', 0, 4, [],
+                                      url='http://x.com/p/1'), 1)
+        policy.cancel()
+        self.assertEqual(policy.strata['parse'].stored, {})
+        self.assertEqual(policy.strata['parse'].seen, {'/p/<id>': 1})
+
+    def test_get_policy(self):
+        settings = Settings({'TESTMASTER_ADMISSION': 'stratified'})
+        self.assertIsInstance(get_admission_policy(settings), StratifiedAdmission)
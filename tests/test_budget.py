@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapy_testmaster.budget import (
+    MAX_DEFERRED_WRITES,
+    MB,
+    RecordingBudget,
+    TokenBucket
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_debt_and_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(100, clock=clock)
+        self.assertTrue(bucket.ready())
+        bucket.consume(250)
+        self.assertFalse(bucket.ready())
+        clock.now = 1.0
+        self.assertFalse(bucket.ready())
+        clock.now = 1.6
+        self.assertTrue(bucket.ready())
+        clock.now = 100.0
+        bucket.ready()
+        self.assertEqual(bucket.tokens, 100)
+
+
+class TestRecordingBudget(unittest.TestCase):
+    def setUp(self):
+        self.tests_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tests_dir)
+        self.written = []
+
+    def writer(self, name, replaced=0):
+        def write():
+            self.written.append(name)
+            return replaced
+        return write
+
+    def test_disk_quota(self):
+        with open(os.path.join(self.tests_dir, 'fixture1.bin'), 'wb') as f:
+            f.write(b'x' * (MB // 2))
+        budget = RecordingBudget(self.tests_dir, max_disk_mb=1)
+        self.assertEqual(budget.used, MB // 2)
+        self.assertIsNone(budget.check())
+        self.assertTrue(budget.write(MB // 2, self.writer('a')))
+        self.assertEqual(budget.check(), 'disk_quota')
+        # replacing a fixture only counts the difference
+        budget.write(MB // 4, self.writer('b', replaced=MB // 2))
+        self.assertIsNone(budget.check())
+        self.assertEqual(self.written, ['a', 'b'])
+
+    def test_write_rate_defers(self):
+        clock = FakeClock()
+        budget = RecordingBudget(self.tests_dir, max_write_mbps=1, clock=clock)
+        self.assertTrue(budget.write(2 * MB, self.writer('a')))
+        self.assertFalse(budget.write(MB, self.writer('b')))
+        self.assertEqual(self.written, ['a'])
+        self.assertEqual(budget.flush(), 0)
+
+        for i in range(MAX_DEFERRED_WRITES - 1):
+            self.assertIsNone(budget.check())
+            budget.write(1, self.writer(i))
+        self.assertEqual(budget.check(), 'write_rate')
+
+        clock.now = 1.5
+        self.assertEqual(budget.flush(), 1)
+        self.assertEqual(self.written, ['a', 'b'])
+        self.assertEqual(budget.flush(force=True), MAX_DEFERRED_WRITES - 1)
+        self.assertEqual(len(self.written), MAX_DEFERRED_WRITES + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from scrapy_testmaster.drift import DriftReport, diff_results, is_changed
+
+
+def request(url, callback='parse'):
+    return {'url': url, 'method': 'GET', 'callback': callback}
+
+
+class TestDiffResults(unittest.TestCase):
+    def test_field_drift(self):
+        diff = diff_results(
+            [{'name': 'a', 'tags': ['x'], 'old': 1}, {'name': 'b'}],
+            [request('http://a'), request('http://b')],
+            [{'name': 'a', 'tags': ['x', 'y'], 'new': 1}, {'name': 'b'}],
+            [request('http://a'), request('http://c')])
+        self.assertEqual(diff['fields'], {
+            'tags': ['changed', 'length_changed'],
+            'old': ['lost'],
+            'new': ['gained'],
+        })
+        self.assertEqual(diff['requests_gained'], 1)
+        self.assertEqual(diff['requests_lost'], 1)
+        self.assertTrue(is_changed(diff))
+
+    def test_unchanged(self):
+        items, requests = [{'name': 'a'}], [request('http://a')]
+        self.assertFalse(is_changed(diff_results(items, requests, items, requests)))
+        self.assertTrue(is_changed(diff_results(items, requests, [], requests)))
+
+
+class TestDriftReport(unittest.TestCase):
+    def test_aggregation(self):
+        report = DriftReport()
+        changed = diff_results([{'price': 1}], [], [{'price': 2}], [request('http://a')])
+        unchanged = diff_results([{'price': 1}], [], [{'price': 1}], [])
+        for diff in (changed, changed, unchanged):
+            report.add({'callback': 'spider/parse', 'diff': diff})
+        report.add({'callback': 'spider/parse', 'invalid': 'Missing fields'})
+        report.add({'callback': 'spider/parse_item', 'error': 'ValueError: x'})
+
+        stats = report.to_dict()['spider/parse']
+        self.assertEqual((stats['fixtures'], stats['changed'], stats['unchanged'],
+                          stats['invalid']), (4, 2, 1, 1))
+        self.assertEqual(stats['gained_requests'], 2)
+        self.assertEqual(stats['fields']['price']['changed'], 2)
+        self.assertEqual(report.to_dict()['spider/parse_item']['errors'], 1)
+        self.assertIn('price: changed 2', report.format())
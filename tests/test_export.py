@@ -0,0 +1,83 @@
+import os
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+
+from scrapy.settings import Settings
+
+from scrapy_testmaster import fixtures
+from scrapy_testmaster.export import Schema, export_items
+from scrapy_testmaster.storage import get_storage
+from scrapy_testmaster.utils import add_sample
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class TestSchema(unittest.TestCase):
+    def test_inference(self):
+        schema = Schema()
+        schema.update({'a': 1, 'b': 1, 'c': True, 'd': 'x', 'e': None})
+        schema.update({'a': 2, 'b': 1.5, 'c': False, 'd': 3, 'f': {'k': 1}})
+        self.assertEqual(schema.columns[-6:], ['a', 'b', 'c', 'd', 'e', 'f'])
+        self.assertEqual([schema.column_type(c) for c in 'abcdef'],
+                         ['int', 'float', 'bool', 'string', 'string', 'string'])
+        self.assertEqual(schema.cast('b', 1), 1.0)
+        self.assertEqual(schema.cast('d', 3), '3')
+        self.assertEqual(schema.cast('f', {'k': 1}), '{"k": 1}')
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings = Settings({'TESTMASTER_BASE_PATH': self.dir})
+        storage = get_storage(self.settings)
+        for num, items in enumerate([[{'name': 'a', 'price': 1}],
+                                     [{'name': 'b', 'price': 2.5, 'tags': ['x']},
+                                      {'name': 'c', 'price': None}]], 1):
+            test_dir = os.path.join(self.dir, 'tests', 'spider', 'parse')
+            if not os.path.isdir(test_dir):
+                os.makedirs(test_dir)
+            url = 'http://example.com/%d' % num
+            add_sample(num, test_dir, 'parse', {
+                'request': {'url': url},
+                'response': {'url': url, 'status': 200, 'body': b'',
+                             'encoding': 'utf-8'},
+                'result': [{'type': 'item', 'data': i} for i in items] +
+                          [{'type': 'request', 'data': {'url': url}}],
+            }, storage=storage)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def export(self, fmt):
+        out_path = os.path.join(self.dir, 'out.' + fmt)
+        num_rows, _ = export_items(
+            fixtures.query(settings=self.settings), out_path, fmt,
+            processes=2, settings=self.settings)
+        self.assertEqual(num_rows, 3)
+        return out_path
+
+    def test_jsonl(self):
+        with open(self.export('jsonl')) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[1], {
+            '_spider': 'spider', '_callback': 'parse', '_fixture_num': 2,
+            '_url': 'http://example.com/2', 'name': 'b', 'price': 2.5,
+            'tags': ['x']})
+
+    def test_csv(self):
+        with open(self.export('csv')) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([r['price'] for r in rows], ['1.0', '2.5', ''])
+        self.assertEqual([r['tags'] for r in rows], ['', '["x"]', ''])
+
+    @unittest.skipIf(pq is None, "pyarrow is not installed")
+    def test_parquet(self):
+        table = pq.read_table(self.export('parquet'))
+        self.assertEqual(table.column('price').to_pylist(), [1.0, 2.5, None])
+        self.assertEqual(table.column('_fixture_num').to_pylist(), [1, 2, 2])
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from scrapy.settings import Settings
+
+from scrapy_testmaster import fixtures
+from scrapy_testmaster.storage import get_storage
+from scrapy_testmaster.utils import add_sample
+from scrapy_testmaster.utils_novel import write_json
+
+
+def count_items(fixture):
+    return len(fixture.items)
+
+
+class TestFixtureQuery(unittest.TestCase):
+    storage = 'files'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings = Settings({'TESTMASTER_BASE_PATH': self.dir,
+                                  'TESTMASTER_STORAGE': self.storage})
+        storage = get_storage(self.settings)
+        records = [
+            ('spider1', 'parse', 1, 'http://example.com/a', 200, 2),
+            ('spider1', 'parse', 2, 'http://example.com/b', 404, 0),
+            ('spider1', 'parse_item', 1, 'http://example.com/item/1', 200, 1),
+            ('spider2', 'parse', 1, 'http://example.org/', 200, 3),
+        ]
+        for spider, callback, num, url, status, num_items in records:
+            test_dir = os.path.join(self.dir, 'tests', spider, callback)
+            if not os.path.isdir(test_dir):
+                os.makedirs(test_dir)
+            result = [{'type': 'item', 'data': {'n': i}} for i in range(num_items)]
+            data = {
+                'spider_name': spider,
+                'request': {'url': url},
+                'response': {'url': url, 'status': status, 'body': b'',
+                             'encoding': 'utf-8'},
+                'result': result,
+            }
+            add_sample(num, test_dir, callback, data, storage=storage)
+            write_json(test_dir, {'url': url}, result, num,
+                       extra={'status': status})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def query(self, **kwargs):
+        return [(f.spider, f.callback, f.fixture_num) for f in
+                fixtures.query(settings=self.settings, **kwargs)]
+
+    def test_filters(self):
+        self.assertEqual(len(self.query()), 4)
+        self.assertEqual(self.query(spider='spider2'), [('spider2', 'parse', 1)])
+        self.assertEqual(self.query(spider='spider1', callback='parse'),
+                         [('spider1', 'parse', 1), ('spider1', 'parse', 2)])
+        self.assertEqual(self.query(url=r'/item/'),
+                         [('spider1', 'parse_item', 1)])
+        self.assertEqual(self.query(status=404), [('spider1', 'parse', 2)])
+        self.assertEqual(len(self.query(since=datetime.now() - timedelta(1))), 4)
+        self.assertEqual(self.query(until=datetime.now() - timedelta(1)), [])
+
+    def test_slow_fixtures(self):
+        slow_dir = os.path.join(self.dir, 'tests', 'spider1', 'parse', 'slow')
+        os.makedirs(slow_dir)
+        url = 'http://example.com/slow'
+        add_sample(1, slow_dir, 'parse', {
+            'spider_name': 'spider1',
+            'request': {'url': url},
+            'response': {'url': url, 'status': 200, 'body': b'',
+                         'encoding': 'utf-8'},
+            'result': [],
+        }, storage=get_storage(self.settings))
+        write_json(slow_dir, {'url': url}, [], 1, extra={'status': 200})
+        self.assertEqual(self.query(url='/slow$'), [('spider1', 'parse', 1)])
+        self.assertEqual(len(self.query(callback='parse')), 4)
+
+    def test_lazy_data(self):
+        fixture = next(fixtures.query(settings=self.settings, url='/b$'))
+        self.assertIsNone(fixture._data)
+        self.assertEqual(fixture.status, 404)
+        self.assertEqual(fixture.items, [])
+        self.assertEqual(fixture.response['url'], 'http://example.com/b')
+
+    def test_map(self):
+        results = list(fixtures.map(
+            count_items, fixtures.query(settings=self.settings),
+            processes=2, settings=self.settings))
+        self.assertEqual(results, [2, 0, 1, 3])
+
+    def test_map_reads_ahead_a_bounded_window(self):
+        taken = []
+
+        def take():
+            for fixture in fixtures.query(settings=self.settings):
+                taken.append(fixture)
+                yield fixture
+        results = fixtures.map(count_items, take(), processes=1, chunksize=1,
+                               settings=self.settings)
+        self.assertEqual(next(results), 2)
+        # two chunks in flight per process, and one more once the first is done
+        self.assertEqual(len(taken), 3)
+        self.assertEqual(list(results), [0, 1, 3])
+
+
+class TestSqliteFixtureQuery(TestFixtureQuery):
+    storage = 'sqlite'
@@ -0,0 +1,100 @@
+import os
+import json
+import random
+import shutil
+import tempfile
+import unittest
+
+from scrapy_testmaster.merge import merge_callback, merge_samples
+from scrapy_testmaster.storage import FileStorage, load_fixture_data
+from scrapy_testmaster.utils import add_sample
+from scrapy_testmaster.utils_novel import write_json
+
+
+def fixture_data(url):
+    return {
+        'request': {'url': url},
+        'response': {'url': url, 'status': 200, 'body': url.encode('utf-8'),
+                     'encoding': 'utf-8'},
+        'result': [],
+    }
+
+
+class TestMergeSamples(unittest.TestCase):
+    def test_weighted_by_responses_seen(self):
+        rng = random.Random(0)
+        picks = {'a': 0, 'b': 0}
+        for _ in range(200):
+            for name in merge_samples([(900, ['a'] * 10), (100, ['b'] * 10)],
+                                      10, rng=rng):
+                picks[name] += 1
+        self.assertAlmostEqual(picks['a'] / 2000, 0.9, delta=0.03)
+
+    def test_small_samples(self):
+        picked = merge_samples([(5, [1, 2]), (0, []), (1, [3])], 10)
+        self.assertEqual(sorted(picked), [1, 2, 3])
+
+
+class TestMergeCallback(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.tests_dir = os.path.join(self.dir, 'tests')
+        self.storage = FileStorage(None)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_dir(self, test_dir, urls, seen=None, **extra):
+        os.makedirs(test_dir)
+        for i, url in enumerate(urls, 1):
+            data = fixture_data(url)
+            add_sample(i, test_dir, 'test', data, storage=self.storage)
+            write_json(test_dir, data['request'], [], i, extra=dict(extra))
+        if seen is not None:
+            with open(os.path.join(os.path.dirname(test_dir), 'seen.json'), 'w') as f:
+                json.dump({os.path.basename(test_dir): seen}, f)
+
+    def urls(self, test_dir):
+        return [load_fixture_data(path, storage=self.storage)['request']['url']
+                for path in self.storage.iter_paths(test_dir, recursive=False)]
+
+    def test_merge(self):
+        test_dir = os.path.join(self.tests_dir, 'spider', 'parse')
+        self.make_dir(test_dir, ['u%s' % i for i in range(10)], seen=10)
+        src_dir = os.path.join(self.dir, 'spool', 'n', 'tests', 'spider', 'parse')
+        self.make_dir(src_dir, ['u0', 'v1', 'v2'])
+        record = merge_callback(self.tests_dir, os.path.join('spider', 'parse'),
+                                [('n', src_dir, 1000)], 10, storage=self.storage,
+                                rng=random.Random(0))
+        self.assertEqual(record['before'], 10)
+        self.assertEqual(record['after'], 10)
+        self.assertEqual(record['duplicates'], 1)
+        self.assertEqual(record['added'], 2)
+        self.assertEqual(record['dropped'], 2)
+        # renumbered from 1, the stored fixtures first
+        urls = self.urls(test_dir)
+        self.assertEqual(urls[-2:], ['v1', 'v2'])
+        self.assertEqual(len(set(urls)), 10)
+        with open(os.path.join(test_dir, 'view.json')) as f:
+            view = json.load(f)
+        self.assertEqual(sorted(view, key=int), [str(i) for i in range(1, 11)])
+        self.assertEqual([view[str(i)]['request']['url'] for i in range(1, 11)],
+                         urls)
+
+    def test_slow(self):
+        rel_path = os.path.join('spider', 'parse', 'slow')
+        test_dir = os.path.join(self.tests_dir, rel_path)
+        self.make_dir(test_dir, ['a'], wall_ms=5)
+        src_dir = os.path.join(self.dir, 'spool', 'n', 'tests', rel_path)
+        self.make_dir(src_dir, ['b'], wall_ms=50)
+        merge_callback(self.tests_dir, rel_path, [('n', src_dir, 1)], 10,
+                       storage=self.storage)
+        self.assertEqual(self.urls(test_dir), ['b'])
+        self.assertFalse(os.path.exists(os.path.join(test_dir, 'config.py')))
+
+        # sized by TESTMASTER_SLOW_FIXTURES, not by the largest pool
+        src_dir = os.path.join(self.dir, 'spool', 'm', 'tests', rel_path)
+        self.make_dir(src_dir, ['c', 'd'], wall_ms=80)
+        merge_callback(self.tests_dir, rel_path, [('m', src_dir, 2)], 10,
+                       slow_fixtures=1, storage=self.storage)
+        self.assertEqual(self.urls(test_dir), ['c'])
@@ -0,0 +1,44 @@
+import unittest
+
+import lxml.html
+
+from scrapy_testmaster.minimize import ddmin, minimize_body
+
+
+class TestDdmin(unittest.TestCase):
+    def test_finds_needed_items(self):
+        calls = []
+
+        def passes(items):
+            calls.append(items)
+            return {3, 7} <= set(items)
+
+        self.assertEqual(sorted(ddmin(range(10), passes)), [3, 7])
+
+    def test_nothing_needed(self):
+        self.assertEqual(ddmin([1, 2, 3], lambda items: True), [])
+
+
+class TestMinimizeBody(unittest.TestCase):
+    body = (b'<html><head><script>var a = 1;</script><style>p {}</style></head>'
+            b'<body><div class="ad"><img src="x.gif"></div>'
+            b'<div id="main"><p>keep me</p><span>noise</span></div>'
+            b'<a href="/next">next</a></body></html>')
+
+    @staticmethod
+    def output(body):
+        doc = lxml.html.document_fromstring(body)
+        return (doc.xpath('//p/text()'), doc.xpath('//a/@href'))
+
+    def test_strips_unused_subtrees(self):
+        expected = self.output(self.body)
+        minimized = minimize_body(
+            self.body, 'utf-8', lambda body: self.output(body) == expected)
+        self.assertEqual(self.output(minimized), expected)
+        self.assertLess(len(minimized), len(self.body))
+        for noise in (b'script', b'style', b'ad', b'noise'):
+            self.assertNotIn(noise, minimized)
+
+    def test_unstable_serialization(self):
+        with self.assertRaises(ValueError):
+            minimize_body(self.body, 'utf-8', lambda body: body == self.body)
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from scrapy import Request, Spider
+from scrapy.http import TextResponse
+from scrapy.settings import Settings
+
+from scrapy_testmaster.monitor import Monitor, callback_name
+
+
+def make_callback():
+    def callback(self, response):
+        pass
+    return callback
+
+
+class MySpider(Spider):
+    name = 'myspider'
+
+    def parse(self, response):
+        pass
+
+    # named as the recorder does, after the spider attribute
+    parse_item = make_callback()
+
+
+class FakeRandom(object):
+    def __init__(self, values):
+        self.values = list(values)
+
+    def random(self):
+        return self.values.pop(0)
+
+
+class TestMonitor(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings = Settings({'TESTMASTER_OBLIGATE_ITEM_FIELDS': ['a']})
+        self.spider = MySpider()
+        self.spider.settings = self.settings
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def response(self, url='http://example.com/'):
+        return TextResponse(url, body=b'', request=Request(
+            url, callback=self.spider.parse))
+
+    def test_from_settings(self):
+        self.assertIsNone(Monitor.from_settings(Settings(), self.dir))
+        monitor = Monitor.from_settings(
+            Settings({'TESTMASTER_MODE': 'monitor',
+                      'TESTMASTER_MONITOR_SAMPLE_RATE': 0.5}), self.dir)
+        self.assertEqual(monitor.sample_rate, 0.5)
+
+    def test_callback_name(self):
+        self.assertEqual(callback_name(self.response().request, self.spider), 'parse')
+        request = Request('http://example.com/', callback=self.spider.parse_item)
+        self.assertEqual(callback_name(request, self.spider), 'parse_item')
+        self.assertEqual(callback_name(Request('http://example.com/'), self.spider),
+                         'parse')
+
+    def test_unsampled_output_untouched(self):
+        monitor = Monitor(self.dir, self.settings, sample_rate=0.5,
+                          rng=FakeRandom([0.7]))
+        result = iter([{'b': 1}])
+        self.assertIs(
+            monitor.process_spider_output(self.response(), result, self.spider),
+            result)
+        report = monitor.report()['callbacks']['parse']
+        self.assertEqual((report['seen'], report['validated']), (1, 0))
+
+    def test_violations_aggregated(self):
+        report_path = os.path.join(self.dir, 'report.json')
+        monitor = Monitor(self.dir, self.settings, report_path=report_path,
+                          sample_rate=0.5, rng=FakeRandom([0.1, 0.2, 0.9]))
+        for item in ({'a': 1}, {'b': 1}, {'b': 2}):
+            out = monitor.process_spider_output(
+                self.response(), iter([item]), self.spider)
+            self.assertEqual(list(out), [item])
+        monitor.write_report()
+        with open(report_path) as f:
+            report = json.load(f)['callbacks']['parse']
+        self.assertEqual(report['seen'], 3)
+        self.assertEqual(report['validated'], 2)
+        self.assertEqual(report['invalid'], 1)
+        self.assertEqual(report['violations'], {'fields': 1})
+        self.assertEqual(report['examples'][0]['check'], 'fields')
+
+    def test_callback_sample_rate(self):
+        callback_dir = os.path.join(self.dir, 'tests', 'myspider', 'parse')
+        os.makedirs(callback_dir)
+        with open(os.path.join(callback_dir, 'config.py'), 'w') as f:
+            f.write('MONITOR_SAMPLE_RATE = 1\n')
+        monitor = Monitor(self.dir, self.settings, sample_rate=0,
+                          rng=FakeRandom([]))
+        monitor.process_spider_output(self.response(), iter([]), self.spider)
+        self.assertEqual(monitor.report()['callbacks']['parse']['validated'], 1)
@@ -0,0 +1,87 @@
+import io
+import json
+import unittest
+from argparse import Namespace
+from contextlib import redirect_stdout
+
+from scrapy import Request
+
+from scrapy_testmaster.parse import ResultStore, iter_url_specs, write_jsonl
+
+
+class TestResultStore(unittest.TestCase):
+    def test_in_memory(self):
+        store = ResultStore()
+        self.assertFalse(store)
+        store.add(1, [{'a': 1}])
+        store.add(2, [{'b': 2}])
+        store.add(1, [{'c': 3}])
+        self.assertEqual(store.levels(), [1, 2])
+        self.assertEqual(list(store.iter_level(1)), [{'a': 1}, {'c': 3}])
+        self.assertEqual(list(store.iter_all()),
+                         [{'a': 1}, {'c': 3}, {'b': 2}])
+
+    def test_spill(self):
+        store = ResultStore(spill_mb=0.0001)
+        entries = [{'n': i, 'pad': 'x' * 50} for i in range(20)]
+        store.add(1, entries[:10])
+        store.add(2, [lambda: None])
+        store.add(1, entries[10:])
+        self.assertTrue(store._files)
+        self.assertEqual(list(store.iter_level(1)), entries)
+        unpicklable = list(store.iter_level(2))
+        self.assertEqual(len(unpicklable), 1)
+        self.assertIn('lambda', repr(unpicklable[0]))
+
+
+class TestJsonl(unittest.TestCase):
+    def test_write_jsonl(self):
+        def parse_next(response):
+            pass
+        args = Namespace(noitems=False, nolinks=False)
+        request = Request('http://example.com/2', callback=parse_next,
+                          meta={'x': 1, '_depth': 2})
+        out = io.StringIO()
+        with redirect_stdout(out):
+            write_jsonl(1, 'http://example.com/1', [{'a': b'b'}, request],
+                        args)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(lines, [
+            {'type': 'item', 'depth': 1, 'source_url': 'http://example.com/1',
+             'data': {'a': 'b'}},
+            {'type': 'request', 'depth': 1,
+             'source_url': 'http://example.com/1',
+             'data': {'url': 'http://example.com/2', 'method': 'GET',
+                      'callback': 'parse_next', 'meta': {'x': 1},
+                      'cb_kwargs': {}}},
+        ])
+
+    def test_jsonable_values(self):
+        args = Namespace(noitems=False, nolinks=True)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            write_jsonl(1, 'http://example.com/1', [
+                {'a': None, 'b': (1, 2), 'c': True, 'd': b'\xff', b'e': 1.5},
+            ], args)
+        self.assertEqual(json.loads(out.getvalue())['data'], {
+            'a': None, 'b': [1, 2], 'c': True, 'd': '\ufffd', 'e': 1.5})
+
+
+class TestUrlSpecs(unittest.TestCase):
+    def test_iter_url_specs(self):
+        lines = [
+            'http://example.com/1\n',
+            '\n',
+            '# comment\n',
+            '{"url": "http://example.com/2", "callback": "parse_item", '
+            '"meta": {"x": 1}}\n',
+            'not a url\n',
+            '{"broken json\n',
+        ]
+        with self.assertLogs('scrapy_testmaster.parse', level='ERROR'):
+            specs = list(iter_url_specs(lines))
+        self.assertEqual(specs, [
+            {'url': 'http://example.com/1'},
+            {'url': 'http://example.com/2', 'callback': 'parse_item',
+             'meta': {'x': 1}},
+        ])
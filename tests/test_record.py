@@ -3,6 +3,7 @@ import tempfile
 import subprocess
 import os
 import shutil
+import json
 import re
 
 
@@ -148,7 +149,8 @@ class CaseSpider(object):
                 second_callback=self._second_callback
             ))
 
-    def record(self, args=None, settings=None, record_verbosity=False):
+    def record(self, args=None, settings=None, record_verbosity=False,
+               expect_tests=True):
         if self._start_requests is None or self._parse is None:
             raise AssertionError()
         self._write_spider()
@@ -175,11 +177,12 @@ class CaseSpider(object):
         check_process('Running spider failed!', result)
         if record_verbosity:
             print_test_output(result)
-        if not any(
+        if expect_tests and not any(
             any(f.endswith('.py') and f != '__init__.py' for f in files)
             for _, _, files in os.walk(os.path.join(self.dir, 'testmaster'))
         ):
             process_error('No testmaster tests recorded!', result)
+        return result
 
     def test(self, test_verbosity=True):
         if self._start_requests is None or self._parse is None:
@@ -207,6 +210,23 @@ class CaseSpider(object):
         if test_verbosity:
             print_test_output(result)
 
+    def test_pytest(self, *args, check=True):
+        env = os.environ.copy()
+        env['SCRAPY_SETTINGS_MODULE'] = 'myproject.settings'
+        result = run(
+            [
+                'python', '-m', 'pytest', '--testmaster', '-v',
+                '-p', 'no:cacheprovider', 'testmaster'
+            ] + list(args),
+            env=env,
+            cwd=self.dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if check:
+            check_process('Pytest run failed!', result)
+        return result
+
 
 class TestRecording(unittest.TestCase):
 
@@ -480,6 +500,62 @@ class TestRecording(unittest.TestCase):
                                         re.escape(expected_message)):
                 spider.test(test_verbosity=True)
 
+    def test_output_comparison_stops_early(self):
+        with CaseSpider() as spider:
+            spider.imports('import itertools')
+            spider.start_requests("yield scrapy.Request('data:text/plain,')")
+            spider.parse("""
+                for i in range(3):
+                    yield {'a': i}
+            """)
+            spider.record()
+
+            # the rest of the output isn't drained once it's longer
+            spider.parse("""
+                for i in itertools.count():
+                    if i > 100:
+                        raise Exception('drained')
+                    yield {'a': i}
+            """)
+            spider._write_spider()
+            out = spider.test_pytest(check=False)['stdout'].decode('utf-8')
+            self.assertIn('Expected 3 elements, found more '
+                          '(output #3 onwards is extra)', out)
+            self.assertNotIn('drained', out)
+
+            spider.parse("""
+                for i in range(3):
+                    yield {'a': -i}
+            """)
+            spider._write_spider()
+            out = spider.test_pytest(check=False)['stdout'].decode('utf-8')
+            self.assertIn('Callback output #1 ', out)
+            self.assertNotIn('Callback output #2 ', out)
+
+            out = spider.test_pytest('--testmaster-collect-all',
+                                     check=False)['stdout'].decode('utf-8')
+            self.assertIn('2 mismatches:', out)
+            self.assertIn('Callback output #1 ', out)
+            self.assertIn('Callback output #2 ', out)
+
+            out = spider.test_pytest('--testmaster-collect-all=1',
+                                     check=False)['stdout'].decode('utf-8')
+            self.assertNotIn('Callback output #2 ', out)
+
+            # exactly as many mismatches as the limit isn't stopping early
+            out = spider.test_pytest('--testmaster-collect-all=2',
+                                     check=False)['stdout'].decode('utf-8')
+            self.assertIn('2 mismatches:', out)
+
+            spider.parse("""
+                for i in range(3):
+                    yield {'a': -i - 1}
+            """)
+            spider._write_spider()
+            out = spider.test_pytest('--testmaster-collect-all=2',
+                                     check=False)['stdout'].decode('utf-8')
+            self.assertIn('2 mismatches (stopped at the limit):', out)
+
     def test_attribute_change_raises_error(self):
         class ModifiedSpider(CaseSpider):
             @property
@@ -508,6 +584,372 @@ class TestRecording(unittest.TestCase):
                                         re.escape(expected_message)):
                 spider.test(test_verbosity=True)
 
+    def test_peak_memory_budget(self):
+        with CaseSpider() as spider:
+            spider.custom_settings('''
+                TESTMASTER_MAX_PEAK_MEMORY_MB = 50
+            ''')
+            spider.start_requests("yield scrapy.Request('data:text/plain,')")
+            spider.parse('''
+                yield {'a': 4}
+            ''')
+            spider.record()
+            spider.test()
+            view_path = os.path.join(
+                spider.dir, 'testmaster', 'tests', 'myspider', 'parse',
+                'view.json')
+            with open(view_path) as f:
+                view = json.load(f)
+            self.assertNotIn('peak_memory_mb', view['1'])
+
+        with CaseSpider() as spider:
+            spider.custom_settings('''
+                TESTMASTER_MAX_PEAK_MEMORY_MB = 50,
+                TESTMASTER_RECORD_PEAK_MEMORY = True,
+            ''')
+            spider.start_requests("yield scrapy.Request('data:text/plain,')")
+            spider.parse('''
+                yield {'a': 4}
+            ''')
+            spider.record()
+            spider.test()
+            view_path = os.path.join(
+                spider.dir, 'testmaster', 'tests', 'myspider', 'parse',
+                'view.json')
+            with open(view_path) as f:
+                view = json.load(f)
+            self.assertIn('peak_memory_mb', view['1'])
+
+        with CaseSpider() as spider:
+            spider.custom_settings('''
+                TESTMASTER_MAX_PEAK_MEMORY_MB = 1
+            ''')
+            spider.start_requests("yield scrapy.Request('data:text/plain,')")
+            spider.parse('''
+                big = [str(i) for i in range(200000)]
+                yield {'a': len(big)}
+            ''')
+            spider.record()
+            with self.assertRaisesRegex(AssertionError,
+                                        'exceeding the budget of 1'):
+                spider.test(test_verbosity=True)
+
+        # measured as the output is compared, so it's never all held at once
+        with CaseSpider() as spider:
+            spider.custom_settings('''
+                TESTMASTER_MAX_PEAK_MEMORY_MB = 5
+            ''')
+            spider.start_requests("yield scrapy.Request('data:text/plain,')")
+            spider.parse('''
+                for i in range(20):
+                    yield {'a': str(i) * 500000}
+            ''')
+            spider.record()
+            spider.test()
+
+    def test_pytest_plugin(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                yield {'a': response.text}
+            """)
+            spider.record(settings=dict(TESTMASTER_WRITE_TEST_MODULES=0))
+            callback_dir = os.path.join(
+                spider.dir, 'testmaster', 'tests', 'myspider', 'parse')
+            self.assertNotIn('test_fixtures.py', os.listdir(callback_dir))
+            self.assertNotIn('__init__.py', os.listdir(callback_dir))
+            out = spider.test_pytest()['stdout'].decode('utf-8')
+            for i in range(1, 4):
+                self.assertIn('myspider/parse/fixture%d PASSED' % i, out)
+
+    def test_coverage_admission(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(6):
+                    yield scrapy.Request('data:text/plain,%s%s' % ('ab'[i % 2], i))
+            """)
+            spider.parse("""
+                if response.text.startswith('a'):
+                    yield {'a': 1}
+                else:
+                    yield {'b': 2}
+            """)
+            spider.record(settings=dict(
+                TESTMASTER_ADMISSION='coverage',
+                TESTMASTER_COVERAGE_SAMPLE_RATE=1))
+            callback_dir = os.path.join(
+                spider.dir, 'testmaster', 'tests', 'myspider', 'parse')
+            fixtures = [f for f in os.listdir(callback_dir)
+                        if f.endswith('.bin')]
+            self.assertEqual(sorted(fixtures), ['fixture1.bin', 'fixture2.bin'])
+            with open(os.path.join(callback_dir, 'view.json')) as f:
+                view = json.load(f)
+            self.assertNotEqual(view['1']['coverage'], view['2']['coverage'])
+            spider.test()
+
+    def test_coverage_admission_list_callback(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(4):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                return [{'a': response.text}]
+            """)
+            spider.record(settings=dict(
+                TESTMASTER_ADMISSION='coverage',
+                TESTMASTER_COVERAGE_SAMPLE_RATE=1))
+            callback_dir = os.path.join(
+                spider.dir, 'testmaster', 'tests', 'myspider', 'parse')
+            fixtures = [f for f in os.listdir(callback_dir)
+                        if f.endswith('.bin')]
+            self.assertEqual(len(fixtures), 4)
+            spider.test()
+
+    def test_replay_session(self):
+        with CaseSpider() as spider:
+            spider.imports('''
+import os
+from scrapy_testmaster.session import fixture_reset
+
+LOG = os.path.join(os.path.dirname(__file__), 'events.log')
+
+
+def log(event):
+    with open(LOG, 'a') as f:
+        f.write(event + '\\n')
+
+
+class CountingMiddleware(object):
+    def __init__(self, crawler):
+        log('init')
+        crawler.signals.connect(self.opened, signal=scrapy.signals.spider_opened)
+        crawler.signals.connect(self.reset, signal=fixture_reset)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def opened(self, spider):
+        log('opened')
+
+    def reset(self, spider):
+        log('reset')
+''')
+            spider.custom_settings('''
+                SPIDER_MIDDLEWARES_BASE=dict(
+                    scrapy.settings.default_settings.SPIDER_MIDDLEWARES_BASE,
+                    **{'myproject.myspider.CountingMiddleware': 960}),
+            ''')
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            # attributes set by one replay mustn't leak into the next
+            spider.parse("""
+                self.seen = response.text
+                yield {'a': response.text}
+            """)
+            spider.record()
+            with open(os.path.join(spider.proj_dir, 'settings.py'), 'a') as dest:
+                dest.write('TESTMASTER_REPLAY_SESSION = True\n')
+            log_path = os.path.join(spider.proj_dir, 'events.log')
+            os.remove(log_path)
+            spider.test()
+            with open(log_path) as f:
+                events = f.read().split()
+            self.assertEqual(events, ['init', 'opened', 'reset', 'reset', 'reset'])
+
+    def test_seen_counts_across_crawls(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                yield {'a': response.text}
+            """)
+            spider_dir = os.path.join(spider.dir, 'testmaster', 'tests', 'myspider')
+            seen_path = os.path.join(spider_dir, 'seen.json')
+
+            def fixtures():
+                return sorted(f for f in os.listdir(os.path.join(spider_dir, 'parse'))
+                              if f.endswith('.bin'))
+
+            spider.record()
+            with open(seen_path) as f:
+                self.assertEqual(json.load(f), {'parse': 3})
+            # later crawls add fixtures rather than overwrite the first ones
+            spider.record()
+            with open(seen_path) as f:
+                self.assertEqual(json.load(f), {'parse': 6})
+            self.assertEqual(len(fixtures()), 6)
+
+            # without counts, those of the fixtures stored are assumed
+            os.remove(seen_path)
+            spider.record()
+            with open(seen_path) as f:
+                self.assertEqual(json.load(f), {'parse': 9})
+            self.assertEqual(len(fixtures()), 9)
+
+            # fixtures added by testmaster parse count as seen, so crawls
+            # never see fewer responses than there are fixtures
+            page = os.path.join(spider.dir, 'page.txt')
+            with open(page, 'w') as f:
+                f.write('9')
+            env = os.environ.copy()
+            env['PYTHONPATH'] = spider.dir
+            env['SCRAPY_SETTINGS_MODULE'] = 'myproject.settings'
+            env['SCRAPY_TESTMASTER_ENABLED'] = '1'
+            result = run(['testmaster', 'parse', 'file://' + page,
+                          '--spider', 'myspider', '-c', 'parse'],
+                         env=env, cwd=spider.dir,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            check_process('testmaster parse failed!', result)
+            with open(seen_path) as f:
+                self.assertEqual(json.load(f), {'parse': 10})
+            self.assertEqual(len(fixtures()), 10)
+            spider.record()
+            with open(seen_path) as f:
+                self.assertEqual(json.load(f), {'parse': 13})
+            self.assertEqual(len(fixtures()), 10)
+            spider.test()
+
+    def test_disk_quota(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                yield {'a': response.text}
+            """)
+            # the quota is overshot by one fixture at most
+            result = spider.record(settings=dict(TESTMASTER_MAX_DISK_MB=0.0001))
+            callback_dir = os.path.join(
+                spider.dir, 'testmaster', 'tests', 'myspider', 'parse')
+            fixtures = [f for f in os.listdir(callback_dir)
+                        if f.endswith('.bin')]
+            self.assertEqual(fixtures, ['fixture1.bin'])
+            self.assertIn("'testmaster/skipped/disk_quota': 2",
+                          result['stderr'].decode('utf-8'))
+            spider.test()
+
+    def test_slow_fixtures(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                import time
+                time.sleep(0.01 * int(response.text))
+                yield {'a': response.text}
+            """)
+            result = spider.record(settings=dict(TESTMASTER_SLOW_FIXTURES=1))
+            slow_dir = os.path.join(spider.dir, 'testmaster', 'tests',
+                                    'myspider', 'parse', 'slow')
+            fixtures = [f for f in os.listdir(slow_dir) if f.endswith('.bin')]
+            self.assertEqual(fixtures, ['fixture1.bin'])
+            self.assertFalse(os.path.exists(os.path.join(slow_dir, 'config.py')))
+            with open(os.path.join(slow_dir, 'view.json')) as f:
+                view = json.load(f)
+            self.assertEqual(len(view), 1)
+            entry = list(view.values())[0]
+            self.assertTrue(entry['performance'])
+            self.assertGreaterEqual(entry['wall_ms'], 20)
+            self.assertTrue(entry['request']['url'].endswith(',2'))
+            self.assertIn("'testmaster/slow/recorded'",
+                          result['stderr'].decode('utf-8'))
+            spider.test()
+
+    def test_slow_fixtures_list_callback(self):
+        with CaseSpider() as spider:
+            spider.start_requests("yield scrapy.Request('data:text/plain,1')")
+            spider.parse("""
+                import time
+                time.sleep(0.05)
+                return [{'a': response.text}]
+            """)
+            spider.record(settings=dict(TESTMASTER_SLOW_FIXTURES=1))
+            slow_dir = os.path.join(spider.dir, 'testmaster', 'tests',
+                                    'myspider', 'parse', 'slow')
+            with open(os.path.join(slow_dir, 'view.json')) as f:
+                view = json.load(f)
+            self.assertGreaterEqual(view['1']['wall_ms'], 50)
+            spider.test()
+
+    def test_spools_merge(self):
+        from scrapy.settings import Settings
+        from scrapy_testmaster.merge import find_spools, merge_spools
+
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                yield {'a': response.text}
+            """)
+            spool_dir = os.path.join(spider.dir, 'spool')
+            for node in ('a', 'b'):
+                spider.record(settings=dict(TESTMASTER_SPOOL_DIR=spool_dir,
+                                            TESTMASTER_NODE_ID=node),
+                              expect_tests=False)
+            node_dir = os.path.join(spool_dir, 'a', 'tests', 'myspider')
+            self.assertEqual(len([f for f in os.listdir(os.path.join(node_dir, 'parse'))
+                                  if f.endswith('.bin')]), 3)
+            with open(os.path.join(node_dir, 'seen.json')) as f:
+                self.assertEqual(json.load(f), {'parse': 3})
+            spider_dir = os.path.join(spider.dir, 'testmaster', 'tests', 'myspider')
+            self.assertFalse(os.path.exists(spider_dir))
+
+            tests_dir = os.path.join(spider.dir, 'testmaster', 'tests')
+            spools = find_spools([spool_dir])
+            self.assertEqual([os.path.basename(s) for s in spools], ['a', 'b'])
+            records = merge_spools(tests_dir, spools, Settings(), processes=2)
+            # both nodes crawled the same pages
+            self.assertEqual(records, [{
+                'callback': os.path.join('myspider', 'parse'), 'before': 0,
+                'after': 3, 'added': 3, 'dropped': 0, 'duplicates': 3}])
+            self.assertEqual(os.listdir(spool_dir), [])
+            with open(os.path.join(spider_dir, 'seen.json')) as f:
+                self.assertEqual(json.load(f), {'parse': 6})
+            with open(os.path.join(spider_dir, 'parse', 'view.json')) as f:
+                view = json.load(f)
+            self.assertEqual(sorted(view), ['1', '2', '3'])
+            self.assertEqual(len(set(e['fixture_id'] for e in view.values())), 3)
+            spider.test()
+
+    def test_monitor_mode(self):
+        with CaseSpider() as spider:
+            spider.start_requests("""
+                for i in range(3):
+                    yield scrapy.Request('data:text/plain,%s' % i)
+            """)
+            spider.parse("""
+                if response.text == '1':
+                    yield {'b': response.text}
+                else:
+                    yield {'a': response.text}
+            """)
+            result = spider.record(settings=dict(
+                TESTMASTER_MODE='monitor', TESTMASTER_MONITOR_SAMPLE_RATE=1,
+                TESTMASTER_OBLIGATE_ITEM_FIELDS='a'), expect_tests=False)
+            base_path = os.path.join(spider.dir, 'testmaster')
+            self.assertFalse(os.path.exists(os.path.join(base_path, 'tests')))
+            stderr = result['stderr'].decode('utf-8')
+            self.assertIn("'testmaster/monitor/validated': 3", stderr)
+            self.assertIn("'testmaster/monitor/violations/fields': 1", stderr)
+            with open(os.path.join(base_path, 'monitor', 'myspider.json')) as f:
+                report = json.load(f)
+            self.assertEqual(report['callbacks']['parse']['invalid'], 1)
+            self.assertEqual(report['callbacks']['parse']['examples'][0]['url'],
+                             'data:text/plain,1')
+
     def test_missing_parse_method_raises_assertionerror(self):
         with CaseSpider() as spider:
             spider.start_requests("""
@@ -0,0 +1,53 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from scrapy_testmaster.replay import (
+    assign_shards,
+    estimate_costs,
+    fixture_test_id,
+    iter_fixture_paths,
+    parse_shard_arg
+)
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cb_dir = os.path.join(self.dir, 'tests', 'myspider', 'parse')
+        os.makedirs(self.cb_dir)
+        for i, size in enumerate([100, 200, 300, 400], 1):
+            with open(os.path.join(self.cb_dir, 'fixture%d.bin' % i), 'wb') as f:
+                f.write(b'x' * size)
+        self.paths = list(iter_fixture_paths(self.dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fixture_ids(self):
+        self.assertEqual([fixture_test_id(p) for p in self.paths], [
+            'myspider/parse/fixture%d' % i for i in range(1, 5)])
+
+    def test_size_fallback(self):
+        shards = assign_shards(self.paths, 2)
+        names = [[os.path.basename(p) for p in shard] for shard in shards]
+        self.assertEqual(names, [['fixture1.bin', 'fixture4.bin'],
+                                 ['fixture2.bin', 'fixture3.bin']])
+
+    def test_history(self):
+        with open(os.path.join(self.cb_dir, 'timings.json'), 'w') as f:
+            json.dump({'fixture1.bin': 10.0, 'fixture2.bin': 1.0}, f)
+        costs = estimate_costs(self.paths)
+        self.assertEqual(costs[self.paths[0]], 10.0)
+        # 11 seconds over 300 bytes of known fixtures
+        self.assertAlmostEqual(costs[self.paths[3]], 400 * 11.0 / 300)
+        p1, p2, p3, p4 = self.paths
+        self.assertEqual(assign_shards(self.paths, 2), [[p2, p4], [p1, p3]])
+
+    def test_parse_shard_arg(self):
+        self.assertEqual(parse_shard_arg('2/8'), (2, 8))
+        for bad in ('0/8', '9/8', '2', 'a/b'):
+            with self.assertRaises(ValueError):
+                parse_shard_arg(bad)
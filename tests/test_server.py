@@ -0,0 +1,132 @@
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import threading
+import importlib
+import unittest
+
+from scrapy_testmaster.server import (
+    ModuleReloader,
+    ReplayClient,
+    ReplayServer,
+    default_socket_path
+)
+
+
+def write_module(path, source, mtime):
+    with open(path, 'w') as f:
+        f.write(source)
+    os.utime(path, ns=(mtime, mtime))
+
+
+class TestModuleReloader(unittest.TestCase):
+    def setUp(self):
+        self.project_dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.project_dir)
+        self.helpers = os.path.join(self.project_dir, 'tm_helpers.py')
+        write_module(self.helpers, 'def price():\n    return 1\n', 10 ** 18)
+        write_module(os.path.join(self.project_dir, 'tm_spider.py'),
+                     'from tm_helpers import price\n', 10 ** 18)
+        write_module(os.path.join(self.project_dir, 'tm_other.py'),
+                     'VALUE = 1\n', 10 ** 18)
+        importlib.invalidate_caches()
+        for name in ('tm_helpers', 'tm_spider', 'tm_other'):
+            importlib.import_module(name)
+
+    def tearDown(self):
+        sys.path.remove(self.project_dir)
+        for name in ('tm_helpers', 'tm_spider', 'tm_other'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.project_dir)
+
+    def test_reloads_changed_modules_and_dependents(self):
+        reloader = ModuleReloader(self.project_dir)
+        self.assertEqual(reloader.reload_changed(), [])
+
+        write_module(self.helpers, 'def price():\n    return 2\n', 2 * 10 ** 18)
+        self.assertEqual(sorted(reloader.reload_changed()),
+                         ['tm_helpers', 'tm_spider'])
+        self.assertEqual(sys.modules['tm_spider'].price(), 2)
+        self.assertEqual(reloader.reload_changed(), [])
+
+
+class TestReplayServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, 'run', 'testmaster.sock')
+        self.tests_dir = os.path.join(self.tmp_dir, 'testmaster', 'tests')
+        os.makedirs(self.tests_dir)
+        self.server = ReplayServer(self.socket_path, self.tmp_dir)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+        self.client = ReplayClient(self.socket_path, timeout=10)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            self.client.request('shutdown')
+        self.thread.join(10)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_requests(self):
+        self.assertTrue(self.client.is_running())
+        response = self.client.request('ping')
+        self.assertEqual(response['pid'], os.getpid())
+        self.assertEqual(response['reloaded'], [])
+
+        response = self.client.request('frobnicate')
+        self.assertFalse(response['ok'])
+        self.assertIn('frobnicate', response['error'])
+
+        response = self.client.request('replay', paths=[])
+        self.assertEqual(response['results'], [])
+
+    def test_private_socket(self):
+        self.assertEqual(
+            stat.S_IMODE(os.stat(os.path.dirname(self.socket_path)).st_mode), 0o700)
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+    def test_socket_dir_checked(self):
+        shared_dir = os.path.join(self.tmp_dir, 'shared')
+        os.mkdir(shared_dir)
+        os.chmod(shared_dir, 0o755)
+        with self.assertRaisesRegex(ValueError, 'mode 0700'):
+            ReplayServer(os.path.join(shared_dir, 'testmaster.sock'), self.tmp_dir)
+        linked_dir = os.path.join(self.tmp_dir, 'linked')
+        os.symlink(os.path.dirname(self.socket_path), linked_dir)
+        with self.assertRaisesRegex(ValueError, 'not a symlink'):
+            ReplayServer(os.path.join(linked_dir, 'other.sock'), self.tmp_dir)
+
+    def test_running_server_not_replaced(self):
+        with self.assertRaisesRegex(ValueError, 'already running'):
+            ReplayServer(self.socket_path, self.tmp_dir)
+        self.assertTrue(self.client.is_running())
+
+    def test_paths_outside_tests_dir(self):
+        outside = os.path.join(self.tests_dir, '..', '..', 'fixture1.bin')
+        for command, kwargs in [('inspect', {'path': outside}),
+                                ('replay', {'paths': [outside]}),
+                                ('update', {'paths': ['/etc']})]:
+            response = self.client.request(command, **kwargs)
+            self.assertFalse(response['ok'])
+            self.assertIn('is not in the tests dir', response['error'])
+        response = self.client.request('replay', paths=[self.tests_dir])
+        self.assertEqual(response['results'], [])
+
+    def test_shutdown(self):
+        self.assertTrue(self.client.request('shutdown')['ok'])
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertFalse(self.client.is_running())
+
+    def test_default_socket_path(self):
+        self.assertEqual(default_socket_path(self.tmp_dir),
+                         default_socket_path(self.tmp_dir + os.sep))
+        self.assertNotEqual(default_socket_path(self.tmp_dir),
+                            default_socket_path(self.tmp_dir + 'x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
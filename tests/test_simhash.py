@@ -0,0 +1,72 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+
+from scrapy_testmaster.simhash import (
+    NearDuplicateFilter,
+    hamming_distance,
+    response_text,
+    simhash
+)
+from scrapy_testmaster.utils_novel import write_json
+
+_random = random.Random(0)
+TEXT = ' '.join('word%d' % _random.randrange(500) for _ in range(1000))
+
+
+class TestSimHash(unittest.TestCase):
+    def test_near_duplicates_are_close(self):
+        a = simhash(TEXT)
+        b = simhash(TEXT + ' posted at 12:31')
+        c = simhash(' '.join('other%d' % i for i in range(400)))
+        self.assertLessEqual(hamming_distance(a, b), 3)
+        self.assertGreater(hamming_distance(a, c), 10)
+
+    def test_text_source(self):
+        body = b'<html><head><script>var x = 1;</script></head>' \
+               b'<body><p>Hello</p><style>p {}</style><p>world</p></body></html>'
+        response = HtmlResponse('http://example.com', body=body)
+        self.assertEqual(response_text(response, 'text').split(), ['Hello', 'world'])
+        self.assertIn('<script>', response_text(response, 'body'))
+
+
+class TestNearDuplicateFilter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(NearDuplicateFilter.from_settings(Settings()))
+
+    def test_index_persisted_in_view_json(self):
+        settings = Settings({'TESTMASTER_SIMHASH_DISTANCE': 3})
+        dedupe = NearDuplicateFilter.from_settings(settings)
+        fp = simhash(TEXT)
+        self.assertIsNone(dedupe.find_near_duplicate(self.dir, 'parse', fp))
+        dedupe.add('parse', 1, fp)
+        request = {'url': 'http://example.com', 'method': 'GET',
+                   'meta': {}, 'cb_kwargs': {}}
+        write_json(self.dir, request, [], 1, extra=dedupe.view_fields(fp))
+
+        fresh = NearDuplicateFilter.from_settings(settings)
+        near = simhash(TEXT + ' posted at 12:31')
+        self.assertEqual(fresh.find_near_duplicate(self.dir, 'parse', near), 1)
+
+    def test_index_survives_fixture_updates(self):
+        settings = Settings({'TESTMASTER_SIMHASH_DISTANCE': 3})
+        dedupe = NearDuplicateFilter.from_settings(settings)
+        fp = simhash(TEXT)
+        request = {'url': 'http://example.com', 'method': 'GET',
+                   'meta': {}, 'cb_kwargs': {}}
+        write_json(self.dir, request, [], 1, extra=dedupe.view_fields(fp))
+        # as `testmaster update` rewrites the fixture
+        write_json(self.dir, request, [], 1, extra={'status': 200})
+
+        fresh = NearDuplicateFilter.from_settings(settings)
+        self.assertEqual(fresh.find_near_duplicate(self.dir, 'parse', fp), 1)
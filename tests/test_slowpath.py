@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapy.settings import Settings
+
+from scrapy_testmaster.slowpath import (
+    CallbackTimer,
+    SlowResponses,
+    slow_fixtures_dir
+)
+from scrapy_testmaster.utils_novel import get_cb_settings
+
+
+def timer(wall):
+    t = CallbackTimer()
+    t.wall = wall
+    return t
+
+
+class TestSlowResponses(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.slow_dir = slow_fixtures_dir(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(SlowResponses.from_settings(Settings()))
+        slow = SlowResponses.from_settings(
+            Settings({'TESTMASTER_SLOW_FIXTURES': 2}))
+        self.assertEqual(slow.size, 2)
+
+    def test_keeps_the_slowest(self):
+        slow = SlowResponses(2)
+        self.assertEqual(slow.admit(self.slow_dir, 'parse', timer(0.05)), 1)
+        self.assertEqual(slow.admit(self.slow_dir, 'parse', timer(0.01)), 2)
+        # replaces the fastest one
+        self.assertEqual(slow.admit(self.slow_dir, 'parse', timer(0.03)), 2)
+        self.assertIsNone(slow.admit(self.slow_dir, 'parse', timer(0.02)))
+        self.assertEqual(slow.admit(self.slow_dir, 'parse', timer(0.1)), 2)
+        # one heap per callback
+        self.assertEqual(slow.admit(self.slow_dir, 'other', timer(0.001)), 1)
+
+    def test_seeded_from_view(self):
+        os.makedirs(self.slow_dir)
+        with open(os.path.join(self.slow_dir, 'view.json'), 'w') as f:
+            json.dump({'1': {'wall_ms': 40}, '2': {'wall_ms': 10}}, f)
+        slow = SlowResponses(2)
+        self.assertIsNone(slow.admit(self.slow_dir, 'parse', timer(0.005)))
+        self.assertEqual(slow.admit(self.slow_dir, 'parse', timer(0.02)), 2)
+
+    def test_timer(self):
+        with CallbackTimer() as t:
+            sum(range(10000))
+        self.assertGreater(t.wall, 0)
+        self.assertGreaterEqual(t.cpu, 0)
+        fields = SlowResponses(1).view_fields(timer(0.0123))
+        self.assertEqual(fields['wall_ms'], 12.3)
+        self.assertTrue(fields['performance'])
+
+    def test_config_from_callback_dir(self):
+        with open(os.path.join(self.dir, 'config.py'), 'w') as f:
+            f.write('SKIPPED_FIELDS = ["a"]\n')
+        os.makedirs(self.slow_dir)
+        config = get_cb_settings(self.slow_dir)
+        self.assertEqual(config.SKIPPED_FIELDS, ['a'])
@@ -0,0 +1,59 @@
+import re
+import sys
+import subprocess
+import unittest
+
+# Import budget for the CLI modules the metadata commands (inspect, clear,
+# establish) run with, on top of the interpreter's own startup
+CLI_IMPORT_BUDGET_MS = 100
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+# {module: cumulative import time in us} for the modules imported by `code`
+# in a fresh interpreter
+def import_times(code):
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.PIPE, check=True, universal_newlines=True).stderr
+    times = {}
+    for line in output.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def format_slowest(times, count=10):
+    return '\n'.join('%8d us  %s' % (us, name) for name, us in sorted(
+        times.items(), key=lambda entry: -entry[1])[:count])
+
+
+# -X importtime is new in Python 3.7
+@unittest.skipIf(sys.version_info < (3, 7), 'needs -X importtime')
+class TestStartup(unittest.TestCase):
+    def test_cli_does_without_scrapy(self):
+        times = import_times(
+            'import scrapy_testmaster.cli, scrapy_testmaster.pytest_plugin')
+        for module in ('scrapy', 'twisted', 'datadiff', 'scrapy_testmaster.utils'):
+            self.assertNotIn(module, times, format_slowest(times))
+
+        cli_ms = times['scrapy_testmaster.cli'] / 1000
+        self.assertLess(cli_ms, CLI_IMPORT_BUDGET_MS, format_slowest(times))
+
+    def test_middleware_imports(self):
+        times = import_times('from scrapy_testmaster import TestMasterMiddleware')
+        self.assertIn('scrapy_testmaster.middleware', times)
+        # only needed by `testmaster update`, replays or the sqlite storage
+        for module in ('scrapy_testmaster.drift', 'concurrent.futures.process',
+                       'datadiff', 'sqlite3'):
+            self.assertNotIn(module, times)
+
+    def test_package_import_is_lazy(self):
+        times = import_times('import scrapy_testmaster')
+        self.assertNotIn('scrapy_testmaster.middleware', times)
+        self.assertNotIn('scrapy', times)
+
+
+if __name__ == '__main__':
+    unittest.main()
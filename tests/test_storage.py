@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scrapy.settings import Settings
+
+from scrapy_testmaster.storage import (
+    FileStorage,
+    SqliteStorage,
+    SQLITE_FILENAME,
+    WorkerTask,
+    get_storage,
+    get_worker_storage
+)
+
+
+def fixture_data(url):
+    return {'request': {'url': url},
+            'response': {'status': 200, 'body': b'<html></html>'}}
+
+
+def _load_with_worker_storage(path):
+    return get_worker_storage().load(path)
+
+
+class StorageTestMixin(object):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = self.storage_cls(
+            Settings({'TESTMASTER_BASE_PATH': self.dir}))
+        self.spider_dir = os.path.join(self.dir, 'tests', 'spider')
+        self.test_dir = os.path.join(self.spider_dir, 'parse')
+        os.makedirs(self.test_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, num, test_dir=None):
+        return os.path.join(test_dir or self.test_dir, 'fixture%d.bin' % num)
+
+    def save(self, num, test_dir=None):
+        self.storage.save(self.path(num, test_dir), b'blob%d' % num,
+                          fixture_data('http://example.com/%d' % num))
+
+    def test_save_load(self):
+        self.assertFalse(self.storage.exists(self.path(1)))
+        self.save(1)
+        self.assertTrue(self.storage.exists(self.path(1)))
+        self.assertEqual(self.storage.load(self.path(1)), b'blob1')
+        self.assertEqual(self.storage.size(self.path(1)), 5)
+
+    def test_list_and_count(self):
+        other_dir = os.path.join(self.spider_dir, 'parse_next')
+        os.makedirs(other_dir)
+        for num in (10, 2, 1):
+            self.save(num)
+        self.save(1, other_dir)
+        self.assertEqual(self.storage.count(self.test_dir), 3)
+        self.assertEqual(
+            list(self.storage.iter_paths(self.test_dir, recursive=False)),
+            [self.path(1), self.path(2), self.path(10)])
+        self.assertEqual(
+            list(self.storage.iter_paths(self.spider_dir)),
+            [self.path(1), self.path(2), self.path(10), self.path(1, other_dir)])
+
+    def test_list_callback_subdirs(self):
+        test_dir = os.path.join(self.spider_dir, 'parse_item')
+        slow_dir = os.path.join(test_dir, 'slow')
+        other_dir = os.path.join(self.spider_dir, 'parseXitem', 'slow')
+        for path in (slow_dir, other_dir):
+            os.makedirs(path)
+        for path in (test_dir, slow_dir, other_dir):
+            self.save(1, path)
+        self.assertEqual(list(self.storage.iter_paths(test_dir)),
+                         [self.path(1, test_dir), self.path(1, slow_dir)])
+
+    def test_delete_rename(self):
+        self.save(1)
+        self.save(2)
+        self.storage.delete(self.path(1))
+        self.storage.rename(self.path(2), self.path(1))
+        self.assertEqual(list(self.storage.iter_paths(self.test_dir)),
+                         [self.path(1)])
+        self.assertEqual(self.storage.load(self.path(1)), b'blob2')
+
+
+class TestFileStorage(StorageTestMixin, unittest.TestCase):
+    storage_cls = FileStorage
+
+
+class TestSqliteStorage(StorageTestMixin, unittest.TestCase):
+    storage_cls = SqliteStorage
+
+    def test_single_file_per_spider(self):
+        self.save(1)
+        self.assertEqual(sorted(os.listdir(self.spider_dir)),
+                         [SQLITE_FILENAME, 'parse'])
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+    def test_resave_keeps_created_at(self):
+        self.save(1)
+        conn = self.storage._connect(self.spider_dir)
+        conn.execute('UPDATE fixtures SET created_at = 1')
+        conn.commit()
+        self.storage.save(self.path(1), b'blob', fixture_data('http://example.com/'))
+        self.assertEqual(self.storage.load(self.path(1)), b'blob')
+        self.assertEqual(conn.execute(
+            'SELECT created_at, url FROM fixtures').fetchall(),
+            [(1, 'http://example.com/')])
+
+    def test_forked_process_reconnects(self):
+        self.save(1)
+        conn = self.storage._connect(self.spider_dir)
+        self.storage._pid = -1  # as if the storage came from the parent
+        self.assertEqual(self.storage.load(self.path(1)), b'blob1')
+        self.assertIsNot(self.storage._connect(self.spider_dir), conn)
+
+    def test_worker_task(self):
+        settings = Settings({'TESTMASTER_BASE_PATH': self.dir,
+                             'TESTMASTER_STORAGE': 'sqlite'})
+        self.save(1)
+        task = WorkerTask(_load_with_worker_storage, settings)
+        self.assertEqual(task(self.path(1)), b'blob1')
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage(Settings()), FileStorage)
+        settings = Settings({'TESTMASTER_STORAGE': 'sqlite'})
+        self.assertIsInstance(get_storage(settings), SqliteStorage)
@@ -1,9 +1,15 @@
 import unittest
+from unittest import mock
 
+import os
 import copy
+import shutil
 import datetime
+import tempfile
 
-from scrapy_testmaster.utils import clean_item, clean_request
+from scrapy_testmaster import utils
+from scrapy_testmaster.utils import PeakMemory, clean_item, clean_request
+from scrapy_testmaster.utils_novel import read_seen_counts, write_seen_counts
 from .shared import Settings
 
 
@@ -83,3 +89,40 @@ class TestUtils(unittest.TestCase):
                     }
                 }
             })
+
+
+class TestPeakMemory(unittest.TestCase):
+    def test_peak(self):
+        with PeakMemory() as memory:
+            big = bytearray(4 * 1024 * 1024)
+            del big
+        self.assertGreaterEqual(memory.peak, 4 * 1024 * 1024)
+        with PeakMemory(active=False) as memory:
+            big = bytearray(4 * 1024 * 1024)
+            del big
+        self.assertEqual(memory.peak, 0)
+
+    def test_already_tracing_without_reset_peak(self):
+        tracemalloc = mock.Mock(
+            spec=['is_tracing', 'start', 'stop', 'get_traced_memory'])
+        tracemalloc.is_tracing.return_value = True
+        with mock.patch.object(utils, 'tracemalloc', tracemalloc):
+            with self.assertRaisesRegex(RuntimeError, 'Python 3.9'):
+                with PeakMemory():
+                    pass
+
+
+class TestSeenCounts(unittest.TestCase):
+    def test_concurrent_crawls_add_up(self):
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        self.assertEqual(read_seen_counts(base_dir), {})
+
+        write_seen_counts(base_dir, {}, {'parse': 4})
+        initial = read_seen_counts(base_dir)
+        # another crawl started from the same counts finishes first
+        write_seen_counts(base_dir, initial, {'parse': 6, 'parse_item': 1})
+        write_seen_counts(base_dir, initial, {'parse': 5})
+        self.assertEqual(read_seen_counts(base_dir),
+                         {'parse': 7, 'parse_item': 1})
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(base_dir)))
@@ -0,0 +1,121 @@
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import importlib
+import unittest
+
+from scrapy_testmaster.watch import (
+    affected_callbacks,
+    find_callback_dirs,
+    module_fingerprint
+)
+
+from .test_record import CaseSpider, check_process, run
+
+SPIDER = '''
+import scrapy
+
+
+def helper():
+    return {helper}
+
+
+class MySpider(scrapy.Spider):
+    name = 'tm_watch'
+
+    def parse(self, response):
+        yield {{'a': {parse}}}
+
+    def parse_item(self, response):
+        yield {{'b': {parse_item}}}
+'''
+
+
+class TestAffectedCallbacks(unittest.TestCase):
+    def setUp(self):
+        self.project_dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.project_dir)
+        self.callbacks = {'parse': '', 'parse_item': ''}
+
+    def tearDown(self):
+        sys.path.remove(self.project_dir)
+        sys.modules.pop('tm_watch_spider', None)
+        shutil.rmtree(self.project_dir)
+
+    def fingerprint(self, header='', **values):
+        source = dict({'helper': 1, 'parse': 1, 'parse_item': 1}, **values)
+        path = os.path.join(self.project_dir, 'tm_watch_spider.py')
+        with open(path, 'w') as f:
+            f.write(header + SPIDER.format(**source))
+        importlib.invalidate_caches()
+        if 'tm_watch_spider' in sys.modules:
+            module = importlib.reload(sys.modules['tm_watch_spider'])
+        else:
+            module = importlib.import_module('tm_watch_spider')
+        return {'tm_watch_spider': module_fingerprint(module)}
+
+    def test_only_changed_callbacks(self):
+        before = self.fingerprint()
+        after = self.fingerprint(header='# moves everything down\n\n', parse_item=2)
+        self.assertEqual(affected_callbacks(before, after, self.callbacks),
+                         {'parse_item'})
+
+    def test_unchanged(self):
+        before = self.fingerprint()
+        after = self.fingerprint(header='# only a comment\n')
+        self.assertEqual(affected_callbacks(before, after, self.callbacks), set())
+
+    def test_other_changes_affect_all(self):
+        before = self.fingerprint()
+        after = self.fingerprint(helper=2, parse=2)
+        self.assertEqual(affected_callbacks(before, after, self.callbacks),
+                         {'parse', 'parse_item'})
+
+
+class TestFindCallbackDirs(unittest.TestCase):
+    def test_callback_dirs(self):
+        spider_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spider_dir)
+        for name in ('parse', 'parse_item', '__pycache__'):
+            os.makedirs(os.path.join(spider_dir, 'extra', name))
+        open(os.path.join(spider_dir, 'extra', '__init__.py'), 'w').close()
+
+        self.assertEqual(sorted(find_callback_dirs(spider_dir, 'extra')),
+                         ['parse', 'parse_item'])
+        self.assertEqual(find_callback_dirs(spider_dir, 'extra', 'parse'),
+                         {'parse': os.path.join(spider_dir, 'extra', 'parse')})
+        self.assertEqual(find_callback_dirs(spider_dir), {'extra': os.path.join(spider_dir, 'extra')})
+
+
+REPLAY_TWICE = '''
+import sys
+from scrapy_testmaster.watch import Watcher, find_callback_dirs
+watcher = Watcher(find_callback_dirs('testmaster/tests/myspider'), 'myproject')
+watcher.poll()
+sys.exit(watcher.replay(['parse']) + watcher.replay(['parse']))
+'''
+
+
+class TestWatcher(unittest.TestCase):
+    def test_replays_dont_share_fixture_data(self):
+        with CaseSpider() as spider:
+            spider.set_init('self.seen = []')
+            spider.start_requests("yield scrapy.Request('data:text/plain,')")
+            spider.parse("""
+                self.seen.append(1)
+                yield {'a': len(self.seen)}
+            """)
+            spider.record()
+            env = os.environ.copy()
+            env['PYTHONPATH'] = spider.dir
+            env['SCRAPY_SETTINGS_MODULE'] = 'myproject.settings'
+            result = run([sys.executable, '-c', REPLAY_TWICE], env=env,
+                         cwd=spider.dir, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+            check_process('Replaying the fixture twice failed!', result)
+
+
+if __name__ == '__main__':
+    unittest.main()